@@ -0,0 +1,38 @@
+"""
+pyxform command line tools:
+
+    python -m pyxform serve [--port N | --socket PATH] [--workers N]
+"""
+import argparse
+
+from pyxform import server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m pyxform")
+    commands = parser.add_subparsers(dest="command")
+    serve = commands.add_parser(
+        "serve", help="Convert XLSForms posted to a local HTTP server.")
+    serve.add_argument(
+        "--port", type=int, default=8000,
+        help="Port to listen on at --host (default: 8000).")
+    serve.add_argument(
+        "--host", default="127.0.0.1",
+        help="Address to listen on (default: 127.0.0.1).")
+    serve.add_argument(
+        "--socket",
+        help="Listen on this unix socket instead of a port.")
+    serve.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of forms converted at once (default: one per cpu).")
+    serve.add_argument(
+        "--timeout", type=int, default=server.CONVERSION_TIMEOUT,
+        help="Seconds a single conversion may take.")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server.serve(port=args.port, host=args.host, socket_path=args.socket,
+                     workers=args.workers, timeout=args.timeout)
+
+
+main()
@@ -1,5 +1,4 @@
 import os
-import copy
 
 import utils
 import file_utils
@@ -10,6 +9,7 @@ from survey import Survey
 from xls2json import SurveyReader
 from question_type_dictionary import QUESTION_TYPE_DICT
 from errors import PyXFormError
+from choices import ChoiceList
 from pyxform import constants
 from pyxform import aliases
 
@@ -55,6 +55,8 @@ class SurveyElementBuilder(object):
 
     def __init__(self, **kwargs):
         self._add_none_option = False #I don't know why we would need an explicit none option for select alls
+        self._shared_choices = kwargs.get(u"shared_choices", False)
+        self._shared_choice_lists = None
         self.set_sections(
             kwargs.get(u"sections", {})
             )
@@ -76,6 +78,8 @@ class SurveyElementBuilder(object):
         """
         if u"add_none_option" in element_dict:
             self._add_none_option = element_dict[u"add_none_option"]
+        if u"shared_choices" in element_dict:
+            self._shared_choices = element_dict[u"shared_choices"]
         if element_dict[u"type"] in self.SECTION_CLASSES:
             return self._create_section_from_dict(element_dict)
         elif element_dict[u"type"] == u"loop":
@@ -89,25 +93,28 @@ class SurveyElementBuilder(object):
             full_survey = self.create_survey_element_from_dict(element_dict)
             return full_survey.children
         else:
-            question_type_dict_copy= copy_json_dict(QUESTION_TYPE_DICT) # FIXME: Why do we need a copy of this?
-            return self._create_question_from_dict(element_dict, question_type_dict_copy, self._add_none_option)
+            # The question type dictionary is only read, questions merge
+            # their own bind and control values over it when they are used.
+            return self._create_question_from_dict(
+                element_dict, QUESTION_TYPE_DICT, self._add_none_option,
+                self._shared_choice_lists)
 
     @staticmethod
-    def _create_question_from_dict(question_dict, question_type_dictionary, add_none_option=False):
+    def _create_question_from_dict(question_dict, question_type_dictionary, add_none_option=False, shared_choice_lists=None):
         question_type_str = question_dict[constants.TYPE]
         question_dict_copy = question_dict.copy()
         
         # TODO: Keep add none option?
         if add_none_option and question_type_str.startswith(u"select all that apply"):
-            SurveyElementBuilder._add_none_option_to_select_all_that_apply(question_dict_copy)
+            SurveyElementBuilder._add_none_option_to_select_all_that_apply(question_dict_copy, shared_choice_lists)
 
         # Handle or_other on select type questions
         or_other_str = u" or specify other"
         if question_type_str.endswith(or_other_str):
             question_type_str = question_type_str[:len(question_type_str) - len(or_other_str)]
             question_dict_copy["type"] = question_type_str
-            SurveyElementBuilder._add_other_option_to_multiple_choice_question(question_dict_copy)
-            return [SurveyElementBuilder._create_question_from_dict(question_dict_copy, question_type_dictionary, add_none_option),
+            SurveyElementBuilder._add_other_option_to_multiple_choice_question(question_dict_copy, shared_choice_lists)
+            return [SurveyElementBuilder._create_question_from_dict(question_dict_copy, question_type_dictionary, add_none_option, shared_choice_lists),
                     SurveyElementBuilder._create_specify_other_question_from_dict(question_dict_copy)]
         
         question_class = SurveyElementBuilder._get_question_class(question_type_str, question_type_dictionary)
@@ -117,43 +124,59 @@ class SurveyElementBuilder(object):
             question_type_str= aliases.multiple_choice[question_type_str]
             question_dict_copy["type"] = question_type_str
             
-        # todo: clean up this spaghetti code
-        question_dict_copy[u"question_type_dictionary"] = question_type_dictionary
+        if shared_choice_lists is not None and \
+                question_class is MultipleChoiceQuestion:
+            shared_choice_lists.use(question_dict_copy)
+
         if question_class:
             return question_class(**question_dict_copy)
         return []
     
     @staticmethod
-    def _add_other_option_to_multiple_choice_question(question_dict):
+    def _add_other_option_to_multiple_choice_question(question_dict, shared_choice_lists=None):
         # ideally, we'question_dict just be pulling from children
-        choice_list = question_dict.get(u"choices", question_dict.get(u"children", []))
+        choices_key = u"choices" if u"choices" in question_dict else u"children"
+        choice_list = question_dict.get(choices_key, [])
         if len(choice_list) <= 0:
             raise PyXFormError("There should be choices for this question.")
         other_choice = {
             constants.NAME: u"other",
             u"label": u"Other",
             }
+        # the choice list can be shared with other questions, it is replaced
+        # rather than changed
         if other_choice not in choice_list:
-            choice_list.append(other_choice)
+            question_dict[choices_key] = SurveyElementBuilder._add_choice(
+                choice_list, other_choice, shared_choice_lists)
 
     @staticmethod
-    def _add_none_option_to_select_all_that_apply(question_dict_copy):
-        choice_list = question_dict_copy.get(u"choices", question_dict_copy.get(u"children", []))
+    def _add_none_option_to_select_all_that_apply(question_dict_copy, shared_choice_lists=None):
+        choices_key = u"choices" if u"choices" in question_dict_copy else u"children"
+        choice_list = question_dict_copy.get(choices_key, [])
         if len(choice_list) <= 0:
             raise PyXFormError("There should be choices for this question.")
         none_choice = {
             constants.NAME: u"none",
             u"label": u"None",
             }
+        # the choice list and bind can be shared with other questions, they
+        # are replaced rather than changed
         if none_choice not in choice_list:
-            choice_list.append(none_choice)
+            question_dict_copy[choices_key] = SurveyElementBuilder._add_choice(
+                choice_list, none_choice, shared_choice_lists)
             none_constraint = u"(.='none' or not(selected(., 'none')))"
-            if constants.BIND not in question_dict_copy:
-                question_dict_copy[constants.BIND] = {}
-            if u"constraint" in question_dict_copy[constants.BIND]:
-                question_dict_copy[constants.BIND][u"constraint"] += " and " + none_constraint
+            bind = question_dict_copy.get(constants.BIND, {}).copy()
+            if u"constraint" in bind:
+                bind[u"constraint"] += " and " + none_constraint
             else:
-                question_dict_copy[constants.BIND][u"constraint"] = none_constraint
+                bind[u"constraint"] = none_constraint
+            question_dict_copy[constants.BIND] = bind
+
+    @staticmethod
+    def _add_choice(choice_list, choice, shared_choice_lists=None):
+        if shared_choice_lists is not None:
+            return shared_choice_lists.with_choice(choice_list, choice)
+        return choice_list + [choice]
 
     @staticmethod
     def _get_question_class(question_type_str, question_type_dictionary):
@@ -189,15 +212,23 @@ class SurveyElementBuilder(object):
         section_class = self.SECTION_CLASSES[section_dict_copy[u"type"]]
         if section_dict[u'type'] == u'survey' and constants.TITLE not in section_dict:
             section_dict_copy[constants.TITLE] = section_dict[constants.NAME]
-        result = section_class(**section_dict_copy)
-        for child in children:
-            #Deep copying the child is a hacky solution to the or_other bug.
-            #I don't know why it works.
-            #And I hope it doesn't break something else.
-            #I think the good solution would be to rewrite this class.
-            survey_element = self.create_survey_element_from_dict(copy.deepcopy(child))
-            if survey_element:
-                result.add_children(survey_element)
+        shared_choice_lists = None
+        # surveys that are included in another one don't share their lists
+        if section_dict[u'type'] == u'survey' and self._shared_choices and \
+                self._shared_choice_lists is None:
+            shared_choice_lists = SharedChoiceLists(section_dict)
+            self._shared_choice_lists = shared_choice_lists
+        try:
+            result = section_class(**section_dict_copy)
+            for child in children:
+                survey_element = self.create_survey_element_from_dict(child)
+                if survey_element:
+                    result.add_children(survey_element)
+        finally:
+            if shared_choice_lists is not None:
+                self._shared_choice_lists = None
+        if shared_choice_lists is not None and shared_choice_lists.choices:
+            result[constants.CHOICES] = shared_choice_lists.choices
         return result
 
     def _create_loop_from_dict(self, d, group_each_iteration=True):
@@ -253,11 +284,131 @@ class SurveyElementBuilder(object):
         return self.create_survey_element_from_dict(d)
 
 
-def create_survey_element_from_dict(d, sections={}):
+class SharedChoiceLists(object):
+    """
+    The choice lists used by more than one select question of a survey.
+    Rather than every question getting its own options, the questions
+    reference the list by name through an itemset and the list is kept
+    once in the survey choices, which are emitted as secondary instances
+    (see Survey._generate_static_instances) and serialized once in the
+    json. The lists are shared, so they must not be changed.
+    Lists are told apart by identity, like the lists workbook_to_json
+    gives to all the selects of a list name.
+    """
+
+    OR_OTHER = u" or specify other"
+
+    def __init__(self, survey_dict):
+        # the choices of the selects with a choice filter are in there
+        self.choices = dict(survey_dict.get(constants.CHOICES) or {})
+        self._names = dict((id(choice_list), name)
+                           for name, choice_list in self.choices.items())
+        self._uses = {}
+        self._with_choice = {}
+        self._count_uses(survey_dict.get(constants.CHILDREN, []))
+
+    def _count_uses(self, children):
+        for child in children:
+            question_type = child.get(constants.TYPE, u"")
+            if question_type in (u"group", u"repeat"):
+                self._count_uses(child.get(constants.CHILDREN, []))
+                continue
+            choice_list = self._choice_list(child)
+            key = id(choice_list)
+            # an or_other select uses the list with the other choice added
+            if question_type.endswith(self.OR_OTHER):
+                question_type = question_type[:-len(self.OR_OTHER)]
+                key = (key, u"other")
+            question_class = SurveyElementBuilder._get_question_class(
+                question_type, QUESTION_TYPE_DICT)
+            if question_class is MultipleChoiceQuestion and choice_list:
+                self._uses[key] = self._uses.get(key, 0) + 1
+
+    @staticmethod
+    def _choice_list(question_dict):
+        if question_dict.get(constants.ITEMSET_XFORM) or \
+                (constants.CHOICES in question_dict and
+                 constants.CHILDREN in question_dict):
+            return None
+        return question_dict.get(constants.CHOICES) or \
+            question_dict.get(constants.CHILDREN)
+
+    def is_shared(self, choice_list):
+        return self._uses.get(id(choice_list), 0) > 1
+
+    @staticmethod
+    def _translated_choice(choice_list, choice):
+        """
+        Returns choice with its label given in every language the labels of
+        choice_list are translated to. The labels of a shared list are all
+        written to the itext, where a plain label is only in the default
+        language.
+        """
+        label = choice.get(u"label")
+        if not isinstance(label, basestring):
+            return choice
+        languages = set()
+        for other_choice in choice_list:
+            other_label = other_choice.get(u"label")
+            if isinstance(other_label, dict):
+                languages.update(other_label.keys())
+        if not languages:
+            return choice
+        choice = dict(choice)
+        choice[u"label"] = dict((language, label) for language in languages)
+        return choice
+
+    def with_choice(self, choice_list, choice):
+        """
+        Returns choice_list with choice added, the same list every time
+        if it is used by several selects.
+        """
+        key = (id(choice_list), choice[constants.NAME])
+        if self._uses.get(key, 0) < 2:
+            return choice_list + [choice]
+        result = self._with_choice.get(key)
+        if result is None:
+            list_name = self._names.get(id(choice_list)) or \
+                getattr(choice_list, "list_name", None)
+            if list_name:
+                list_name = u"%s_%s" % (list_name, choice[constants.NAME])
+            result = ChoiceList(
+                choice_list + [self._translated_choice(choice_list, choice)],
+                list_name)
+            self._with_choice[key] = result
+            self._uses[id(result)] = self._uses[key]
+        return result
+
+    def use(self, question_dict):
+        """
+        Make the select question_dict use its choice list through an
+        itemset if the list is shared.
+        """
+        choice_list = self._choice_list(question_dict)
+        if not choice_list or not self.is_shared(choice_list):
+            return
+        name = self._names.get(id(choice_list))
+        if name is None:
+            name = getattr(choice_list, "list_name", None) or \
+                question_dict[constants.NAME]
+            unique_name, number = name, 1
+            while unique_name in self.choices:
+                number += 1
+                unique_name = u"%s_%d" % (name, number)
+            name = self._names[id(choice_list)] = unique_name
+            self.choices[name] = choice_list
+        question_dict.pop(constants.CHOICES, None)
+        question_dict.pop(constants.CHILDREN, None)
+        question_dict[constants.ITEMSET_XFORM] = name
+
+
+def create_survey_element_from_dict(d, sections={}, shared_choices=False):
     """
     Creates a Survey from a dictionary in the format provided by SurveyReader
+    shared_choices -- emit the choice lists used by several selects once,
+    see SharedChoiceLists.
     """
-    builder = SurveyElementBuilder()
+    builder = SurveyElementBuilder(shared_choices=shared_choices)
     builder.set_sections(sections)
     return builder.create_survey_element_from_dict(d)
 
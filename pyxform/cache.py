@@ -0,0 +1,219 @@
+"""
+A content-addressed cache for XForm conversions.
+
+Entries are keyed on a hash of the input (the XLSForm bytes or the survey
+json), the pyxform version and the options that change the output, so an
+unchanged form can skip parsing, building, rendering and ODK Validate.
+
+Usage::
+
+    from pyxform.cache import ConversionCache, DirectoryStore
+    cache = ConversionCache(DirectoryStore("/var/cache/pyxform"))
+    xls2xform_convert("form.xlsx", "form.xml", cache=cache)
+    print cache.stats()
+"""
+import codecs
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import pyxform
+
+
+def make_entry(xform, warnings=None, itemsets=None):
+    """
+    Build a cache entry.
+    xform -- the generated XForm (unicode)
+    warnings -- the warnings produced while converting the form
+    itemsets -- the contents of itemsets.csv (str) or None
+    """
+    return {
+        u"xform": xform,
+        u"warnings": list(warnings or []),
+        u"itemsets": itemsets,
+    }
+
+
+def _entry_size(entry):
+    return len(entry[u"xform"]) + len(entry[u"itemsets"] or "")
+
+
+class MemoryStore(object):
+    """
+    Keep entries in memory, evicting the least recently used ones once
+    there are more than max_entries entries or their xforms and itemsets
+    add up to more than max_bytes.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self._size -= _entry_size(old_entry)
+            self._entries[key] = entry
+            self._size += _entry_size(entry)
+            while len(self._entries) > 1 and (
+                    (self.max_entries is not None and
+                     len(self._entries) > self.max_entries) or
+                    (self.max_bytes is not None and
+                     self._size > self.max_bytes)):
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= _entry_size(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DirectoryStore(object):
+    """
+    Keep entries as json files in a directory so they survive restarts
+    and can be shared between processes.
+    Reading an entry refreshes its modification time; when the directory
+    holds more than max_entries entries or more than max_bytes bytes the
+    entries that were used the longest time ago are removed.
+    """
+
+    suffix = u".json"
+
+    def __init__(self, directory, max_entries=None, max_bytes=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with codecs.open(path, mode="r", encoding="utf-8") as fp:
+                entry = json.load(fp)
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry[u"itemsets"] is not None:
+            entry[u"itemsets"] = entry[u"itemsets"].encode("utf-8")
+        return entry
+
+    def set(self, key, entry):
+        entry = dict(entry)
+        if entry[u"itemsets"] is not None:
+            entry[u"itemsets"] = entry[u"itemsets"].decode("utf-8")
+        # write to a temporary file first so readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=u".tmp")
+        with codecs.getwriter("utf-8")(os.fdopen(fd, "w")) as fp:
+            json.dump(entry, fp, ensure_ascii=False)
+        os.rename(tmp_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        if self.max_entries is None and self.max_bytes is None:
+            return
+        with self._lock:
+            files = []
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith(self.suffix):
+                    continue
+                path = os.path.join(self.directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            total_size = sum([size for _, size, _ in files])
+            while len(files) > 1 and (
+                    (self.max_entries is not None and
+                     len(files) > self.max_entries) or
+                    (self.max_bytes is not None and
+                     total_size > self.max_bytes)):
+                _, size, path = files.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total_size -= size
+                self.evictions += 1
+
+    def clear(self):
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(self.suffix):
+                os.remove(os.path.join(self.directory, file_name))
+
+    def __len__(self):
+        return len([file_name for file_name in os.listdir(self.directory)
+                    if file_name.endswith(self.suffix)])
+
+
+class ConversionCache(object):
+    """
+    Look up and store conversion results in a storage backend
+    (MemoryStore by default) and count hits and misses.
+    """
+
+    def __init__(self, store=None):
+        if store is None:
+            store = MemoryStore()
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, data, **options):
+        """
+        Return the key for the input data (a str) converted with the
+        given options.
+        """
+        digest = hashlib.sha256()
+        digest.update(pyxform.__version__)
+        digest.update("\0")
+        digest.update(json.dumps(options, sort_keys=True))
+        digest.update("\0")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = self.store.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, entry):
+        self.store.set(key, entry)
+
+    def stats(self):
+        return {
+            u"hits": self.hits,
+            u"misses": self.misses,
+            u"entries": len(self.store),
+            u"evictions": self.store.evictions,
+        }
@@ -0,0 +1,138 @@
+"""
+The choice lists of a form: the rows of the choices sheet grouped by
+list name.
+"""
+from pyxform import constants
+
+# the list methods that change its items
+CHANGING_METHODS = ["append", "extend", "insert", "remove", "pop", "sort",
+                    "reverse", "__setitem__", "__delitem__", "__setslice__",
+                    "__delslice__", "__iadd__", "__imul__"]
+
+
+class ChoiceList(list):
+    """
+    The choices (dicts) of one list name, in the order of the choices
+    sheet. The same ChoiceList is shared by every select using the list.
+
+    Besides the choices it holds an index of the choice names and the
+    counts the choices sheet checks need, built on first use and again
+    after the list changes. Changes to the choice dicts themselves are
+    not noticed.
+    """
+
+    def __init__(self, choices=(), list_name=None):
+        list.__init__(self, choices)
+        self.list_name = list_name
+        self._index = None
+
+    def __getstate__(self):
+        return {"list_name": self.list_name, "_index": None}
+
+    def _get_index(self):
+        if self._index is None:
+            index = {"names": {}, "names_with_spaces": [], "unnamed": 0,
+                     "unlabelled": 0, "headers": set(),
+                     "duplicate_names": False}
+            names = index["names"]
+            for position, choice in enumerate(self):
+                index["headers"].update(choice)
+                name = choice.get(constants.NAME)
+                if constants.NAME not in choice:
+                    index["unnamed"] += 1
+                elif isinstance(name, basestring):
+                    if name in names:
+                        index["duplicate_names"] = True
+                    else:
+                        names[name] = position
+                    if u" " in name:
+                        index["names_with_spaces"].append(name)
+                if constants.LABEL not in choice:
+                    index["unlabelled"] += 1
+            self._index = index
+        return self._index
+
+    @property
+    def names(self):
+        """
+        A dict of the position of the first choice with each name.
+        """
+        return self._get_index()["names"]
+
+    @property
+    def names_with_spaces(self):
+        """
+        The choice names with spaces, which select_multiple can't use.
+        """
+        return self._get_index()["names_with_spaces"]
+
+    @property
+    def unnamed(self):
+        """
+        The number of choices without a name.
+        """
+        return self._get_index()["unnamed"]
+
+    @property
+    def unlabelled(self):
+        """
+        The number of choices without a label.
+        """
+        return self._get_index()["unlabelled"]
+
+    @property
+    def headers(self):
+        """
+        The set of the columns used by the choices.
+        """
+        return self._get_index()["headers"]
+
+    def get_choice(self, name, default=None):
+        """
+        Return the first choice named name.
+        """
+        position = self.names.get(name)
+        if position is None:
+            return default
+        return self[position]
+
+    def __contains__(self, choice):
+        # look a choice up by its name instead of comparing it to them all
+        name = choice.get(constants.NAME) if isinstance(choice, dict) \
+            else None
+        if not isinstance(name, basestring) or \
+                self._get_index()["duplicate_names"]:
+            return list.__contains__(self, choice)
+        return self.get_choice(name) == choice
+
+
+def _changes_list(method):
+    def changing_method(self, *args, **kwargs):
+        self._index = None
+        return method(self, *args, **kwargs)
+    changing_method.__name__ = method.__name__
+    changing_method.__doc__ = method.__doc__
+    return changing_method
+
+
+for method_name in CHANGING_METHODS:
+    setattr(ChoiceList, method_name,
+            _changes_list(getattr(list, method_name)))
+
+
+def group_choice_lists(choices):
+    """
+    Group choice dicts (rows of the choices sheet) into a dict of
+    ChoiceLists by list name. The list name is removed from the choices.
+    """
+    choice_lists = dict()
+    for choice in choices:
+        if constants.LIST_NAME not in choice:
+            continue
+        list_name = choice.pop(constants.LIST_NAME)
+        choice_list = choice_lists.get(list_name)
+        if choice_list is None:
+            choice_list = choice_lists[list_name] = ChoiceList(
+                list_name=list_name)
+        choice_list.append(choice)
+    return choice_lists
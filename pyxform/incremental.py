@@ -0,0 +1,471 @@
+"""
+Compile a form again after changes to some rows of its sheets, doing only
+the work the changes need.
+
+compile_workbook converts a workbook dict (see xls2json.workbook_to_json)
+into a Survey that keeps what it was made from. recompile takes such a
+survey and a row-level diff of the sheets, and returns the survey of the
+changed workbook::
+
+    survey = compile_workbook(workbook_dict, u"data")
+    xform = survey.to_xml(validate=False)
+    survey = recompile(survey, {u"survey": [(UPDATE, 3, row)],
+                                u"choices": [(DELETE, 10)]})
+    xform = survey.to_xml(validate=False)
+
+The diff maps sheet names to a list of changes made in order, each one of
+(INSERT, index, row), (UPDATE, index, row) or (DELETE, index), the index
+counting the rows below the header from 0.
+
+The sheets are parsed again, as workbook_to_json checks rows against each
+other, but only the top level elements (questions, groups and repeats of
+the survey sheet) whose json changed are built again. The others are
+taken from the previous survey, along with the XForm text of their
+instance, bindings, body controls and itext, which is kept for as long as
+the xpaths of the ${names} they reference do not change. The time from an
+edit to the XForm then grows with the size of the change rather than with
+the size of the form.
+
+The elements of the previous survey are moved to the new one, so the
+previous survey should not be used any more, and compiled surveys should
+not be changed.
+"""
+from builder import SurveyElementBuilder, copy_json_dict
+from question import Question
+from section import Section
+from survey_element import SurveyElement, rendering_xml
+from substitution import tokenize
+from translations import TranslationTable
+from utils import node
+from xls2json import workbook_to_json
+from xml_writer import pretty_xml_fragment, to_pretty_xml, \
+    to_pretty_xml_with_fragments
+from errors import PyXFormError
+from pyxform import constants
+
+INSERT = u"insert"
+UPDATE = u"update"
+DELETE = u"delete"
+
+# the indentation of the parts of the XForm: the children of the main
+# instance, those of the model and the body controls
+INSTANCE_INDENT = u" " * 10
+MODEL_INDENT = u" " * 6
+BODY_INDENT = u" " * 4
+
+# the xpath of a name without a survey element
+_MISSING = object()
+
+
+def apply_changes(workbook_dict, changes):
+    """
+    Returns a copy of workbook_dict with changes (see above) made to its
+    sheets. The rows are not copied.
+    """
+    result = dict(workbook_dict)
+    for sheet_name, sheet_changes in changes.items():
+        rows = list(result.get(sheet_name, []))
+        for change in sheet_changes:
+            action, index = change[0], change[1]
+            size = len(rows) + 1 if action == INSERT else len(rows)
+            if action not in (INSERT, UPDATE, DELETE):
+                raise PyXFormError("Unknown change to the %s sheet: %s" %
+                                   (sheet_name, action))
+            if not 0 <= index < size:
+                raise PyXFormError("There is no row %s in the %s sheet." %
+                                   (index, sheet_name))
+            if action == INSERT:
+                rows.insert(index, change[2])
+            elif action == UPDATE:
+                rows[index] = change[2]
+            else:
+                del rows[index]
+        result[sheet_name] = rows
+    return result
+
+
+def _references(value, names):
+    """
+    Add the names of the ${name} references in the strings of a json value
+    to the set names.
+    """
+    if isinstance(value, dict):
+        for item in value.itervalues():
+            _references(item, names)
+    elif isinstance(value, list):
+        for item in value:
+            _references(item, names)
+    elif isinstance(value, basestring) and u"${" in value:
+        names.update(tokenize(value)[1::2])
+
+
+class _Part(object):
+    """
+    The elements made from the json of a top level element (a select
+    or_other makes two) and the XForm text made for them.
+    """
+
+    def __init__(self, source, elements):
+        self.source = source
+        self.elements = elements
+        self.context = None
+        self.references = None
+        self.reference_xpaths = None
+        self.fragments = {}
+
+    def prepare(self, survey, context):
+        """
+        Validate the elements and collect their xpaths, section names and
+        translations for the survey name and default language in context.
+        """
+        if self.context == context:
+            return
+        if self.context is None:
+            for element in self.elements:
+                element.validate()
+        descendants = [descendant for element in self.elements
+                       for descendant in element.iter_descendants()]
+        self.xpaths = [(e.name, e.get_xpath()) for e in descendants
+                       if isinstance(e, (Question, Section))]
+        self.section_names = [e.name for e in descendants
+                              if isinstance(e, Section)]
+        self.translations = [
+            (d['lang'], d['path'], d['text']) for e in descendants
+            for d in e.get_translations(survey.default_language)]
+        self.media = [media for e in descendants
+                      for media in survey._element_media(e)]
+        self.context = context
+        self.reference_xpaths = None
+        self.fragments = {}
+
+    def check(self, xpaths):
+        """
+        Forget the XForm text if an xpath it references changed.
+        """
+        if self.references is None:
+            names = set()
+            if self.source is not None:
+                _references(self.source, names)
+            else:
+                for element in self.elements:
+                    _references(element.to_json_dict(), names)
+            self.references = sorted(names)
+        reference_xpaths = [xpaths.get(name, _MISSING)
+                            for name in self.references]
+        if reference_xpaths != self.reference_xpaths:
+            self.reference_xpaths = reference_xpaths
+            self.fragments = {}
+
+    def _instance_nodes(self):
+        for element in self.elements:
+            if element.get(u"flat"):
+                for instance_node in element.xml_instance_array():
+                    yield instance_node
+            else:
+                yield element.xml_instance()
+
+    def _binding_nodes(self):
+        for element in self.elements:
+            for binding in element.xml_bindings():
+                yield binding
+
+    def _control_nodes(self):
+        for element in self.elements:
+            control = element.xml_control()
+            if control is not None:
+                yield control
+
+    def fragment(self, kind, indent):
+        """
+        Returns the text of the instance, binding or control nodes (kind),
+        u"" if there are none, or None if it can't be written separately.
+        """
+        key = (kind, indent)
+        if key not in self.fragments:
+            nodes = list(getattr(self, "_%s_nodes" % kind)())
+            self.fragments[key] = \
+                pretty_xml_fragment(nodes, indent) if nodes else u""
+        return self.fragments[key]
+
+
+class Compilation(object):
+    """
+    A workbook and the survey compiled from it, see compile_workbook.
+    """
+
+    def __init__(self, workbook_dict, form_name=None,
+                 default_language=u"default", warnings=None, previous=None):
+        self.workbook_dict = workbook_dict
+        self.form_name = form_name
+        self.default_language = default_language
+        # workbook_to_json changes the rows and the workbook dict
+        workbook_copy = dict(
+            (sheet_name, copy_json_dict(rows))
+            for sheet_name, rows in workbook_dict.items())
+        json_dict = workbook_to_json(workbook_copy, form_name,
+                                     default_language, warnings)
+        self.survey_json = dict(json_dict)
+        children = self.survey_json.pop(constants.CHILDREN, [])
+        # the choices of filtered selects are written with the survey
+        # while the others are part of each select's json
+        self.survey_json.pop(constants.CHOICES, None)
+        builder = SurveyElementBuilder()
+        if json_dict.get(u"shared_choices"):
+            # the shared lists depend on all the selects of the survey
+            self.survey = builder.create_survey_element_from_dict(json_dict)
+            self.parts = [_Part(None, [child])
+                          for child in self.survey.children]
+        else:
+            self.survey = builder.create_survey_element_from_dict(
+                dict(json_dict, children=[]))
+            self.parts = []
+            reusable = {}
+            if previous is not None and \
+                    previous.survey_json == self.survey_json:
+                for part in previous.parts:
+                    if part.source is not None:
+                        reusable.setdefault(
+                            part.source.get(constants.NAME), part)
+            for child in children:
+                part = reusable.pop(child.get(constants.NAME), None)
+                if part is None or part.source != child:
+                    elements = builder.create_survey_element_from_dict(child)
+                    if not elements:
+                        elements = []
+                    elif not isinstance(elements, list):
+                        elements = [elements]
+                    part = _Part(child, elements)
+                self.survey.add_children(part.elements)
+                self.parts.append(part)
+        self._static_instances = None
+        self._itext_texts = {}
+        if previous is not None:
+            self._static_instances = previous._static_instances
+            self._itext_texts = previous._itext_texts
+            object.__setattr__(previous.survey, "_compilation", None)
+        object.__setattr__(self.survey, "_compilation", self)
+
+    def recompile(self, changes, warnings=None):
+        """
+        Returns the survey of the workbook with changes made to it.
+        """
+        workbook_dict = apply_changes(self.workbook_dict, changes)
+        compilation = Compilation(workbook_dict, self.form_name,
+                                  self.default_language, warnings,
+                                  previous=self)
+        return compilation.survey
+
+    def _validate(self):
+        # what Survey.validate checks, the elements of the parts are
+        # checked when they are first prepared
+        survey = self.survey
+        if survey.id_string in [None, 'None']:
+            raise PyXFormError('Survey cannot have an empty id_string')
+        SurveyElement.validate(survey)
+        context = (survey.name, survey.default_language)
+        for part in self.parts:
+            part.prepare(survey, context)
+        survey._validate_uniqueness_of_element_names()
+        section_names = set([survey.name])
+        for part in self.parts:
+            for name in part.section_names:
+                if name in section_names:
+                    raise PyXFormError(
+                        "There are two sections with the name %s." % name)
+                section_names.add(name)
+
+    def _setup_xpath_dictionary(self):
+        survey = self.survey
+        xpaths = {survey.name: survey.get_xpath()}
+        for part in self.parts:
+            for name, xpath in part.xpaths:
+                if name in xpaths:
+                    xpaths[name] = None
+                else:
+                    xpaths[name] = xpath
+        if xpaths != survey._xpath:
+            survey._xpath = xpaths
+
+    def _setup_translations(self):
+        # the order of Survey._setup_translations, _setup_media and
+        # _add_empty_translations, which the order of the itext follows
+        survey = self.survey
+        survey._translations = translations = TranslationTable()
+        for d in survey.get_translations(survey.default_language):
+            translations.set_text(d['lang'], d['path'], d['text'])
+        for part in self.parts:
+            for lang, path, text in part.translations:
+                translations.set_text(lang, path, text)
+        survey._setup_choice_translations()
+        for media in survey._element_media(survey):
+            survey._add_media(*media)
+        for part in self.parts:
+            for media in part.media:
+                survey._add_media(*media)
+        survey._add_empty_translations()
+
+    def _static_instances_fragment(self, indent):
+        choices = self.survey.choices
+        cached = self._static_instances
+        if cached is None or cached[0] != indent or cached[1] != choices:
+            nodes = list(self.survey._generate_static_instances())
+            text = pretty_xml_fragment(nodes, indent) if nodes else u""
+            cached = self._static_instances = (indent, choices, text)
+        return cached[2]
+
+    def _translation_fragment(self, translation, itext_texts, indent):
+        """
+        Returns the text of the itext texts of a translation, reusing those
+        of the previous rendering.
+        """
+        survey = self.survey
+        xpaths = survey._xpath
+        texts = []
+        for label_name, content in translation.items():
+            key = (indent, label_name, tuple(content.items()))
+            try:
+                cached = self._itext_texts.get(key)
+            except TypeError:
+                key, cached = None, None
+            if cached is not None and all(
+                    xpaths.get(name, _MISSING) == xpath
+                    for name, xpath in cached[0]):
+                text = cached[1]
+            else:
+                text = pretty_xml_fragment(
+                    [survey._itext_text(label_name, content)], indent)
+                if text is None:
+                    return None
+                names = set()
+                _references(content.values(), names)
+                cached = ([(name, xpaths.get(name, _MISSING))
+                           for name in names], text)
+            if key is not None:
+                itext_texts[key] = cached
+            texts.append(text)
+        return u"\n".join(texts)
+
+    def _render(self):
+        """
+        Returns the XForm, or None if it can't be put together from the
+        text of its parts.
+        """
+        survey = self.survey
+        if survey.shared_itext:
+            # the itext ids of the elements depend on the whole survey
+            return None
+        self._validate()
+        self._setup_xpath_dictionary()
+        for part in self.parts:
+            part.check(survey._xpath)
+        self._setup_translations()
+
+        fragments = {}
+
+        def placeholder(text):
+            tag = u"pyxform-fragment-%d" % len(fragments)
+            fragments[tag] = text
+            return node(tag)
+
+        def part_placeholders(kind, indent):
+            placeholders = []
+            for part in self.parts:
+                text = part.fragment(kind, indent)
+                if text is None:
+                    return None
+                if text:
+                    placeholders.append(placeholder(
+                        lambda indent, part=part: part.fragment(kind,
+                                                                indent)))
+            return placeholders
+
+        itext = None
+        if survey._translations:
+            itext_texts = {}
+            translations = []
+            for lang, translation in survey._translations.items():
+                translation_node = survey._itext_translation(lang)
+                if translation:
+                    translation_node.appendChild(placeholder(
+                        lambda indent, translation=translation:
+                        self._translation_fragment(translation, itext_texts,
+                                                   indent)))
+                translations.append(translation_node)
+            itext = node("itext", *translations)
+
+        instance = survey._instance_node()
+        instance_placeholders = part_placeholders(u"instance",
+                                                  INSTANCE_INDENT)
+        if instance_placeholders is None:
+            return None
+        for instance_placeholder in instance_placeholders:
+            instance.appendChild(instance_placeholder)
+
+        static_instances = []
+        text = self._static_instances_fragment(MODEL_INDENT)
+        if text is None:
+            return None
+        if text:
+            static_instances.append(
+                placeholder(self._static_instances_fragment))
+
+        bindings = []
+        survey_binding = survey.xml_binding()
+        if survey_binding is not None:
+            bindings.append(survey_binding)
+        binding_placeholders = part_placeholders(u"binding", MODEL_INDENT)
+        if binding_placeholders is None:
+            return None
+        bindings += binding_placeholders
+
+        model = survey._xml_model(itext, instance, static_instances,
+                                  bindings)
+        controls = part_placeholders(u"control", BODY_INDENT)
+        if controls is None:
+            return None
+        result = to_pretty_xml_with_fragments(
+            survey._xml_document(model, controls), fragments)
+        if result is not None:
+            # only the itext texts still in use are kept
+            self._itext_texts = itext_texts if itext is not None else {}
+        return result
+
+    def render(self):
+        """
+        Returns the XForm of the survey (see Survey.to_xml).
+        """
+        # the nodes are only used for the text, they can be shared
+        return rendering_xml(self.survey, True, self._render_text)
+
+    def _render_text(self):
+        result = self._render()
+        if result is None:
+            # a part of the XForm depends on the text around it
+            result = to_pretty_xml(self.survey.xml())
+        return result
+
+
+def compile_workbook(workbook_dict, form_name=None,
+                     default_language=u"default", warnings=None):
+    """
+    Returns the survey of a workbook dict (see workbook_to_json), which can
+    be compiled again with recompile.
+    """
+    workbook_dict = dict((sheet_name, list(rows))
+                         for sheet_name, rows in workbook_dict.items())
+    return Compilation(workbook_dict, form_name, default_language,
+                       warnings).survey
+
+
+def recompile(survey, changes, warnings=None):
+    """
+    Returns the survey of the workbook survey was compiled from with
+    changes made to it, reusing what did not change. survey must have been
+    made by compile_workbook or recompile, and should not be used
+    afterwards.
+    """
+    compilation = getattr(survey, "_compilation", None)
+    if compilation is None:
+        raise PyXFormError("The survey was not made by compile_workbook or "
+                           "was recompiled already.")
+    return compilation.recompile(changes, warnings)
@@ -15,7 +15,8 @@ class SurveyInstance(object):
 
         # get xpaths
         #  - prep for xpaths.
-        self._survey.xml()
+        self._survey.validate()
+        self._survey._setup_xpath_dictionary()
         self._xpaths = self._survey._xpath.values()
         
         #see "answers(self):" below for explanation of this dict
@@ -39,7 +40,7 @@ class SurveyInstance(object):
       # self._survey.xml()
 
 
-        if name in self._survey._xpath.keys():
+        if name in self._survey._xpath:
             self._answers[name] = value
         else:
             self._orphan_answers[name] = value
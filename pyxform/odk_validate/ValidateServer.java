@@ -0,0 +1,85 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.security.Permission;
+
+/**
+ * Runs ODK Validate on many forms in a single JVM.
+ *
+ * Reads one XForm path per line from stdin. For every path the
+ * FormValidator command line entry point is called with System.out and
+ * System.err captured and System.exit trapped, and a response is written
+ * to stdout:
+ *
+ *   <exit status> <stdout length> <stderr length>\n<stdout><stderr>
+ *
+ * The first line written is "READY", or "UNSUPPORTED <reason>" when
+ * System.exit cannot be trapped by this JVM.
+ */
+public class ValidateServer {
+
+    static class ExitTrappedException extends SecurityException {
+        final int status;
+
+        ExitTrappedException(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        PrintStream protocol = new PrintStream(
+            new FileOutputStream(FileDescriptor.out), false, "UTF-8");
+        BufferedReader requests = new BufferedReader(
+            new InputStreamReader(System.in, "UTF-8"));
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                public void checkPermission(Permission perm) {
+                }
+
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                public void checkExit(int status) {
+                    throw new ExitTrappedException(status);
+                }
+            });
+        } catch (UnsupportedOperationException e) {
+            protocol.print("UNSUPPORTED " + e.getMessage() + "\n");
+            protocol.flush();
+            return;
+        }
+        protocol.print("READY\n");
+        protocol.flush();
+
+        String path;
+        while ((path = requests.readLine()) != null) {
+            ByteArrayOutputStream out = new ByteArrayOutputStream();
+            ByteArrayOutputStream err = new ByteArrayOutputStream();
+            System.setOut(new PrintStream(out, true, "UTF-8"));
+            System.setErr(new PrintStream(err, true, "UTF-8"));
+            int status = 0;
+            try {
+                org.odk.validate.FormValidator.main(new String[] {path});
+            } catch (ExitTrappedException e) {
+                status = e.status;
+            } catch (Throwable t) {
+                t.printStackTrace();
+                status = 1;
+            }
+            System.out.flush();
+            System.err.flush();
+            byte[] outBytes = out.toByteArray();
+            byte[] errBytes = err.toByteArray();
+            protocol.print(
+                status + " " + outBytes.length + " " + errBytes.length + "\n");
+            protocol.write(outBytes);
+            protocol.write(errBytes);
+            protocol.flush();
+        }
+        System.setSecurityManager(null);
+    }
+}
@@ -8,9 +8,18 @@ import sys
 from subprocess import Popen, PIPE
 import threading
 import signal
+import atexit
+import shutil
+import stat
+import hashlib
+import tempfile
+import zipfile
+import Queue
 
 CURRENT_DIRECTORY = os.path.dirname(os.path.realpath(__file__))
 ODK_VALIDATE_JAR = os.path.join(CURRENT_DIRECTORY, "ODK_Validate.jar")
+VALIDATE_SERVER_SOURCE = os.path.join(CURRENT_DIRECTORY, "ValidateServer.java")
+VALIDATE_TIMEOUT = 100
 
 
 #Adapted from:
@@ -39,9 +48,250 @@ def run_popen_with_timeout(command, timeout):
     kill_check.clear()
     return (p.returncode, timeout, stdout, stderr)
 
+_java_found = False
+
+
 def _java_installed():
-    p = Popen(["which","java"], stdout=PIPE)
-    return len(p.stdout.readlines()) != 0
+    # only remember a positive answer so installing java later is noticed
+    global _java_found
+    if not _java_found:
+        p = Popen(["which","java"], stdout=PIPE)
+        _java_found = len(p.stdout.readlines()) != 0
+    return _java_found
+
+
+def _java_major_version():
+    """
+    Returns the major version of the installed java (8 for "1.8.0_292",
+    17 for "17.0.2") or None if it can not be determined.
+    """
+    try:
+        p = Popen(["java", "-version"], stdout=PIPE, stderr=PIPE)
+    except OSError:
+        return None
+    stdout, stderr = p.communicate()
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', stderr)
+    if not match:
+        return None
+    major = int(match.group(1))
+    if major == 1 and match.group(2):
+        major = int(match.group(2))
+    return major
+
+
+def _private_directory(name):
+    """
+    Returns the directory name in the temporary directory, created readable
+    by the current user only. A directory that another user could have
+    created or changed is not used, a new one from mkdtemp (removed at
+    exit) is returned instead.
+    """
+    if hasattr(os, "getuid"):
+        name = "%s-%d" % (name, os.getuid())
+    directory = os.path.join(tempfile.gettempdir(), name)
+    try:
+        os.mkdir(directory, 0700)
+    except OSError:
+        pass
+    try:
+        info = os.lstat(directory)
+    except OSError:
+        info = None
+    if info is not None and stat.S_ISDIR(info.st_mode) and \
+            not info.st_mode & (stat.S_IRWXG | stat.S_IRWXO) and \
+            (not hasattr(os, "getuid") or info.st_uid == os.getuid()):
+        return directory
+    directory = tempfile.mkdtemp(prefix=name + "-")
+    atexit.register(shutil.rmtree, directory, True)
+    return directory
+
+
+def _file_hash(path):
+    try:
+        with open(path, 'rb') as extracted_file:
+            return hashlib.sha1(extracted_file.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def _validate_classpath():
+    """
+    ODK_Validate.jar bundles its libraries as jars inside the jar, which
+    only its own launcher can load. Extract them once, to a directory
+    private to the user, so the validator classes can be put on a regular
+    classpath. An extracted jar is only used again if it is still the one
+    in ODK_Validate.jar.
+    """
+    with open(ODK_VALIDATE_JAR, 'rb') as jar_file:
+        jar_hash = hashlib.sha1(jar_file.read()).hexdigest()[:12]
+    directory = _private_directory("pyxform-odk-validate-%s" % jar_hash)
+    classpath = [ODK_VALIDATE_JAR]
+    with zipfile.ZipFile(ODK_VALIDATE_JAR) as jar:
+        for name in jar.namelist():
+            if not name.endswith(".jar"):
+                continue
+            path = os.path.join(directory, os.path.basename(name))
+            content = jar.read(name)
+            if _file_hash(path) != hashlib.sha1(content).hexdigest():
+                # extract next to the target and rename so concurrent
+                # workers never load a partially written jar
+                fd, tmp_path = tempfile.mkstemp(dir=directory)
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    tmp_file.write(content)
+                os.rename(tmp_path, path)
+            classpath.append(path)
+    return classpath
+
+
+class ValidateWorker(object):
+    """
+    A long-lived JVM that runs ODK Validate on one form after another
+    (see ValidateServer.java), so JVM startup and class loading are paid
+    once instead of for every form.
+    The JVM is started on first use and restarted after it crashed or was
+    killed because a form took longer than timeout seconds. When the
+    installed java can not run the worker (it needs java 11 or newer)
+    every form is validated in its own java process as before.
+    """
+
+    def __init__(self, timeout=VALIDATE_TIMEOUT, startup_timeout=60):
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.supported = True
+        self.restarts = 0
+        self._process = None
+        self._lock = threading.Lock()
+
+    def _run_with_timeout(self, function, timeout):
+        """
+        Call function, killing the JVM if it takes longer than timeout.
+        returns a tuple of timeout, result
+        """
+        kill_check = threading.Event()
+        process = self._process
+
+        def _kill_process_after_a_timeout():
+            kill_check.set()
+            try:
+                process.kill()
+            except OSError:
+                pass
+        watchdog = threading.Timer(timeout, _kill_process_after_a_timeout)
+        watchdog.start()
+        try:
+            result = function()
+        finally:
+            watchdog.cancel()
+        return kill_check.isSet(), result
+
+    def start(self):
+        """
+        Start the JVM. Returns True if the worker is ready to validate.
+        """
+        if not self.supported:
+            return False
+        java_version = _java_major_version()
+        if java_version is None or java_version < 11:
+            # the single-file source launcher needs java 11
+            self.supported = False
+            return False
+        command = ["java"]
+        if java_version >= 12:
+            command.append("-Djava.security.manager=allow")
+        command += ["-cp", os.pathsep.join(_validate_classpath()),
+                    VALIDATE_SERVER_SOURCE]
+        with open(os.devnull, 'w') as devnull:
+            self._process = Popen(
+                command, stdin=PIPE, stdout=PIPE, stderr=devnull)
+        timeout, ready = self._run_with_timeout(
+            self._process.stdout.readline, self.startup_timeout)
+        if ready.strip() != "READY":
+            self.stop()
+            if not timeout:
+                self.supported = False
+            return False
+        return True
+
+    def stop(self):
+        if self._process is not None:
+            if self._process.poll() is None:
+                try:
+                    self._process.kill()
+                except OSError:
+                    pass
+            self._process.wait()
+            self._process = None
+
+    def _read_response(self):
+        header = self._process.stdout.readline().split()
+        if len(header) != 3:
+            return None
+        returncode, stdout_length, stderr_length = [int(i) for i in header]
+        stdout = self._process.stdout.read(stdout_length)
+        stderr = self._process.stdout.read(stderr_length)
+        if len(stderr) != stderr_length:
+            return None
+        return returncode, stdout, stderr
+
+    def validate(self, path_to_xform):
+        """
+        Validate a form, returns the same
+        (resultcode, timeout, stdout, stderr) tuple as
+        run_popen_with_timeout would for a java process.
+        """
+        if isinstance(path_to_xform, unicode):
+            path_to_xform = path_to_xform.encode("utf-8")
+        with self._lock:
+            if "\n" not in path_to_xform and (
+                    self._process is not None or self.start()):
+                try:
+                    self._process.stdin.write(path_to_xform + "\n")
+                    self._process.stdin.flush()
+                    timeout, response = self._run_with_timeout(
+                        self._read_response, self.timeout)
+                except IOError:
+                    timeout, response = False, None
+                if timeout:
+                    self.stop()
+                    return (-signal.SIGKILL, True, "", "")
+                if response is not None:
+                    returncode, stdout, stderr = response
+                    return (returncode, False, stdout, stderr)
+                # the JVM died, start a new one for the next form
+                self.stop()
+                self.restarts += 1
+        return run_popen_with_timeout(
+            ["java", "-jar", ODK_VALIDATE_JAR, path_to_xform], self.timeout)
+
+
+_worker = None
+
+
+def start_worker(timeout=VALIDATE_TIMEOUT):
+    """
+    Make check_xform (and so Survey.print_xform_to_file(validate=True))
+    validate forms in a long-lived ValidateWorker.
+    Setting the PYXFORM_VALIDATE_WORKER environment variable does the
+    same the first time a form is validated.
+    """
+    global _worker
+    if _worker is None:
+        _worker = ValidateWorker(timeout)
+    return _worker
+
+
+def stop_worker():
+    """
+    Stop the worker started by start_worker, forms are validated in a new
+    java process each again.
+    """
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
+
+
+atexit.register(stop_worker)
 
 def _cleanup_errors(error_message):
     def get_last_item(xpathStr):
@@ -86,23 +336,17 @@ def _cleanup_errors(error_message):
     return u'\n'.join(k)
 
 
-def check_xform(path_to_xform):
+def _validation_result(returncode, timeout, stdout, stderr):
     """
     Returns an array of warnings if the form is valid.
     Throws an exception if it is not
     """
-    # provide useful error message if java is not installed
-    if not _java_installed():
-        raise EnvironmentError("pyxform odk validate dependency: java not found")
-
     #resultcode indicates validity of the form
     #timeout indicates whether validation ran out of time to complete
     #stdout is not used because it has some warnings that always
     #appear and can be ignored.
     #stderr is treated as a warning if the form is valid or an error
     #if it is invalid.
-    returncode, timeout, stdout, stderr = run_popen_with_timeout(
-        ["java", "-jar", ODK_VALIDATE_JAR, path_to_xform], 100)
     warnings = []
 
     if timeout:
@@ -118,6 +362,128 @@ def check_xform(path_to_xform):
         elif returncode < 0:
             return ["Bad return code from ODK Validate."]
 
+
+def check_xform(path_to_xform):
+    """
+    Returns an array of warnings if the form is valid.
+    Throws an exception if it is not
+    """
+    # provide useful error message if java is not installed
+    if not _java_installed():
+        raise EnvironmentError("pyxform odk validate dependency: java not found")
+
+    if _worker is None and os.environ.get("PYXFORM_VALIDATE_WORKER"):
+        start_worker()
+    if _worker is not None:
+        return _validation_result(*_worker.validate(path_to_xform))
+    return _validation_result(*run_popen_with_timeout(
+        ["java", "-jar", ODK_VALIDATE_JAR, path_to_xform], VALIDATE_TIMEOUT))
+
+
+def check_xform_string(xform):
+    """
+    Like check_xform, for a XForm given as a (unicode) string.
+    ODK Validate reads forms from disk, so the string is written to a
+    temporary file that is removed afterwards.
+    """
+    if not _java_installed():
+        raise EnvironmentError("pyxform odk validate dependency: java not found")
+    if isinstance(xform, unicode):
+        xform = xform.encode("utf-8")
+    with tempfile.NamedTemporaryFile(suffix=".xml") as tmp:
+        tmp.write(xform)
+        tmp.flush()
+        return check_xform(tmp.name)
+
+
+def check_xforms(paths, workers=None, timeout=VALIDATE_TIMEOUT):
+    """
+    Validate many forms on a pool of at most workers validators (one per
+    cpu by default), each running in a ValidateWorker.
+    Yields a (path, warnings, error) tuple for every form as soon as it
+    has been validated, so results do not come in the order of paths.
+    For a valid form error is None, for an invalid one warnings is None
+    and error is the exception check_xform would have raised.
+    A form that takes longer than timeout seconds gets the same warning
+    as in check_xform.
+    """
+    if not _java_installed():
+        raise EnvironmentError("pyxform odk validate dependency: java not found")
+    paths = list(paths)
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(paths)))
+
+    pending = Queue.Queue()
+    for path in paths:
+        pending.put(path)
+    results = Queue.Queue()
+
+    def validate_pending():
+        worker = ValidateWorker(timeout)
+        try:
+            while True:
+                try:
+                    path = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results.put((path, _validation_result(
+                        *worker.validate(path)), None))
+                except Exception as e:
+                    results.put((path, None, e))
+        finally:
+            worker.stop()
+
+    threads = [threading.Thread(target=validate_pending)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for _ in paths:
+        # a timeout keeps KeyboardInterrupt working while waiting
+        while True:
+            try:
+                result = results.get(timeout=1)
+                break
+            except Queue.Empty:
+                pass
+        yield result
+
+
+def main(argv=None):
+    """
+    Validate the XForms given on the command line, several at a time.
+    Exits with status 1 if any of them is invalid.
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Validate XForms with ODK Validate.")
+    parser.add_argument('path_to_xform', nargs='+')
+    parser.add_argument(
+        '--workers', type=int, default=None,
+        help="Number of forms to validate at once (default: one per cpu).")
+    parser.add_argument(
+        '--timeout', type=int, default=VALIDATE_TIMEOUT,
+        help="Seconds to wait for a single form.")
+    args = parser.parse_args(argv)
+
+    invalid = 0
+    for path, warnings, error in check_xforms(
+            args.path_to_xform, workers=args.workers, timeout=args.timeout):
+        if error is not None:
+            invalid += 1
+            print "%s: invalid" % path
+            print error
+        else:
+            print "%s: valid" % path
+            for warning in warnings:
+                print warning
+    print "%d of %d forms are valid." % (
+        len(args.path_to_xform) - invalid, len(args.path_to_xform))
+    sys.exit(1 if invalid else 0)
+
+
 if __name__ == '__main__':
-    print __doc__
-    check_xform(sys.argv[1])
+    main()
@@ -0,0 +1,8 @@
+"""
+Validate XForms from the command line:
+
+    python -m pyxform.odk_validate [--workers N] form.xml [form.xml ...]
+"""
+from pyxform.odk_validate import main
+
+main()
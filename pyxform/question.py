@@ -13,6 +13,8 @@ from .utils                     import node
 
 class Question(SurveyElement):
 
+    __slots__ = ()
+
     def validate(self):
         SurveyElement.validate(self)
 
@@ -112,8 +114,10 @@ class InputQuestion(Question):
     This control string is the same for: strings, integers, decimals,
     dates, geopoints, barcodes ...
     """
+    __slots__ = ()
+
     def xml_control(self):
-        control_dict = self.control
+        control_dict = self.control.copy()
         label_and_hint = self.xml_label_and_hint()
         survey = self.get_root()
         # Resolve field references in attributes
@@ -147,8 +151,10 @@ class InputQuestion(Question):
 
 class TriggerQuestion(Question):
 
+    __slots__ = ()
+
     def xml_control(self):
-        control_dict = self.control
+        control_dict = self.control.copy()
         survey = self.get_root()
         # Resolve field references in attributes
         for key, value in control_dict.items():
@@ -161,11 +167,14 @@ class TriggerQuestion(Question):
             )
 
 class UploadQuestion(Question):
+
+    __slots__ = ()
+
     def _get_media_type(self):
         return self.control[u"mediatype"]
 
     def xml_control(self):
-        control_dict = self.control
+        control_dict = self.control.copy()
         control_dict['ref'] = self.get_xpath()
         control_dict['mediatype'] = self._get_media_type()
         return node(
@@ -198,6 +207,8 @@ class UploadQuestion(Question):
 
 class Option(SurveyElement):
 
+    __slots__ = ()
+
     def xml_value(self):
         return node(u"value", self.name)
 
@@ -236,6 +247,8 @@ class Option(SurveyElement):
 
 class MultipleChoiceQuestion(Question):
 
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         kwargs_copy = kwargs.copy()
         #Notice that choices can be specified under choices or children. I'm going to try to stick to just choices.
@@ -252,9 +265,8 @@ class MultipleChoiceQuestion(Question):
 
     def validate(self):
         Question.validate(self)
-        descendants = self.iter_descendants()
-        descendants.next() # iter_descendants includes self; we need to pop it
-        for choice in descendants:
+        # the descendants include self
+        for choice in self._descendants()[1:]:
             choice.validate()
 
     def xml_control(self):
@@ -314,6 +326,9 @@ class MultipleChoiceQuestion(Question):
 
 # TODO: Utilize or remove this.
 class SelectOneQuestion(MultipleChoiceQuestion):
+
+    __slots__ = ()
+
     def __init__(self, *args, **kwargs):
         super(SelectOneQuestion, self).__init__(*args, **kwargs)
         self._dict[self.TYPE] = u"select one"
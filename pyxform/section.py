@@ -5,6 +5,9 @@ from .errors import PyXFormError
 
 
 class Section(SurveyElement):
+
+    __slots__ = ()
+
     def validate(self):
         super(Section, self).validate()
         for element in self.children:
@@ -26,6 +29,19 @@ class Section(SurveyElement):
         """
         Creates an xml representation of the section
         """
+        result = self._instance_node(**kwargs)
+        for child in self.children:
+            if child.get(u"flat"):
+                for grandchild in child.xml_instance_array():
+                    result.appendChild(grandchild)
+            else:
+                result.appendChild(child.cached_xml(u"xml_instance"))
+        return result
+
+    def _instance_node(self, **kwargs):
+        """
+        The instance element of the section, without its children.
+        """
         attributes = {}
         attributes.update(kwargs)
         attributes.update(self.get(u'instance', {}))
@@ -33,14 +49,7 @@ class Section(SurveyElement):
         # Resolve field references in attributes
         for key, value in attributes.items():
             attributes[key] = survey.insert_xpaths(value)
-        result = node(self.name, **attributes)
-        for child in self.children:
-            if child.get(u"flat"):
-                for grandchild in child.xml_instance_array():
-                    result.appendChild(grandchild)
-            else:
-                result.appendChild(child.xml_instance())
-        return result
+        return node(self.name, **attributes)
 
     def xml_instance_array(self, **kwargs):
         """
@@ -51,7 +60,7 @@ class Section(SurveyElement):
                 for grandchild in child.xml_instance_array():
                     yield grandchild
             else:
-                yield child.xml_instance()
+                yield child.cached_xml(u"xml_instance")
 
     def xml_control(self):
         """
@@ -59,12 +68,15 @@ class Section(SurveyElement):
         let's just yield controls from all the children of this section
         """
         for e in self.children:
-            control = e.xml_control()
+            control = e.cached_xml(u"xml_control")
             if control is not None:
                 yield control
 
 
 class RepeatingSection(Section):
+
+    __slots__ = ()
+
     def xml_control(self):
         """
         <group>
@@ -103,6 +115,9 @@ class RepeatingSection(Section):
         return super(RepeatingSection, self).xml_instance(**kwargs)
 
 class GroupedSection(Section):
+
+    __slots__ = ()
+
 #    I think this might be a better place for the table-list stuff, however it doesn't allow for as good of validation as putting it in xls2json
 #    def __init__(self, **kwargs):
 #        control = kwargs.get(u"control")
@@ -0,0 +1,344 @@
+"""
+A long-running conversion service, so converting a form does not pay for
+starting python, importing pyxform and starting a JVM for ODK Validate.
+
+    python -m pyxform serve --port 8000
+    python -m pyxform serve --socket /tmp/pyxform.sock
+
+Forms are converted by POSTing the XLSForm file to /convert. The optional
+query parameters are name (the file name, which gives the default
+id_string, title and root element name of the form, and its format),
+validate (0 to skip ODK Validate) and default_language. The response is
+the xls2xform --json response with the XForm and the itemsets.csv of
+external choices added:
+
+    {"code": 100, "message": "Ok!", "warnings": [],
+     "xform": "<?xml ...", "itemsets": null}
+
+Each form is converted in one of a fixed number of worker processes, which
+limits the number of conversions running at once. A worker that takes
+longer than the timeout is killed, together with its ODK Validate JVM, and
+replaced by a supervisor thread, the only thread forking workers once the
+server runs.
+"""
+import os
+import re
+import sys
+import json
+import codecs
+import shutil
+import signal
+import tempfile
+import threading
+import urlparse
+import Queue
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+
+import xls2xform
+from xls2json_backends import XLSX_MAGIC
+
+CONVERSION_TIMEOUT = 30
+# how long a request waits for a free worker before it is turned away
+QUEUE_TIMEOUT = 10
+MAX_REQUEST_BYTES = 50 * 1024 * 1024
+
+
+def convert_xlsform(data, name=None, validate=True,
+                    default_language=u"default", temp_dir=None):
+    """
+    Convert the XLSForm file contents data. name is the file name, which
+    gives the default id_string, title and root element name of the form
+    ("form" without one) and its format; without an extension the format
+    is detected from data. The files of the conversion are written to a
+    new directory in temp_dir (the temporary directory by default).
+    Returns the conversion response with the xform and itemsets (unicode,
+    or None) added.
+    """
+    stem, extension = _split_file_name(name or u"")
+    extension = extension.lower()
+    if extension not in (u".xls", u".xlsx", u".csv"):
+        extension = u".xlsx" if data.startswith(XLSX_MAGIC) else u".xls"
+    directory = tempfile.mkdtemp(prefix="pyxform-serve-", dir=temp_dir)
+    try:
+        # apart from the outputs, which could have the same name
+        os.mkdir(os.path.join(directory, u"xlsform"))
+        xlsform_path = os.path.join(directory, u"xlsform", stem + extension)
+        xform_path = os.path.join(directory, u"form.xml")
+        with open(xlsform_path, 'wb') as xlsform_file:
+            xlsform_file.write(data)
+        response = xls2xform.conversion_response(
+            xlsform_path, xform_path, validate=validate,
+            default_language=default_language)
+        response['xform'] = None
+        response['itemsets'] = None
+        if response['code'] != 999:
+            with codecs.open(xform_path, encoding="utf-8") as xform_file:
+                response['xform'] = xform_file.read()
+            itemsets_path = os.path.join(directory, u"itemsets.csv")
+            if os.path.isfile(itemsets_path):
+                with codecs.open(itemsets_path,
+                                 encoding="utf-8") as itemsets_file:
+                    response['itemsets'] = itemsets_file.read()
+        return response
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _split_file_name(name):
+    """
+    Split the file name sent by a client into a stem that is safe to use
+    as a file name, "form" when nothing is left of it, and its extension.
+    """
+    stem, extension = os.path.splitext(re.split(r"[/\\]", name)[-1])
+    stem = re.sub(r"[^\w.-]", u"_", stem).lstrip(u".")
+    return stem or u"form", extension
+
+
+def _serve_conversions(connection, temp_dir):
+    """
+    The loop of a worker process: convert the forms received on connection,
+    in temp_dir, until it is closed.
+    """
+    # lead a process group, so the validate JVM is killed with the worker
+    os.setpgid(0, 0)
+    from odk_validate import start_worker
+    start_worker()
+    # the conversion prints the location of itemsets.csv
+    sys.stdout = sys.stderr
+    while True:
+        try:
+            args, kwargs = connection.recv()
+        except (EOFError, IOError):
+            return
+        try:
+            response = convert_xlsform(*args, temp_dir=temp_dir, **kwargs)
+        except Exception as e:
+            response = {'code': 999, 'message': str(e), 'warnings': [],
+                        'xform': None, 'itemsets': None}
+        connection.send(response)
+
+
+class ConversionWorker(object):
+    """
+    A process converting one form at a time, in a temporary directory of
+    its own.
+    """
+
+    def __init__(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="pyxform-serve-")
+        self._connection, child_connection = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_serve_conversions,
+            args=(child_connection, self.temp_dir))
+        self._process.daemon = True
+        self._process.start()
+        child_connection.close()
+
+    def convert(self, timeout, *args, **kwargs):
+        """
+        Returns a (response, timed_out) tuple: the response of
+        convert_xlsform, or None if the worker died or did not answer within
+        timeout seconds (timed_out is then True). A worker that did not
+        answer has to be stopped.
+        """
+        try:
+            self._connection.send((args, kwargs))
+            if not self._connection.poll(timeout):
+                return None, True
+            return self._connection.recv(), False
+        except (EOFError, IOError):
+            return None, False
+
+    def stop(self):
+        """
+        Kill the process and its validate JVM, and remove its temporary
+        directory.
+        """
+        self._connection.close()
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except OSError:
+            # the process has not made its process group yet
+            if self._process.is_alive():
+                self._process.terminate()
+        self._process.join()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class ConversionService(object):
+    """
+    Converts forms in workers worker processes (one per cpu by default),
+    at most timeout seconds each.
+    """
+
+    def __init__(self, workers=None, timeout=CONVERSION_TIMEOUT,
+                 queue_timeout=QUEUE_TIMEOUT):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._idle = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._stopping = False
+        for _ in range(max(1, workers)):
+            worker = ConversionWorker()
+            self._workers.append(worker)
+            self._idle.put(worker)
+        # the workers to stop and replace, see _supervise
+        self._failed = Queue.Queue()
+        self._supervisor = threading.Thread(target=self._supervise)
+        self._supervisor.daemon = True
+        self._supervisor.start()
+
+    def _supervise(self):
+        """
+        Stop the workers that failed and fork their replacements, in this
+        one thread rather than in those handling the requests.
+        """
+        while True:
+            worker = self._failed.get()
+            if worker is None:
+                return
+            worker.stop()
+            with self._lock:
+                self._workers.remove(worker)
+                if self._stopping:
+                    continue
+                replacement = ConversionWorker()
+                self._workers.append(replacement)
+            self._idle.put(replacement)
+
+    def convert(self, *args, **kwargs):
+        """
+        Convert a form with convert_xlsform in a worker process. Returns an
+        HTTP status code and the response.
+        """
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except Queue.Empty:
+            return 503, {'code': 999, 'warnings': [],
+                         'message': "All workers are busy, try again later."}
+        response, timed_out = worker.convert(self.timeout, *args, **kwargs)
+        if response is None:
+            self._failed.put(worker)
+            if timed_out:
+                return 504, {'code': 999, 'warnings': [],
+                             'message': "The conversion did not complete "
+                                        "within %s seconds." % self.timeout}
+            return 500, {'code': 999, 'warnings': [],
+                         'message': "The conversion crashed."}
+        self._idle.put(worker)
+        return 200, response
+
+    def stop(self):
+        with self._lock:
+            self._stopping = True
+        self._failed.put(None)
+        self._supervisor.join()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+
+
+class ConversionRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def _respond(self, status, response):
+        body = json.dumps(response)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._respond(status, {'code': 999, 'message': message,
+                               'warnings': []})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/convert":
+            return self._error(404, "Forms are converted at /convert.")
+        try:
+            length = int(self.headers.get("Content-Length", ""))
+        except ValueError:
+            return self._error(411, "The Content-Length header is missing.")
+        if length > MAX_REQUEST_BYTES:
+            return self._error(413, "The XLSForm is too large.")
+        data = self.rfile.read(length)
+        query = dict(urlparse.parse_qsl(url.query))
+        status, response = self.server.service.convert(
+            data, name=query.get("name", "").decode("utf-8"),
+            validate=query.get("validate", "1") != "0",
+            default_language=query.get(
+                "default_language", "default").decode("utf-8"))
+        self._respond(status, response)
+
+    def log_message(self, format, *args):
+        # the client address of a unix socket is an empty string
+        client = self.client_address[0] if self.client_address else "-"
+        sys.stderr.write("%s - - [%s] %s\n" % (
+            client, self.log_date_time_string(), format % args))
+
+
+class ConversionHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        BaseHTTPServer.HTTPServer.__init__(
+            self, address, ConversionRequestHandler)
+        self.service = service
+
+
+class UnixConversionHTTPServer(SocketServer.ThreadingMixIn,
+                               SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(
+            self, path, ConversionRequestHandler)
+        self.service = service
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_server(service, port=None, host="127.0.0.1", socket_path=None):
+    """
+    Returns an HTTP server for service listening on the unix socket at
+    socket_path, or on host and port.
+    """
+    if socket_path:
+        return UnixConversionHTTPServer(socket_path, service)
+    return ConversionHTTPServer((host, port or 0), service)
+
+
+def serve(port=None, host="127.0.0.1", socket_path=None, workers=None,
+          timeout=CONVERSION_TIMEOUT):
+    """
+    Serve conversions until interrupted.
+    """
+    # the workers are forked before the server starts any threads
+    service = ConversionService(workers=workers, timeout=timeout)
+    server = make_server(service, port, host, socket_path)
+    if socket_path:
+        sys.stderr.write("Serving conversions on %s\n" % socket_path)
+    else:
+        sys.stderr.write(
+            "Serving conversions on http://%s:%s/convert\n" %
+            server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -10,7 +10,6 @@ Provides the outward interface of the package.
 
 import sys
 import os
-import argparse
 
 from variable_metadata import VariableMetadata
 
@@ -40,6 +39,7 @@ def from_json(json_text):
 
 def main(argv=None): # IGNORE:C0111
     '''Command line options.'''
+    import argparse
     from . import __version__
 
     if argv is None:
@@ -0,0 +1,263 @@
+"""
+Parsing many submitted instances of a survey at once, in a pool of worker
+processes.
+"""
+import os
+import re
+import tarfile
+import zipfile
+import multiprocessing
+from datetime import datetime
+
+from question import Question
+from section import Section
+from xform_instance_parser import XFormInstanceParser, XFORM_ID_STRING
+from errors import PyXFormError
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2")
+
+# the keys of a record holding the values at paths that are not in the
+# survey, and the paths of the values that could not be coerced
+ORPHANS = u"_orphans"
+INVALID_VALUES = u"_invalid_values"
+
+REPEAT_INDEX = re.compile(ur"\[\d+\]")
+
+# the most paths with repeat indexes a schema remembers the coercion of
+PATH_CACHE_SIZE = 10000
+
+_UNSEEN = object()
+
+
+def _split(value):
+    return value.split()
+
+
+def _date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def _geopoint(value):
+    return [float(number) for number in value.split()]
+
+
+# the coercions of the bind types that the question classes don't tell
+BIND_TYPE_COERCIONS = {
+    u"date": _date,
+    u"geopoint": _geopoint,
+}
+
+
+def question_coercion(question):
+    """
+    Returns the function converting the text submitted for question to its
+    value, or None if the text is the value: int for integers, float for
+    decimals, a list of the choice names for select multiple, a date for
+    dates and a list of numbers for geopoints.
+    """
+    if question.is_integer():
+        return int
+    if question.is_decimal():
+        return float
+    if question.is_multi_select():
+        return _split
+    return BIND_TYPE_COERCIONS.get(question.bind.get(u"type"))
+
+
+class SubmissionSchema(object):
+    """
+    What parsing the submissions of a survey needs to know about it, taken
+    from the survey once and sent to the worker processes: the name of the
+    instance root, the id string, and the bind type and coercion (see
+    question_coercion) of the question at each flat path (see
+    XFormInstanceParser.to_flat_dict, without the indexes of repeats).
+    With coerce False the records are left as XFormInstanceParser makes
+    them, with their values as text and no orphans set apart.
+    """
+
+    def __init__(self, survey, coerce=True):
+        survey.validate()
+        self.root_name = survey.name
+        self.id_string = survey.id_string
+        self.coerce = coerce
+        self.bind_types = {}
+        self.coercions = {}
+        index = survey.descendant_index()
+        for question in index.of_class(Question):
+            path = question.get_abbreviated_xpath()
+            self.bind_types[path] = question.bind.get(u"type")
+            self.coercions[path] = question_coercion(question)
+        for section in index.of_class(Section)[1:]:
+            # sections without answers are leaves of the submissions
+            self.coercions.setdefault(section.get_abbreviated_xpath(), None)
+        # the coercion, or ORPHANS, of the last paths with repeat indexes
+        # seen, up to PATH_CACHE_SIZE of them
+        self._path_coercions = {}
+
+    def _path_coercion(self, path):
+        coercion = self._path_coercions.get(path, _UNSEEN)
+        if coercion is _UNSEEN:
+            coercion = self.coercions.get(REPEAT_INDEX.sub(u"", path),
+                                          ORPHANS)
+            if len(self._path_coercions) >= PATH_CACHE_SIZE:
+                self._path_coercions.clear()
+            self._path_coercions[path] = coercion
+        return coercion
+
+    def parse(self, xml):
+        """
+        Returns the flat record of a submission, an xml string or file: its
+        values by flat path, coerced to the types of their questions, and
+        its form id under XFORM_ID_STRING. The values at paths that are not
+        in the survey are kept apart, like SurveyInstance keeps its orphan
+        answers, in a dict under ORPHANS. The paths of the values that could
+        not be coerced, which are left as text, are listed under
+        INVALID_VALUES. With coerce False the record only has the values by
+        flat path, as text, and the form id.
+        """
+        parser = XFormInstanceParser(xml)
+        if parser.get_root_node_name() != self.root_name:
+            raise PyXFormError(
+                "The submission's root node is %s instead of %s." % (
+                    parser.get_root_node_name(), self.root_name))
+        form_id = parser.get_attributes().get(u"id")
+        if form_id != self.id_string:
+            raise PyXFormError(
+                "The submission is for the form %s instead of %s." % (
+                    form_id, self.id_string))
+        if not self.coerce:
+            record = parser.to_flat_dict()
+            record[XFORM_ID_STRING] = form_id
+            return record
+        record = {}
+        orphans = {}
+        invalid_values = []
+        for path, value in parser.to_flat_dict().iteritems():
+            coercion = self._path_coercion(path)
+            if coercion is ORPHANS:
+                orphans[path] = value
+                continue
+            if coercion is not None and value is not None:
+                try:
+                    value = coercion(value)
+                except ValueError:
+                    invalid_values.append(path)
+            record[path] = value
+        record[XFORM_ID_STRING] = form_id
+        record[ORPHANS] = orphans
+        record[INVALID_VALUES] = invalid_values
+        return record
+
+
+def _is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and \
+        os.path.isfile(path)
+
+
+def _archive_documents(path):
+    """
+    Yields the name and xml of the xml files in a zip or tar archive.
+    """
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.lower().endswith(".xml"):
+                    yield os.path.join(path, member), archive.read(member)
+    else:
+        archive = tarfile.open(path)
+        try:
+            for member in archive:
+                if member.isfile() and member.name.lower().endswith(".xml"):
+                    yield os.path.join(path, member.name), \
+                        archive.extractfile(member).read()
+        finally:
+            archive.close()
+
+
+def _documents(submissions):
+    """
+    Yields a (name, xml, path, error) tuple for each submission, where
+    either the xml or the path of the file holding it is given, or the
+    error raised reading it. Files are read by the worker processes,
+    archives and file objects here.
+    """
+    if isinstance(submissions, basestring):
+        submissions = [submissions]
+    for position, submission in enumerate(submissions):
+        if hasattr(submission, "read"):
+            name = getattr(submission, "name", position)
+            try:
+                yield name, submission.read(), None, None
+            except Exception as e:
+                yield name, None, None, e
+        elif isinstance(submission, basestring) and \
+                not submission.lstrip().startswith("<"):
+            if _is_archive(submission):
+                try:
+                    # a damaged archive yields the documents before it
+                    for name, xml in _archive_documents(submission):
+                        yield name, xml, None, None
+                except Exception as e:
+                    yield submission, None, None, e
+            else:
+                yield submission, None, submission, None
+        else:
+            yield position, submission, None, None
+
+
+# the schema of the submissions parsed by a worker process
+_schema = None
+
+
+def _set_schema(schema):
+    global _schema
+    _schema = schema
+
+
+def _parse_document(document, schema=None):
+    name, xml, path, error = document
+    if error is not None:
+        return name, None, error
+    if schema is None:
+        schema = _schema
+    try:
+        if path is not None:
+            with open(path, "rb") as xml_file:
+                return name, schema.parse(xml_file), None
+        return name, schema.parse(xml), None
+    except Exception as e:
+        return name, None, e
+
+
+def parse_submissions(survey, submissions, workers=None, chunksize=32,
+                      coerce=True):
+    """
+    Parse many submissions of survey in a pool of worker processes (one per
+    cpu by default, none if workers is 1). submissions is an iterable of xml
+    strings, paths of xml files, file objects and paths of zip or tar
+    archives of xml files, or the path of one archive.
+
+    Yields a (name, record, error) tuple for every submission, in the order
+    of submissions: name is the path of the file (for archives the path of
+    the archive joined with that of the file in it), the name of the file
+    object or the position of the xml string in submissions. record is the
+    flat record of the submission (see SubmissionSchema.parse), or None and
+    error the exception raised while parsing it. With coerce False the
+    records are not coerced, see SubmissionSchema.
+    """
+    schema = SubmissionSchema(survey, coerce)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers <= 1:
+        for document in _documents(submissions):
+            yield _parse_document(document, schema)
+        return
+    pool = multiprocessing.Pool(workers, _set_schema, (schema,))
+    try:
+        for result in pool.imap(_parse_document, _documents(submissions),
+                                chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
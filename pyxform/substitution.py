@@ -0,0 +1,146 @@
+"""
+Replace ${name} references in labels, hints and expressions.
+
+An XPathSubstitution is made for one xpath dictionary (name -> xpath, or
+None for names used by several survey elements). Texts are split into
+literal and reference segments once, and the results are memoized for as
+long as the dictionary is in use; Survey makes a new one every time it
+rebuilds the dictionary.
+"""
+import re
+from xml.dom.minidom import Text, Element
+
+from utils import node
+from errors import PyXFormError
+
+BRACKETED_TAG = re.compile(r"\$\{(.*?)\}")
+
+# line breaks as an XML parser normalizes them
+_LINE_BREAK_RE = re.compile(u"\r\n?")
+
+
+def escape(text):
+    """
+    Escape text the way a minidom Text node writes it.
+    """
+    return text.replace(u"&", u"&amp;").replace(u"<", u"&lt;"). \
+        replace(u"\"", u"&quot;").replace(u">", u"&gt;")
+
+
+def tokenize(text):
+    """
+    Split text into a list of literal strings and reference names: the
+    literals are at even and the names at odd positions.
+    """
+    return BRACKETED_TAG.split(text)
+
+
+class XPathSubstitution(object):
+
+    def __init__(self, xpaths):
+        self.xpaths = xpaths
+        self._xpath_cache = {}
+        self._output_cache = {}
+
+    def xpath(self, name):
+        """
+        Returns the xpath to the survey element named name.
+        """
+        xpath = self.xpaths.get(name)
+        if xpath is None:
+            intro = "There has been a problem trying to replace ${%s} with "\
+                "the XPath to the survey element named '%s'." % (name, name)
+            if name not in self.xpaths:
+                raise PyXFormError(
+                    intro + " There is no survey element with this name.")
+            raise PyXFormError(intro + " There are multiple survey elements"
+                               " with this name.")
+        return xpath
+
+    def insert_xpaths(self, text):
+        """
+        Replace all instances of ${var} with the xpath to var.
+        """
+        text = unicode(text)
+        result = self._xpath_cache.get(text)
+        if result is None:
+            tokens = tokenize(text)
+            for i in range(1, len(tokens), 2):
+                tokens[i] = u" %s " % self.xpath(tokens[i])
+            result = self._xpath_cache[text] = u"".join(tokens)
+        return result
+
+    def _output_segments(self, text):
+        """
+        Returns the segments of text with ${var} replaced by xpaths: a
+        tuple of literal strings and (xpath,) tuples. None if there are no
+        references.
+        """
+        try:
+            return self._output_cache[text]
+        except KeyError:
+            pass
+        segments = None
+        if u"{" in text:
+            tokens = tokenize(text)
+            if len(tokens) > 1:
+                segments = []
+                for i, token in enumerate(tokens):
+                    if i % 2:
+                        segments.append((u" %s " % self.xpath(token),))
+                    elif token:
+                        segments.append(_LINE_BREAK_RE.sub(u"\n", token))
+                segments = tuple(segments)
+        self._output_cache[text] = segments
+        return segments
+
+    def insert_output_values(self, text):
+        """
+        Replace all the ${variables} in text with <output/> elements.
+        Returns that as XML text and a boolean indicating if there were any
+        ${variables} present.
+        """
+        if not isinstance(text, basestring):
+            # e.g. the dict of an untranslated label, which can't be a key
+            # of the cache
+            text = unicode(text)
+        segments = self._output_segments(text)
+        if segments is None:
+            if u"{" in text:
+                # kept from the regular expression based replacement, which
+                # returned the escaped text whenever there was a brace
+                return escape(text), False
+            return text, False
+        return u"".join(
+            u'<output value="%s" />' % segment[0]
+            if type(segment) is tuple else escape(segment)
+            for segment in segments), True
+
+    def output_node(self, tag, text, prefix=u"", **attributes):
+        """
+        Returns a tag element holding prefix and text, with the
+        ${variables} in text replaced by <output/> elements.
+        """
+        if not isinstance(text, basestring):
+            text = unicode(text)
+        segments = self._output_segments(text)
+        if segments is None:
+            value = self.insert_output_values(text)[0]
+            return node(tag, prefix + value, **attributes)
+        result = node(tag, **attributes)
+        if prefix:
+            segments = (prefix,) + segments
+        previous = None
+        for segment in segments:
+            if type(segment) is tuple:
+                child = Element(u"output")
+                child.setAttribute(u"value", segment[0])
+                result.appendChild(child)
+                previous = None
+            elif previous is None:
+                previous = Text()
+                previous.data = segment
+                result.appendChild(previous)
+            else:
+                previous.data += segment
+        return result
@@ -1,18 +1,19 @@
 # Python standard library.
-import re
-import tempfile
 import codecs
 import StringIO
+import json
 from datetime import datetime
-from collections import defaultdict
 
 # 'pyxform'-internal.
-import pyxform.survey_to_xlsform
 from section import Section
 from question import Question
 from utils import node
-from odk_validate import check_xform
-from survey_element import SurveyElement
+from xml_writer import to_pretty_xml, write_pretty_xml
+from cache import make_entry
+from translations import TranslationTable
+from substitution import XPathSubstitution
+from survey_element import SurveyElement, add_field_properties, \
+    rendering_xml
 from errors import PyXFormError
 from pyxform import constants
 
@@ -29,6 +30,8 @@ nsmap = {
 
 class Survey(Section):
 
+    __slots__ = ("_xpath_substitution", "_compilation", "_itext_ids")
+
     FIELDS = Section.FIELDS.copy()
     FIELDS.update(
         {
@@ -53,6 +56,7 @@ class Survey(Section):
             constants.STYLE: unicode,
             u"attribute": dict,
             u"namespaces": unicode,
+            u"shared_itext": bool,
         }
     )
 
@@ -63,13 +67,12 @@ class Survey(Section):
         self._validate_uniqueness_of_section_names()
 
     def _validate_uniqueness_of_section_names(self):
-        section_names = []
-        for e in self.iter_descendants():
-            if isinstance(e, Section):
-                if e.name in section_names:
-                    raise PyXFormError(
-                        "There are two sections with the name %s." % e.name)
-                section_names.append(e.name)
+        section_names = set()
+        for e in self.descendant_index().of_class(Section):
+            if e.name in section_names:
+                raise PyXFormError(
+                    "There are two sections with the name %s." % e.name)
+            section_names.add(e.name)
 
     def get_nsmap(self):
         """Add additional namespaces"""
@@ -92,8 +95,18 @@ class Survey(Section):
         """
         calls necessary preparation methods, then returns the xml.
         """
+        return rendering_xml(self, False, self._xml)
+
+    def _xml(self):
         self.validate()
         self._setup_xpath_dictionary()
+        model = self.xml_model()
+        return self._xml_document(model, self.xml_control())
+
+    def _xml_document(self, model, controls):
+        """
+        Returns the h:html element holding the model and the body controls.
+        """
         body_kwargs = {}
         if hasattr(self, constants.STYLE) and getattr(
                 self, constants.STYLE):
@@ -104,9 +117,9 @@ class Survey(Section):
         return node(u"h:html",
                     node(u"h:head",
                          node(u"h:title", self.title),
-                         self.xml_model()
+                         model
                          ),
-                    node(u"h:body", *self.xml_control(), **body_kwargs),
+                    node(u"h:body", *controls, **body_kwargs),
                     **nsmap
                     )
 
@@ -117,12 +130,13 @@ class Survey(Section):
         """
         for list_name, choice_list in self.choices.items():
             instance_element_list = []
-            for idx, choice in zip(range(len(choice_list)), choice_list):
+            for idx, choice in enumerate(choice_list):
                 choice_element_list = []
                 # Add a unique id to the choice element incase there is itext
                 # it refrences
                 itextId = '-'.join(['static_instance', list_name, str(idx)])
-                choice_element_list.append(node("itextId", itextId))
+                choice_element_list.append(
+                    node("itextId", self._itext_id(itextId)))
 
                 for choicePropertyName, choicePropertyValue in choice.items():
                     if isinstance(choicePropertyValue, basestring) \
@@ -143,13 +157,24 @@ class Survey(Section):
         self._setup_translations()
         self._setup_media()
         self._add_empty_translations()
+        self._setup_itext_ids()
+
+        itext = self.itext() if self._translations else None
+        return self._xml_model(itext, self.xml_instance(),
+                               self._generate_static_instances(),
+                               self.xml_bindings())
 
+    def _xml_model(self, itext, instance, static_instances, bindings):
+        """
+        Returns the model element holding the itext element (or None), the
+        main and static instances and the bindings.
+        """
         model_children = []
-        if self._translations:
-            model_children.append(self.itext())
-        model_children += [node(constants.INSTANCE_XFORM, self.xml_instance())]
-        model_children += list(self._generate_static_instances())
-        model_children += self.xml_bindings()
+        if itext is not None:
+            model_children.append(itext)
+        model_children += [node(constants.INSTANCE_XFORM, instance)]
+        model_children += list(static_instances)
+        model_children += bindings
 
         if self.submission_url or self.public_key:
             submission_attrs = dict()
@@ -162,8 +187,8 @@ class Survey(Section):
             model_children.insert(0, submission_node)
         return node(constants.MODEL_XFORM,  *model_children)
 
-    def xml_instance(self):
-        result = Section.xml_instance(self)
+    def _instance_node(self, **kwargs):
+        result = Section._instance_node(self, **kwargs)
         result.setAttribute(u"id", self.id_string)
 
         # add instance xmlns attribute to the instance node
@@ -174,55 +199,45 @@ class Survey(Section):
             result.setAttribute(constants.VERSION, self.version)
         return result
 
-    def _add_to_nested_dict(self, dicty, path, value):
-        if len(path) == 1:
-            dicty[path[0]] = value
-            return
-        if path[0] not in dicty:
-            dicty[path[0]] = {}
-        self._add_to_nested_dict(dicty[path[0]], path[1:], value)
-
     def _setup_translations(self):
         """
         set up the self._translations dict which will be referenced in the
         setup media and itext functions
         """
-        self._translations = defaultdict(dict)
-        for element in self.iter_descendants():
+        self._translations = translations = TranslationTable()
+        for element in self.descendant_index().elements:
             for d in element.get_translations(self.default_language):
-                self._translations[d['lang']][d['path']] = {"long": d['text']}
+                translations.set_text(d['lang'], d['path'], d['text'])
+        self._setup_choice_translations()
 
-        # This code sets up translations for choices in filtered selects.
+    def _setup_choice_translations(self):
+        """
+        This code sets up translations for choices in filtered selects.
+        """
+        translations = self._translations
         for list_name, choice_list in self.choices.items():
-            for idx, choice in zip(range(len(choice_list)), choice_list):
+            for idx, choice in enumerate(choice_list):
+                itextId = '-'.join(['static_instance', list_name, str(idx)])
                 for choicePropertyName, choicePropertyValue in choice.items():
-                    itextId = '-'.join(
-                        ['static_instance', list_name, str(idx)])
                     if isinstance(choicePropertyValue, dict):
                         for mediatypeorlanguage, value in choicePropertyValue.items():  # noqa
                             if isinstance(value, dict):
                                 for langauge, value in value.items():
-                                    self._add_to_nested_dict(
-                                        self._translations,
-                                        [langauge, itextId,
-                                         mediatypeorlanguage],
-                                        value)
+                                    translations.set_content(
+                                        langauge, itextId,
+                                        mediatypeorlanguage, value)
                             else:
                                 if choicePropertyName == 'media':
-                                    self._add_to_nested_dict(
-                                        self._translations,
-                                        [self.default_language, itextId,
-                                         mediatypeorlanguage],
-                                        value)
+                                    translations.set_content(
+                                        self.default_language, itextId,
+                                        mediatypeorlanguage, value)
                                 else:
-                                    self._add_to_nested_dict(
-                                        self._translations,
-                                        [mediatypeorlanguage, itextId, 'long'],
-                                        value)
+                                    translations.set_content(
+                                        mediatypeorlanguage, itextId,
+                                        'long', value)
                     elif choicePropertyName == 'label':
-                        self._add_to_nested_dict(
-                            self._translations,
-                            [self.default_language, itextId, 'long'],
+                        translations.set_content(
+                            self.default_language, itextId, 'long',
                             choicePropertyValue)
 
     def _add_empty_translations(self):
@@ -232,18 +247,26 @@ class Survey(Section):
         When translations are not provided "-" will be used.
         This disables any of the default_language fallback functionality.
         """
-        paths = {}
-        for lang, translation in self._translations.items():
-            for path, content in translation.items():
-                paths[path] = paths.get(path, set()).union(content.keys())
+        self._translations.fill(u"-")
 
-        for lang, translation in self._translations.items():
-            for path, content_types in paths.items():
-                if path not in self._translations[lang]:
-                    self._translations[lang][path] = {}
-                for content_type in content_types:
-                    if content_type not in self._translations[lang][path]:
-                        self._translations[lang][path][content_type] = u"-"
+    def _setup_itext_ids(self):
+        """
+        With shared_itext, the paths that have the same translations as a
+        path before them use its itext id, so the texts are written once.
+        """
+        itext_ids = None
+        if self.shared_itext and self._translations:
+            itext_ids = self._translations.shared_paths()
+        object.__setattr__(self, "_itext_ids", itext_ids)
+
+    def _itext_id(self, path):
+        """
+        Returns the id of the itext text of path.
+        """
+        itext_ids = getattr(self, "_itext_ids", None)
+        if itext_ids:
+            return itext_ids.get(path, path)
+        return path
 
     def _setup_media(self):
         """
@@ -253,51 +276,45 @@ class Survey(Section):
         It matches the xform nesting order.
         """
         if not self._translations:
-            self._translations = defaultdict(dict)
-
-        for survey_element in self.iter_descendants():
-
-            translation_key = survey_element.get_xpath() + ":label"
-            media_dict = survey_element.get(u"media")
-
-            for media_type, possibly_localized_media in media_dict.items():
-
-                if media_type not in SurveyElement.SUPPORTED_MEDIA:
-                    raise PyXFormError(
-                        "Media type: " + media_type + " not supported")
-
-                localized_media = dict()
+            self._translations = TranslationTable()
 
-                if type(possibly_localized_media) is dict:
-                    # media is localized
-                    localized_media = possibly_localized_media
-                else:
-                    # media is not localized so create a localized version
-                    # using the default language
-                    localized_media = {
-                        self.default_language: possibly_localized_media
-                    }
+        for survey_element in self.descendant_index().elements:
+            for language, translation_key, media_type, media in \
+                    self._element_media(survey_element):
+                self._add_media(language, translation_key, media_type, media)
 
-                for language, media in localized_media.items():
-
-                    # Create the required dictionaries in _translations,
-                    # then add media as a leaf value:
+    def _element_media(self, survey_element):
+        """
+        Yields the language, translation key, media type and media of each
+        media of survey_element.
+        """
+        translation_key = survey_element.get_xpath() + ":label"
+        media_dict = survey_element.get(u"media")
 
-                    if language not in self._translations:
-                        self._translations[language] = {}
+        for media_type, possibly_localized_media in media_dict.items():
 
-                    translations_language = self._translations[language]
+            if media_type not in SurveyElement.SUPPORTED_MEDIA:
+                raise PyXFormError(
+                    "Media type: " + media_type + " not supported")
 
-                    if translation_key not in translations_language:
-                        translations_language[translation_key] = {}
+            localized_media = dict()
 
-                    translations_trans_key = \
-                        translations_language[translation_key]
+            if type(possibly_localized_media) is dict:
+                # media is localized
+                localized_media = possibly_localized_media
+            else:
+                # media is not localized so create a localized version
+                # using the default language
+                localized_media = {
+                    self.default_language: possibly_localized_media
+                }
 
-                    if media_type not in translations_trans_key:
-                            translations_trans_key[media_type] = {}
+            for language, media in localized_media.items():
+                yield language, translation_key, media_type, media
 
-                    translations_trans_key[media_type] = media
+    def _add_media(self, language, translation_key, media_type, media):
+        self._translations.set_content(language, translation_key, media_type,
+                                       media)
 
     def itext(self):
         """
@@ -307,59 +324,63 @@ class Survey(Section):
         @see http://code.google.com/p/opendatakit/wiki/XFormDesignGuidelines
         """
         result = []
-        for lang, translation in self._translations.items():
-            if lang == self.default_language:
-                result.append(
-                    node("translation", lang=lang, default=u"true()"))
-            else:
-                result.append(node("translation", lang=lang))
-
-            for label_name, content in translation.items():
-                itext_nodes = []
-                label_type = label_name.partition(":")[-1]
-
-                if type(content) is not dict:
-                    raise Exception()
-
-                for media_type, media_value in content.items():
-
-                    # There is a odk/jr bug where hints can't have a value
-                    # for the "form" attribute.
-                    # This is my workaround.
-                    if label_type == u"hint":
-                        value, outputInserted = \
-                            self.insert_output_values(media_value)
-                        itext_nodes.append(
-                            node("value", value, toParseString=outputInserted))
-                        continue
-
-                    if media_type == "long":
-                        value, outputInserted = \
-                            self.insert_output_values(media_value)
-                        # I'm ignoring long types for now because I don't know
-                        # how they are supposed to work.
-                        itext_nodes.append(
-                            node("value", value, toParseString=outputInserted))
-                    elif media_type == "image":
-                        value, outputInserted = \
-                            self.insert_output_values(media_value)
-                        itext_nodes.append(
-                            node("value", "jr://images/" + value,
-                                 form=media_type, toParseString=outputInserted)
-                        )
-                    else:
-                        value, outputInserted = \
-                            self.insert_output_values(media_value)
-                        itext_nodes.append(
-                            node("value", "jr://" + media_type + "/" + value,
-                                 form=media_type,
-                                 toParseString=outputInserted))
+        itext_ids = getattr(self, "_itext_ids", None) or {}
+        for lang, translation in self._translations.iteritems():
+            result.append(self._itext_translation(lang))
 
-                result[-1].appendChild(
-                    node("text", *itext_nodes, id=label_name))
+            for label_name, content in translation.iteritems():
+                if label_name in itext_ids:
+                    # the text is written under the id it shares
+                    continue
+                result[-1].appendChild(self._itext_text(label_name, content))
 
         return node("itext", *result)
 
+    def _itext_translation(self, lang):
+        """
+        Returns the itext translation element of a language, without texts.
+        """
+        if lang == self.default_language:
+            return node("translation", lang=lang, default=u"true()")
+        return node("translation", lang=lang)
+
+    def _itext_text(self, label_name, content):
+        """
+        Returns the itext text element of a translation.
+        """
+        itext_nodes = []
+        label_type = label_name.partition(":")[-1]
+
+        if type(content) is not dict:
+            raise Exception()
+
+        for media_type, media_value in content.items():
+
+            # There is a odk/jr bug where hints can't have a value
+            # for the "form" attribute.
+            # This is my workaround.
+            if label_type == u"hint":
+                itext_nodes.append(
+                    self.output_node("value", media_value))
+                continue
+
+            if media_type == "long":
+                # I'm ignoring long types for now because I don't know
+                # how they are supposed to work.
+                itext_nodes.append(
+                    self.output_node("value", media_value))
+            elif media_type == "image":
+                itext_nodes.append(
+                    self.output_node("value", media_value,
+                                     "jr://images/", form=media_type))
+            else:
+                itext_nodes.append(
+                    self.output_node("value", media_value,
+                                     "jr://" + media_type + "/",
+                                     form=media_type))
+
+        return node("text", *itext_nodes, id=label_name)
+
     def date_stamp(self):
         return self._created.strftime("%Y_%m_%d")
 
@@ -368,18 +389,21 @@ class Survey(Section):
         I want the to_xml method to by default validate the xml we are
         producing.
         """
-        # Hacky way of pretty printing xml without adding extra white
-        # space to text
-        # TODO: check out pyxml
-        # http://ronrothman.com/public/leftbraned/xml-dom-minidom-toprettyxml-and-silly-whitespace/
-        xml_with_linebreaks = self.xml().toprettyxml(indent='  ')
-        text_re = re.compile('>\n\s+([^<>\s].*?)\n\s+</', re.DOTALL)
-        output_re = re.compile('\n.*(<output.*>)\n(  )*')
-        prettyXml = text_re.sub('>\g<1></', xml_with_linebreaks)
-        inlineOutput = output_re.sub('\g<1>', prettyXml)
-        inlineOutput = re.compile('<label>\s*\n*\s*\n*\s*</label>')\
-            .sub('<label></label>', inlineOutput)
-        return '<?xml version="1.0"?>\n' + inlineOutput
+        # surveys made by pyxform.incremental reuse the text of the parts
+        # that did not change since the previous version
+        compilation = getattr(self, "_compilation", None)
+        if compilation is not None:
+            return compilation.render()
+        return rendering_xml(self, True, self._shared_pretty_xml)
+
+    def _shared_pretty_xml(self, fp=None):
+        """
+        Write the XForm to the file fp, or return it, from a document that
+        shares the nodes cached for the elements (see rendering_xml).
+        """
+        if fp is not None:
+            return write_pretty_xml(self.xml(), fp)
+        return to_pretty_xml(self.xml())
 
     def __repr__(self):
         return unicode(self)
@@ -388,48 +412,31 @@ class Survey(Section):
         return "<pyxform.survey.Survey instance at %s>" % hex(id(self))
 
     def _setup_xpath_dictionary(self):
-        self._xpath = {}
-        for element in self.iter_descendants():
-            if isinstance(element, Question) or isinstance(element, Section):
-                if element.name in self._xpath:
-                    self._xpath[element.name] = None
-                else:
-                    self._xpath[element.name] = element.get_xpath()
-
-    def _var_repl_function(self, matchobj):
-        """
-        Given a dictionary of xpaths, return a function we can use to
-        replace ${varname} with the xpath to varname.
-        """
-        name = matchobj.group(1)
-        intro = "There has been a problem trying to replace ${%s} with the "\
-            "XPath to the survey element named '%s'." % (name, name)
-        if name not in self._xpath:
-            raise PyXFormError(
-                intro + " There is no survey element with this name.")
-        if self._xpath[name] is None:
-            raise PyXFormError(intro + " There are multiple survey elements"
-                               " with this name.")
-
-        return " " + self._xpath[name] + " "
+        xpaths = {}
+        for element in self.descendant_index().of_class((Question, Section)):
+            if element.name in xpaths:
+                xpaths[element.name] = None
+            else:
+                xpaths[element.name] = element.get_xpath()
+        # the xml cached for the elements is made for the dictionary
+        if xpaths != self._xpath:
+            self._xpath = xpaths
 
-    def insert_xpaths(self, text):
+    def _substitution(self):
         """
-        Replace all instances of ${var} with the xpath to var.
+        The XPathSubstitution for the current xpath dictionary.
         """
-        bracketed_tag = r"\$\{(.*?)\}"
+        substitution = getattr(self, "_xpath_substitution", None)
+        if substitution is None or substitution.xpaths is not self._xpath:
+            substitution = XPathSubstitution(self._xpath)
+            object.__setattr__(self, "_xpath_substitution", substitution)
+        return substitution
 
-        return re.sub(bracketed_tag, self._var_repl_function, unicode(text))
-
-    def _var_repl_output_function(self, matchobj):
+    def insert_xpaths(self, text):
         """
-        A regex substitution function that will replace
-        ${varname} with an output element that has the xpath to varname.
+        Replace all instances of ${var} with the xpath to var.
         """
-#        if matchobj.group(1) not in self._xpath:
-#            raise PyXFormError("There is no survey element with this name.",
-#                            matchobj.group(1))
-        return '<output value="' + self._var_repl_function(matchobj) + '" />'
+        return self._substitution().insert_xpaths(text)
 
     def insert_output_values(self, text):
         """
@@ -437,26 +444,15 @@ class Survey(Section):
         Returns that and a boolean indicating if there were any ${variables}
         present.
         """
-        # There was a bug where escaping is completely turned off in labels
-        # where variable replacement is used.
-        # For exampke, `${name} < 3` causes an error but `< 3` does not.
-        # This is my hacky fix for it, which does string escaping prior to
-        # variable replacement:
-        from xml.dom.minidom import Text
-        text_node = Text()
-        text_node.data = text
-        xml_text = text_node.toxml()
-
-        bracketed_tag = r"\$\{(.*?)\}"
-        # need to make sure we have reason to replace
-        # since at this point < is &lt,
-        # the net effect &lt gets translated again to &amp;lt;
-        if unicode(xml_text).find('{') != -1:
-            result = re.sub(
-                bracketed_tag, self._var_repl_output_function,
-                unicode(xml_text))
-            return result, not result == xml_text
-        return text, False
+        return self._substitution().insert_output_values(text)
+
+    def output_node(self, tag, text, prefix=u"", **attributes):
+        """
+        Returns a tag element holding prefix and text, with the
+        ${variables} in text replaced by <output/> elements.
+        """
+        return self._substitution().output_node(
+            tag, text, prefix, **attributes)
 
     def print_xform_to_file(self, path=None, validate=True, warnings=None):
         """
@@ -467,17 +463,46 @@ class Survey(Section):
             warnings = []
         if not path:
             path = self._print_name + ".xml"
-        fp = codecs.open(path, mode="w", encoding="utf-8")
-        fp.write(self._to_pretty_xml())
-        fp.close()
+        with codecs.open(path, mode="w", encoding="utf-8") as fp:
+            rendering_xml(self, True, self._shared_pretty_xml, fp)
         if validate:
+            from odk_validate import check_xform
             warnings.extend(check_xform(path))
 
-    def to_xml(self, validate=True, warnings=None):
-        with tempfile.NamedTemporaryFile() as tmp:
+    def to_xml(self, validate=True, warnings=None, cache=None):
+        """
+        Return the XForm as a string.
+        If a pyxform.cache.ConversionCache is given, the XForm of a survey
+        with the same content is taken from it instead of being generated
+        (and validated) again.
+        """
+        key = None
+        if warnings is None:
+            warnings = []
+        if cache is not None:
+            key = self._cache_key(cache, validate=validate)
+            entry = cache.get(key)
+            if entry is not None:
+                warnings.extend(entry[u"warnings"])
+                return entry[u"xform"]
+        warnings_start = len(warnings)
+        # the xml is rendered once, validation reads the same string
+        xml = self._to_pretty_xml()
+        if validate:
             # this will throw an exception if the xml is not valid
-            self.print_xform_to_file(tmp.name, validate=validate, warnings=warnings)
-        return self._to_pretty_xml()
+            from odk_validate import check_xform_string
+            warnings.extend(check_xform_string(xml))
+        if key is not None:
+            cache.set(key, make_entry(xml, warnings[warnings_start:]))
+        return xml
+
+    def _cache_key(self, cache, **options):
+        json_dict = self.to_json_dict()
+        # these are derived from the rest of the survey while generating xml
+        json_dict.pop(u"_xpath", None)
+        json_dict.pop(u"_translations", None)
+        return cache.make_key(
+            json.dumps(json_dict, sort_keys=True), **options)
 
     def instantiate(self):
         """
@@ -510,7 +535,7 @@ class Survey(Section):
         Wrapper around 'pyxform.survey_to_xlsform.to_xls'; see that function for
         documentation.
         '''
-
+        import pyxform.survey_to_xlsform
         return pyxform.survey_to_xlsform.to_xls(self, path, warnings=warnings)
 
 
@@ -519,7 +544,7 @@ class Survey(Section):
         Wrapper around 'pyxform.survey_to_xlsform.to_csv'; see that function for
         documentation.
         '''
-
+        import pyxform.survey_to_xlsform
         return pyxform.survey_to_xlsform.to_csv(self, path, warnings=warnings, koboform=koboform)
 
 
@@ -528,7 +553,7 @@ class Survey(Section):
         Wrapper around 'pyxform.survey_to_xlsform.to_ssjson'; see that function for
         documentation.
         '''
-
+        import pyxform.survey_to_xlsform
         return pyxform.survey_to_xlsform.to_ssjson(self, path, warnings=warnings)
 
     @staticmethod
@@ -544,7 +569,7 @@ class Survey(Section):
 
         :Example: Survey.from_xform('/path/to/xform.xml')
         '''
-        
+        import pyxform.xform2json
         survey= pyxform.xform2json.XFormToDictBuilder(path=path, filelike_obj=filelike_obj, warnings=warnings).survey()
         return survey
 
@@ -563,6 +588,7 @@ class Survey(Section):
         '''
         
         # Convert the XLS to JSON then import the JSON ...such a kludge.
+        import pyxform.xls2json_backends
         if path:
             workbook_dict= pyxform.xls2json_backends.xls_to_dict(path)
         elif filelike_obj:
@@ -587,6 +613,7 @@ class Survey(Section):
         '''
 
         # Convert the CSV to JSON then import the JSON ...such a kludge.
+        import pyxform.xls2json_backends
         if path:
             workbook_dict= pyxform.xls2json_backends.csv_to_dict(path)
         elif filelike_obj:
@@ -595,3 +622,6 @@ class Survey(Section):
         survey= pyxform.builder.create_survey_element_from_dict(json_temp)
 
         return survey
+
+
+add_field_properties(Survey)
@@ -1,9 +1,11 @@
 from __future__ import unicode_literals
 import json
 import random
+import hashlib
+from xml.dom.minidom import Node
 
 from . import constants
-from .utils import is_valid_xml_tag, node
+from .utils import is_valid_xml_tag, node, clone_node
 from .xls2json import print_pyobj_to_json
 from .question_type_dictionary import QUESTION_TYPE_DICT
 from .errors import PyXFormError
@@ -11,6 +13,32 @@ from .errors import PyXFormError
 
 RANDOM_SEED= random.seed()
 
+# Changing one of these on any element can change the lineage (and xpath)
+# of its descendants, or which elements are its descendants.
+LINEAGE_KEYS = frozenset([constants.PARENT, constants.NAME, u"flat",
+                          constants.CHILDREN])
+
+# These are derived from the rest of the survey while generating xml, they
+# don't change the xml of its elements (the xpath dictionary is checked on
+# its own).
+DERIVED_KEYS = frozenset([u"_xpath", u"_translations"])
+
+
+def _field_property(key):
+    def get_field(self):
+        return self._field_value(key)
+    return property(get_field)
+
+
+def add_field_properties(cls):
+    """
+    Add a property for each key in cls.FIELDS that is not an attribute yet,
+    which reads faster than falling back on __getattr__.
+    """
+    for key in cls.FIELDS:
+        if not hasattr(cls, key):
+            setattr(cls, key, _field_property(key))
+
 
 def _overlay(over, under):
     if type(under) == dict:
@@ -20,6 +48,72 @@ def _overlay(over, under):
     return over if over else under
 
 
+class ChildList(list):
+    """
+    The children of a survey element. Changing the list in place changes
+    the lineage and the xml of the elements, like setting the children.
+    """
+
+    __slots__ = ()
+
+
+def _changing_children(method):
+    def change(self, *args):
+        SurveyElement._lineage_epoch += 1
+        SurveyElement._change_epoch += 1
+        return method(self, *args)
+    return change
+
+
+for _name in ("append", "extend", "insert", "remove", "pop", "sort",
+              "reverse", "__setitem__", "__delitem__", "__setslice__",
+              "__delslice__", "__iadd__", "__imul__"):
+    setattr(ChildList, _name, _changing_children(getattr(list, _name)))
+del _name
+
+
+class DescendantIndex(object):
+    """
+    The elements of a tree of survey elements in pre-order, as made by
+    iter_descendants, with the elements of each class.
+    The descendants of any element of the tree are a slice of the list.
+    """
+
+    def __init__(self, root):
+        self.elements = []
+        self._spans = {}
+        self._by_class = {}
+        self._add(root)
+
+    def _add(self, element):
+        start = len(self.elements)
+        self.elements.append(element)
+        for child in element.children:
+            self._add(child)
+        # elements are dicts and can't be hashed, their ids are stable
+        # while the list holds them
+        self._spans[id(element)] = (start, len(self.elements))
+
+    def subtree(self, element):
+        """
+        Returns the list of element and its descendants in pre-order.
+        """
+        start, end = self._spans[id(element)]
+        return self.elements[start:end]
+
+    def of_class(self, cls):
+        """
+        Returns the list of the elements that are instances of cls (a class
+        or a tuple of classes), in pre-order.
+        """
+        elements = self._by_class.get(cls)
+        if elements is None:
+            elements = self._by_class[cls] = [
+                element for element in self.elements
+                if isinstance(element, cls)]
+        return elements
+
+
 class SurveyElement(dict):
     """
     SurveyElement is the base class we'll looks for the following keys
@@ -54,33 +148,152 @@ class SurveyElement(dict):
         u"flat": lambda: False, # FIXME: Not a type
     }
 
+    # Elements do not have a __dict__: the slots only hold caches, every
+    # other attribute is stored as a key (see __setattr__). Subclasses
+    # declare empty __slots__ to keep it that way.
+    __slots__ = ("_overlays", "_cached_lineage", "_cached_xpath",
+                 "_cached_xml", "_cached_descendants", "_xml_render")
+
     def __repr__(self, *args, **kwargs):
         return self.get('name', 'UNNAMED ELEMENT')
 
-    def _default(self):
-        # TODO: need way to override question type dictionary
-        defaults = QUESTION_TYPE_DICT
-        return defaults.get(self.get(u"type"), {})
+    @classmethod
+    def _field_defaults(cls):
+        """
+        Sort the FIELDS of this class by how their default is supplied:
+        returns the constant defaults (shared by all elements), the
+        container types (made when first used) and the keys whose default
+        is made when an element is created.
+        """
+        defaults = cls.__dict__.get("_FIELD_DEFAULTS")
+        if defaults is None:
+            constant_defaults = {}
+            container_types = {}
+            eager_keys = []
+            for key, default in cls.FIELDS.items():
+                if default in (dict, list):
+                    container_types[key] = ChildList \
+                        if key == constants.CHILDREN else default
+                    continue
+                value = default()
+                if value is None or type(value) in (unicode, bool):
+                    constant_defaults[key] = value
+                else:
+                    eager_keys.append(key)
+            defaults = (constant_defaults, container_types, eager_keys)
+            cls._FIELD_DEFAULTS = defaults
+        return defaults
+
+    def _field_default(self, key):
+        constant_defaults, container_types = self._field_defaults()[:2]
+        if key in constant_defaults:
+            return constant_defaults[key]
+        return container_types[key]()
+
+    def __missing__(self, key):
+        """
+        Supply the default of a FIELDS key that has not been set. Empty
+        containers are stored, so they can be modified in place.
+        """
+        value = self._field_default(key)
+        if isinstance(value, (dict, list)):
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        if key in self or key in self.FIELDS:
+            return self[key]
+        return default
+
+    def _field_value(self, key):
+        """
+        The value of a FIELDS key, merged with the default from the
+        question type dictionary.
+
+        Merged values are kept while the value of the element is the same,
+        so changes made in place to it are seen. Assign a new value rather
+        than modifying the merged one in place.
+        """
+        try:
+            overlays = self._overlays
+        except AttributeError:
+            overlays = None
+        if overlays and key in overlays:
+            over, value = overlays[key]
+            if key not in self or dict.__getitem__(self, key) == over:
+                return value
+        under = QUESTION_TYPE_DICT.get(dict.get(self, u"type"), {}).get(key)
+        if not under:
+            return self[key]
+        if key in self:
+            over = dict.__getitem__(self, key)
+        else:
+            over = self._field_default(key)
+        value = _overlay(over, under)
+        if overlays is None:
+            overlays = {}
+            object.__setattr__(self, "_overlays", overlays)
+        # a copy of the value merged, to compare the value with later
+        overlays[key] = (over.copy() if type(over) is dict else over, value)
+        return value
 
     def __getattr__(self, key):
         """
         Get attributes from FIELDS rather than the class.
         """
         if key in self.FIELDS:
-            question_type_dict = self._default()
-            under = question_type_dict.get(key, None)
-            over = self.get(key)
-            if not under:
-                return over
-            return _overlay(over, under)
+            return self._field_value(key)
         raise AttributeError(key)
 
     def __setattr__(self, key, value):
         self[key] = value
 
+    # Bumped whenever a key in LINEAGE_KEYS changes on any element, which
+    # invalidates all cached lineages and xpaths.
+    _lineage_epoch = 0
+
+    # Bumped whenever a key not in DERIVED_KEYS changes on any element,
+    # which invalidates all cached xml nodes.
+    _change_epoch = 0
+
+    def __setitem__(self, key, value):
+        if key in LINEAGE_KEYS:
+            SurveyElement._lineage_epoch += 1
+            if key == constants.CHILDREN and type(value) is list:
+                value = ChildList(value)
+        if key not in DERIVED_KEYS:
+            SurveyElement._change_epoch += 1
+        object.__setattr__(self, "_overlays", None)
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        if key in LINEAGE_KEYS:
+            SurveyElement._lineage_epoch += 1
+        if key not in DERIVED_KEYS:
+            SurveyElement._change_epoch += 1
+        object.__setattr__(self, "_overlays", None)
+        dict.__delitem__(self, key)
+
+    def update(self, *args, **kwargs):
+        SurveyElement._lineage_epoch += 1
+        SurveyElement._change_epoch += 1
+        object.__setattr__(self, "_overlays", None)
+        dict.update(self, *args, **kwargs)
+        children = dict.get(self, constants.CHILDREN)
+        if type(children) is list:
+            dict.__setitem__(self, constants.CHILDREN, ChildList(children))
+
+    def __getstate__(self):
+        # the slots only hold caches, the keys are pickled as dict items
+        return None
+
     def __init__(self, **kwargs):
+        eager_keys = self._field_defaults()[2]
         for key, default in self.FIELDS.items():
-            self[key] = kwargs.get(key, default())
+            if key in kwargs:
+                self[key] = kwargs[key]
+            elif key in eager_keys:
+                self[key] = default()
         self._link_children()
 
         #Create a space label for unlabeled elements with the label appearance tag.
@@ -139,35 +352,71 @@ class SurveyElement(dict):
         For the time being this survery_element is included among its descendants
         """
         # it really seems like this method should not yield self
-        yield self
-        for e in self.children:
-            for f in e.iter_descendants():
-                yield f
+        stack = [self]
+        while stack:
+            element = stack.pop()
+            yield element
+            stack.extend(reversed(element.children))
+
+    def descendant_index(self):
+        """
+        Returns the DescendantIndex of this element and its descendants.
+        It is made once and reused until the next change to a parent,
+        children (in place too, see ChildList), name or flat flag, so the
+        passes over a survey share it.
+        """
+        cached = getattr(self, "_cached_descendants", None)
+        if cached is None or cached[0] != SurveyElement._lineage_epoch:
+            cached = (SurveyElement._lineage_epoch, DescendantIndex(self))
+            object.__setattr__(self, "_cached_descendants", cached)
+        return cached[1]
+
+    def _descendants(self):
+        """
+        The list of this element and its descendants in pre-order, a slice
+        of the index of the whole survey.
+        """
+        return self.get_root().descendant_index().subtree(self)
+
+    def _lineage(self):
+        """
+        Return the lineage as a tuple, reusing the one computed for the
+        parent. It is cached on the element until the next change to a
+        parent, name or flat flag.
+        """
+        cached = getattr(self, "_cached_lineage", None)
+        if cached is None or cached[0] != SurveyElement._lineage_epoch:
+            parent = self.get("parent")
+            if not parent:
+                lineage = (self,)
+            #For some reason the root element has a True flat property...
+            elif self.get("flat"):
+                lineage = parent._lineage()
+            else:
+                lineage = parent._lineage() + (self,)
+            cached = (SurveyElement._lineage_epoch, lineage)
+            object.__setattr__(self, "_cached_lineage", cached)
+        return cached[1]
 
     def get_lineage(self):
         """
         Return a the list [root, ..., self._parent, self]
         """
-        result = [self]
-        current_element = self
-        while current_element.parent:
-            current_element = current_element.parent
-            result = [current_element] + result
-        #For some reason the root element has a True flat property...
-        output = [result[0]]
-        for item in result[1:]:
-            if not item.get(u"flat"):
-                output.append(item)
-        return output
+        return list(self._lineage())
 
     def get_root(self):
-        return self.get_lineage()[0]
+        return self._lineage()[0]
 
     def get_xpath(self):
         """
         Return the xpath of this survey element.
         """
-        return u"/".join([u""] + [n.name for n in self.get_lineage()])
+        cached = getattr(self, "_cached_xpath", None)
+        if cached is None or cached[0] != SurveyElement._lineage_epoch:
+            cached = (SurveyElement._lineage_epoch,
+                      "/".join([""] + [n.name for n in self._lineage()]))
+            object.__setattr__(self, "_cached_xpath", cached)
+        return cached[1]
 
     def get_abbreviated_xpath(self):
         lineage = self.get_lineage()
@@ -176,13 +425,27 @@ class SurveyElement(dict):
         else:
             return lineage[0].name
 
+    def _as_dict(self):
+        """
+        Returns a plain dict with every key in FIELDS, like an element
+        holding all its defaults.
+        """
+        result = {}
+        for key in self.FIELDS:
+            result[key] = self[key]
+        for key, value in self.iteritems():
+            if key not in self.FIELDS:
+                result[key] = value
+        # a copy, so the order of the keys is that of a copied element
+        return result.copy()
+
     def to_json_dict(self):
         """
         Create a dict copy of this survey element by removing inappropriate attributes
         and converting its children to dicts
         """
         self.validate()
-        result = self.copy()
+        result = self._as_dict()
         to_delete = [u"parent", u"question_type_dictionary", u"_created"]
         for key in to_delete:
             if key in result:
@@ -213,6 +476,18 @@ class SurveyElement(dict):
     def _translation_path(self, display_element):
         return self.get_xpath() + ":" + display_element
 
+    def _itext_ref(self, display_element):
+        """
+        Returns the jr:itext() reference to the translations of
+        display_element, through the id of the text it shares if the
+        survey shares its itext.
+        """
+        path = self._translation_path(display_element)
+        itext_ids = getattr(self.get_root(), "_itext_ids", None)
+        if itext_ids:
+            path = itext_ids.get(path, path)
+        return "jr:itext('%s')" % path
+
     def get_translations(self, default_language):
         """
         Returns translations used by this element so they can be included in the <itext> block
@@ -281,21 +556,16 @@ class SurveyElement(dict):
         if self.needs_itext_ref():
             #If there is a dictionary label, or non-empty media dict,
             #then we need to make a label with an itext ref
-            ref = "jr:itext('%s')" % self._translation_path(u"label")
-            return node(u"label", ref=ref)
+            return node(u"label", ref=self._itext_ref(u"label"))
         else:
             survey = self.get_root()
-            label, outputInserted = survey.insert_output_values(self.label)
-            return node(u"label", label, toParseString=outputInserted)
+            return survey.output_node(u"label", self.label)
 
     def xml_hint(self):
         if type(self.hint) == dict:
-            path = self._translation_path("hint")
-            return node(u"hint", ref="jr:itext('%s')" % path)
+            return node(u"hint", ref=self._itext_ref(u"hint"))
         else:
-            hint, outputInserted = self.get_root().insert_output_values(
-                self.hint)
-            return node(u"hint", hint, toParseString=outputInserted)
+            return self.get_root().output_node(u"hint", self.hint)
 
     def xml_label_and_hint(self):
         """
@@ -329,11 +599,11 @@ class SurveyElement(dict):
                 if hashable(v) and v in self.binding_conversions:
                     v = self.binding_conversions[v]
                 if k == u'jr:constraintMsg' and type(v) is dict:
-                    v = "jr:itext('%s')" % self._translation_path(u'jr:constraintMsg')
+                    v = self._itext_ref(u'jr:constraintMsg')
                 if k == u'jr:requiredMsg' and type(v) is dict:
-                    v = "jr:itext('%s')" % self._translation_path(u'jr:requiredMsg')
+                    v = self._itext_ref(u'jr:requiredMsg')
                 if k == u'jr:noAppErrorString' and type(v) is dict:
-                    v = "jr:itext('%s')" % self._translation_path(u'jr:noAppErrorString')
+                    v = self._itext_ref(u'jr:noAppErrorString')
                 bind_dict[k] = survey.insert_xpaths(v)
             return node(constants.BIND, nodeset=self.get_xpath(), **bind_dict)
         return None
@@ -343,12 +613,66 @@ class SurveyElement(dict):
         Return a list of bindings for this node and all its descendants.
         """
         result = []
-        for e in self.iter_descendants():
-            xml_binding = e.xml_binding()
+        for e in self._descendants():
+            xml_binding = e.cached_xml(u"xml_binding")
             if xml_binding != None:
                 result.append(xml_binding)
         return result
 
+    def cached_xml(self, method_name):
+        """
+        Returns the node made by the xml method method_name (xml_binding,
+        xml_control or xml_instance). In a render (see rendering_xml) the
+        node made in a previous render is reused if the content of the
+        survey is the same, even changed in place, and the survey has the
+        same xpath dictionary.
+
+        A copy of the stored node is returned, so the documents made from
+        it can be kept and changed, unless the render shares the nodes.
+        """
+        root = self.get_root()
+        render = getattr(root, "_xml_render", None)
+        if render is None:
+            return getattr(self, method_name)()
+        share, fingerprint = render
+        epoch = SurveyElement._change_epoch
+        xpaths = dict.get(root, u"_xpath")
+        cached = getattr(self, "_cached_xml", None)
+        if cached is None or cached[0] != epoch or \
+                cached[1] != fingerprint or cached[2] is not xpaths:
+            cached = (epoch, fingerprint, xpaths, {})
+            object.__setattr__(self, "_cached_xml", cached)
+        nodes = cached[3]
+        if method_name not in nodes:
+            result = getattr(self, method_name)()
+            if SurveyElement._change_epoch != epoch:
+                return result
+            nodes[method_name] = result
+        result = nodes[method_name]
+        if isinstance(result, Node) and not share:
+            return clone_node(result)
+        return result
+
+    def _content_fingerprint(self):
+        """
+        A digest of the values of this element and its descendants, apart
+        from those in DERIVED_KEYS and the empty containers stored for
+        defaults. The children are represented by their names and added
+        on their own.
+        """
+        digest = hashlib.sha1()
+        for element in self.iter_descendants():
+            # in order, storing a default can reorder the keys
+            for key, value in sorted(dict.iteritems(element)):
+                if key in DERIVED_KEYS or key == constants.PARENT or \
+                        (not value and isinstance(value, (dict, list))):
+                    continue
+                if key == constants.CHILDREN:
+                    value = [dict.get(child, constants.NAME)
+                             for child in value]
+                digest.update(repr((key, value)))
+        return digest.digest()
+
     def xml_control(self):
         """
         The control depends on what type of question we're asking, it
@@ -410,6 +734,32 @@ class SurveyElement(dict):
         return label
 
 
+add_field_properties(SurveyElement)
+
+
+def rendering_xml(element, share, function, *args):
+    """
+    Returns function(*args), a render of the xml of the survey of element:
+    while it runs, cached_xml reuses the nodes made for the elements in
+    the previous renders of a survey with the same content. With share,
+    cached_xml gives the stored nodes instead of copies. The nodes then
+    end up in the documents made, which must be written out at once and
+    not kept: the next document made takes the nodes out of them.
+
+    The render is recorded on the root of the survey, which is rendered by
+    one thread at a time. A render started during another one joins it.
+    """
+    root = element.get_root()
+    if getattr(root, "_xml_render", None) is not None:
+        return function(*args)
+    object.__setattr__(root, "_xml_render",
+                       (share, root._content_fingerprint()))
+    try:
+        return function(*args)
+    finally:
+        object.__setattr__(root, "_xml_render", None)
+
+
 def hashable(v):
     """Determine whether `v` can be hashed."""
     try:
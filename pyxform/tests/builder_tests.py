@@ -585,3 +585,106 @@ class BuilderTests(TestCase):
             [c for c in root_elm.getchildren()])
         self.assertEqual(len(body_elms), 1)
         self.assertEqual(body_elms[0].get('class'), 'ltr')
+
+    def test_shared_choices_are_not_changed(self):
+        choices = [{u"name": u"yes", u"label": u"Yes"},
+                   {u"name": u"no", u"label": u"No"}]
+        bind = {u"required": u"yes"}
+        survey_dict = {
+            u"type": u"survey",
+            u"name": u"shared",
+            u"id_string": u"shared",
+            u"add_none_option": True,
+            u"children": [
+                {u"type": u"select one or specify other",
+                 u"name": u"q1", u"label": u"Q1", u"choices": choices},
+                {u"type": u"select all that apply",
+                 u"name": u"q2", u"label": u"Q2", u"choices": choices,
+                 u"bind": bind},
+                {u"type": u"select one",
+                 u"name": u"q3", u"label": u"Q3", u"choices": choices},
+            ]
+        }
+        builder = SurveyElementBuilder()
+        survey = builder.create_survey_element_from_dict(survey_dict)
+        self.assertEqual(
+            [[c.name for c in q.children] for q in survey.children],
+            [[u"yes", u"no", u"other"], [], [u"yes", u"no", u"none"],
+             [u"yes", u"no"]])
+        self.assertEqual(len(choices), 2)
+        self.assertEqual(bind, {u"required": u"yes"})
+        self.assertEqual(
+            SurveyElementBuilder().create_survey_element_from_dict(
+                survey_dict).to_xml(validate=False),
+            survey.to_xml(validate=False))
+
+    def test_shared_choices(self):
+        yes_no = [{u"name": u"yes", u"label": u"Yes"},
+                  {u"name": u"no", u"label": u"No"}]
+        survey_dict = {
+            u"type": u"survey",
+            u"name": u"shared",
+            u"id_string": u"shared",
+            u"children": [
+                {u"type": u"select one", u"name": u"q1", u"label": u"Q1",
+                 u"choices": yes_no},
+                {u"type": u"group", u"name": u"g", u"label": u"G",
+                 u"children": [
+                     {u"type": u"select all that apply", u"name": u"q2",
+                      u"label": u"Q2", u"choices": yes_no}]},
+                {u"type": u"select one or specify other", u"name": u"q3",
+                 u"label": u"Q3", u"choices": yes_no},
+                {u"type": u"select one", u"name": u"q4", u"label": u"Q4",
+                 u"choices": [{u"name": u"a", u"label": u"A"}]},
+            ]
+        }
+        survey = SurveyElementBuilder(
+            shared_choices=True).create_survey_element_from_dict(survey_dict)
+        q1, group, q3 = survey.children[:3]
+        q2 = group.children[0]
+        self.assertEqual((q1.itemset, q2.itemset), (u"q1", u"q1"))
+        self.assertEqual((q1.children, q2.children), ([], []))
+        # lists used by a single select keep their options
+        self.assertEqual(q3.itemset, u"")
+        self.assertEqual([c.name for c in q3.children],
+                         [u"yes", u"no", u"other"])
+        self.assertIs(survey.choices[u"q1"], yes_no)
+        self.assertEqual(survey.choices.keys(), [u"q1"])
+        xml = survey.to_xml(validate=False)
+        self.assertEqual(xml.count(u'<instance id="q1">'), 1)
+        self.assertEqual(
+            xml.count(u"""<itemset nodeset="instance('q1')/root/item">"""),
+            2)
+        survey_json = survey.to_json_dict()
+        self.assertEqual(survey_json[u"choices"], {u"q1": yes_no})
+        self.assertNotIn(u"choices", survey_json[u"children"][0])
+        # the json builds the same survey
+        self.assertEqual(
+            SurveyElementBuilder().create_survey_element_from_dict(
+                survey_json).to_xml(validate=False), xml)
+
+    def test_shared_or_other_choices_are_translated(self):
+        yes_no = [
+            {u"name": u"yes", u"label": {u"English": u"Yes",
+                                         u"French": u"Oui"}},
+            {u"name": u"no", u"label": {u"English": u"No",
+                                        u"French": u"Non"}}]
+        survey_dict = {
+            u"type": u"survey",
+            u"name": u"shared",
+            u"id_string": u"shared",
+            u"children": [
+                {u"type": u"select one or specify other",
+                 u"name": u"q%d" % i,
+                 u"label": {u"English": u"Q", u"French": u"Q"},
+                 u"choices": yes_no} for i in range(2)]
+        }
+        survey = SurveyElementBuilder(
+            shared_choices=True).create_survey_element_from_dict(survey_dict)
+        choice_list, = survey.choices.values()
+        other = choice_list[-1]
+        self.assertEqual(other[u"label"],
+                         {u"English": u"Other", u"French": u"Other"})
+        xml = survey.to_xml(validate=False)
+        self.assertEqual(xml.count(u"<value>Other</value>"), 2)
+        self.assertNotIn(u"<value>-</value>", xml)
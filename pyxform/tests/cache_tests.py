@@ -0,0 +1,106 @@
+"""
+Testing the conversion cache.
+"""
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+import codecs
+import utils
+from pyxform.builder import create_survey_from_path
+from pyxform.cache import ConversionCache, MemoryStore, DirectoryStore, \
+    make_entry
+from pyxform.xls2xform import xls2xform_convert
+
+
+class ConversionCacheTests(TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_xls2xform_convert_hit(self):
+        cache = ConversionCache()
+        xlsform_path = utils.path_to_text_fixture("select_one_external.xlsx")
+        xform_path = os.path.join(self.output_dir, "select_one_external.xml")
+        itemsets_path = os.path.join(self.output_dir, "itemsets.csv")
+        warnings = xls2xform_convert(
+            xlsform_path, xform_path, validate=False, cache=cache)
+        with codecs.open(xform_path, encoding="utf-8") as xform_file:
+            expected_xform = xform_file.read()
+        with open(itemsets_path, 'rb') as itemsets_file:
+            expected_itemsets = itemsets_file.read()
+        os.remove(xform_path)
+        os.remove(itemsets_path)
+        self.assertEqual(cache.stats()[u"misses"], 1)
+
+        self.assertEqual(warnings, xls2xform_convert(
+            xlsform_path, xform_path, validate=False, cache=cache))
+        self.assertEqual(cache.stats()[u"hits"], 1)
+        with codecs.open(xform_path, encoding="utf-8") as xform_file:
+            self.assertMultiLineEqual(expected_xform, xform_file.read())
+        with open(itemsets_path, 'rb') as itemsets_file:
+            self.assertEqual(expected_itemsets, itemsets_file.read())
+
+    def test_file_name_is_part_of_the_key(self):
+        cache = ConversionCache()
+        xlsform_path = utils.path_to_text_fixture("yes_or_no_question.xls")
+        xform_path = os.path.join(self.output_dir, "form.xml")
+        for name in ["first", "second"]:
+            copy_path = os.path.join(self.output_dir, name + ".xls")
+            shutil.copy(xlsform_path, copy_path)
+            xls2xform_convert(copy_path, xform_path, validate=False,
+                              cache=cache)
+            with codecs.open(xform_path, encoding="utf-8") as xform_file:
+                self.assertIn(u'id="%s"' % name, xform_file.read())
+        self.assertEqual(cache.stats()[u"misses"], 2)
+
+    def test_options_are_part_of_the_key(self):
+        cache = ConversionCache()
+        self.assertNotEqual(
+            cache.make_key("form", validate=True),
+            cache.make_key("form", validate=False))
+        self.assertEqual(
+            cache.make_key("form", validate=True, default_language=u"en"),
+            cache.make_key("form", default_language=u"en", validate=True))
+
+    def test_to_xml_hit(self):
+        cache = ConversionCache()
+        path = utils.path_to_text_fixture("yes_or_no_question.xls")
+        xml = create_survey_from_path(path).to_xml(
+            validate=False, cache=cache)
+        self.assertEqual(xml, create_survey_from_path(path).to_xml(
+            validate=False, cache=cache))
+        self.assertEqual(cache.stats()[u"hits"], 1)
+        self.assertEqual(cache.stats()[u"misses"], 1)
+
+    def test_memory_store_eviction(self):
+        store = MemoryStore(max_entries=2)
+        for key in ["a", "b", "c"]:
+            store.set(key, make_entry(u"<h:html/>"))
+            # keep "a" the most recently used entry
+            store.get("a")
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get("b"))
+        self.assertIsNotNone(store.get("a"))
+        self.assertEqual(store.evictions, 1)
+
+        store = MemoryStore(max_entries=None, max_bytes=10)
+        store.set("a", make_entry(u"12345678"))
+        store.set("b", make_entry(u"1234", itemsets="12"))
+        self.assertIsNone(store.get("a"))
+        self.assertEqual(len(store), 1)
+
+    def test_directory_store(self):
+        store = DirectoryStore(self.output_dir, max_entries=1)
+        entry = make_entry(u"<h:html>\u00e9</h:html>", [u"warning"],
+                           itemsets="\"list_name\"\r\n")
+        store.set("a", entry)
+        self.assertEqual(
+            DirectoryStore(self.output_dir).get("a"), entry)
+        store.set("b", entry)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.evictions, 1)
+        self.assertIsNone(store.get("missing"))
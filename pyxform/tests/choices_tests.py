@@ -0,0 +1,96 @@
+"""
+Testing the choice lists and the checks of the choices sheet.
+"""
+from unittest2 import TestCase
+import json
+import pickle
+from pyxform.choices import ChoiceList, group_choice_lists
+from pyxform.errors import PyXFormError
+from pyxform.xls2json import workbook_to_json
+
+
+class ChoiceListTests(TestCase):
+
+    def setUp(self):
+        self.choice_lists = group_choice_lists([
+            {u"list name": u"yes_no", u"name": u"yes", u"label": u"Yes"},
+            {u"list name": u"yes_no", u"name": u"no", u"label": u"No"},
+            {u"list name": u"colors", u"name": u"dark red"},
+            {u"name": u"orphan", u"label": u"Orphan"}])
+
+    def test_group_choice_lists(self):
+        self.assertEqual(self.choice_lists, {
+            u"yes_no": [{u"name": u"yes", u"label": u"Yes"},
+                        {u"name": u"no", u"label": u"No"}],
+            u"colors": [{u"name": u"dark red"}]})
+        self.assertEqual(self.choice_lists[u"yes_no"].list_name, u"yes_no")
+
+    def test_index(self):
+        yes_no = self.choice_lists[u"yes_no"]
+        self.assertEqual(yes_no.names, {u"yes": 0, u"no": 1})
+        self.assertEqual(yes_no.get_choice(u"no"),
+                         {u"name": u"no", u"label": u"No"})
+        self.assertIsNone(yes_no.get_choice(u"maybe"))
+        self.assertIn({u"name": u"no", u"label": u"No"}, yes_no)
+        self.assertNotIn({u"name": u"no", u"label": u"Nope"}, yes_no)
+        colors = self.choice_lists[u"colors"]
+        self.assertEqual(colors.names_with_spaces, [u"dark red"])
+        self.assertEqual((colors.unnamed, colors.unlabelled), (0, 1))
+
+    def test_index_is_rebuilt_after_changes(self):
+        yes_no = self.choice_lists[u"yes_no"]
+        self.assertEqual(yes_no.unlabelled, 0)
+        yes_no.append({u"name": u"maybe"})
+        self.assertEqual(yes_no.unlabelled, 1)
+        del yes_no[0]
+        self.assertEqual(yes_no.names, {u"no": 0, u"maybe": 1})
+
+    def test_serialization(self):
+        yes_no = self.choice_lists[u"yes_no"]
+        self.assertEqual(json.loads(json.dumps(yes_no)), yes_no)
+        for protocol in [0, 2]:
+            copy = pickle.loads(pickle.dumps(yes_no, protocol))
+            self.assertIsInstance(copy, ChoiceList)
+            self.assertEqual(copy, yes_no)
+            self.assertEqual(copy.list_name, u"yes_no")
+            self.assertEqual(copy.names, yes_no.names)
+
+
+class ChoicesSheetTests(TestCase):
+
+    def test_selects_share_the_choice_list(self):
+        json_dict = workbook_to_json({
+            u"survey": [
+                {u"type": u"select_one yes_no", u"name": u"q1",
+                 u"label": u"Q1"},
+                {u"type": u"select_one yes_no", u"name": u"q2",
+                 u"label": u"Q2"}],
+            u"choices": [
+                {u"list_name": u"yes_no", u"name": u"yes", u"label": u"Yes"},
+                {u"list_name": u"yes_no", u"name": u"no", u"label": u"No"}]})
+        q1, q2 = json_dict[u"children"][:2]
+        self.assertIs(q1[u"choices"], q2[u"choices"])
+
+    def test_select_multiple_choice_names_with_spaces(self):
+        with self.assertRaisesRegexp(PyXFormError, r"See \[dark red\]"):
+            workbook_to_json({
+                u"survey": [{u"type": u"select_multiple colors",
+                             u"name": u"colors", u"label": u"Colors"}],
+                u"choices": [{u"list_name": u"colors", u"name": u"dark red",
+                              u"label": u"Dark red"}]})
+
+    def test_choice_warnings(self):
+        warnings = []
+        with self.assertRaisesRegexp(PyXFormError, u"option with no name"):
+            workbook_to_json({
+                u"survey": [{u"type": u"select_one colors",
+                             u"name": u"color", u"label": u"Color"}],
+                u"choices": [{u"list_name": u"colors", u"label": u"Red"}]})
+        workbook_to_json({
+            u"survey": [{u"type": u"select_one colors",
+                         u"name": u"color", u"label": u"Color"}],
+            u"choices": [{u"list_name": u"colors", u"name": u"red",
+                          u"bad header": u"note"}]}, warnings=warnings)
+        self.assertEqual(len(warnings), 2)
+        self.assertIn(u"option with no label", warnings[0])
+        self.assertIn(u"illegal header", warnings[1])
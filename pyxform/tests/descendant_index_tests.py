@@ -0,0 +1,66 @@
+"""
+Testing the index of the descendants of survey elements.
+"""
+from unittest2 import TestCase
+from pyxform import create_survey_element_from_dict
+from pyxform.question import Question, MultipleChoiceQuestion
+from pyxform.section import Section
+
+
+class DescendantIndexTests(TestCase):
+
+    def setUp(self):
+        self.survey = create_survey_element_from_dict({
+            u"type": u"survey", u"name": u"data", u"children": [
+                {u"type": u"group", u"name": u"group", u"children": [
+                    {u"type": u"select one", u"name": u"color",
+                     u"label": u"Color", u"choices": [
+                         {u"name": u"red", u"label": u"Red"},
+                         {u"name": u"blue", u"label": u"Blue"}]}]},
+                {u"type": u"text", u"name": u"name", u"label": u"Name"}]})
+
+    def test_index(self):
+        index = self.survey.descendant_index()
+        self.assertEqual(index.elements, list(self.survey.iter_descendants()))
+        self.assertEqual([e.name for e in index.elements],
+                         [u"data", u"group", u"color", u"red", u"blue",
+                          u"name"])
+        self.assertEqual([e.name for e in index.of_class(Section)],
+                         [u"data", u"group"])
+        self.assertEqual([e.name for e in index.of_class(
+            (Question, Section))],
+                         [u"data", u"group", u"color", u"name"])
+        color = index.of_class(MultipleChoiceQuestion)[0]
+        self.assertEqual([e.name for e in index.subtree(color)],
+                         [u"color", u"red", u"blue"])
+        self.assertIs(self.survey.descendant_index(), index)
+
+    def test_index_is_rebuilt_after_changes(self):
+        index = self.survey.descendant_index()
+        group = self.survey.children[0]
+        group.add_child(create_survey_element_from_dict(
+            {u"type": u"integer", u"name": u"age", u"label": u"Age"}))
+        self.assertIsNot(self.survey.descendant_index(), index)
+        self.assertEqual(
+            [e.name for e in self.survey.descendant_index().subtree(group)],
+            [u"group", u"color", u"red", u"blue", u"age"])
+        self.survey.children = self.survey.children[:1]
+        self.assertEqual(len(self.survey.descendant_index().elements), 6)
+
+    def test_index_follows_changes_to_the_children_in_place(self):
+        index = self.survey.descendant_index()
+        group = self.survey.children[0]
+        group.children.append(create_survey_element_from_dict(
+            {u"type": u"integer", u"name": u"age", u"label": u"Age"}))
+        self.assertIsNot(self.survey.descendant_index(), index)
+        self.assertEqual(
+            [e.name for e in self.survey.descendant_index().subtree(group)],
+            [u"group", u"color", u"red", u"blue", u"age"])
+        del self.survey.children[1]
+        self.assertEqual([e.name for e in self.survey.iter_descendants()],
+                         [e.name for e in
+                          self.survey.descendant_index().elements])
+        self.survey.children = list(self.survey.children)
+        self.survey.children.pop()
+        self.assertEqual(self.survey.descendant_index().elements,
+                         [self.survey])
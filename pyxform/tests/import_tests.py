@@ -0,0 +1,54 @@
+"""
+Testing that importing pyxform and generating XForms do not import the
+spreadsheet readers and writers, lxml or the command line modules.
+"""
+from unittest2 import TestCase
+import os
+import sys
+import json
+import subprocess
+
+import pyxform
+
+# modules that take a noticeable part of the pyxform import time
+HEAVY_MODULES = ["xlrd", "xlwt", "lxml", "csv", "zipfile", "argparse",
+                 "multiprocessing", "subprocess", "pyxform.survey_to_xlsform",
+                 "pyxform.xform2json", "pyxform.xls2json_backends",
+                 "pyxform.odk_validate", "pyxform.spss"]
+
+
+def imported_modules(code):
+    """
+    Run code in a new python process and return the heavy modules it
+    imported.
+    """
+    script = code + (
+        "\nimport sys, json\n"
+        "print json.dumps(sorted(name for name in %r"
+        " if sys.modules.get(name) is not None))\n" % HEAVY_MODULES)
+    package_dir = os.path.dirname(os.path.dirname(pyxform.__file__))
+    environment = dict(os.environ, PYTHONPATH=package_dir)
+    output = subprocess.check_output([sys.executable, "-c", script],
+                                     env=environment)
+    return json.loads(output.splitlines()[-1])
+
+
+class ImportTests(TestCase):
+
+    def test_import_pyxform(self):
+        self.assertEqual(imported_modules("import pyxform"), [])
+
+    def test_xform_generation(self):
+        self.assertEqual(imported_modules(
+            "from pyxform import create_survey_element_from_dict\n"
+            "survey = create_survey_element_from_dict({\n"
+            "    'type': 'survey', 'name': 'data', 'children': [\n"
+            "        {'type': 'integer', 'name': 'age', 'label': 'Age'}]})\n"
+            "survey.to_xml(validate=False)\n"), [])
+
+    def test_spreadsheets_are_read_when_needed(self):
+        xls_path = os.path.join(os.path.dirname(__file__), "example_xls",
+                                "yes_or_no_question.xls")
+        self.assertIn("xlrd", imported_modules(
+            "from pyxform import create_survey_from_path\n"
+            "create_survey_from_path(%r)\n" % xls_path))
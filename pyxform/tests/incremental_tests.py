@@ -0,0 +1,114 @@
+"""
+Testing that recompiling a survey after changes to its sheets gives the
+XForm of a full conversion of the changed workbook.
+"""
+from unittest2 import TestCase
+import copy
+
+from pyxform.builder import create_survey_element_from_dict
+from pyxform.errors import PyXFormError
+from pyxform.incremental import compile_workbook, recompile, apply_changes, \
+    INSERT, UPDATE, DELETE
+from pyxform.xls2json import workbook_to_json
+
+WORKBOOK = {
+    u"survey": [
+        {u"type": u"text", u"name": u"name",
+         u"label::English": u"Name", u"label::French": u"Nom"},
+        {u"type": u"begin group", u"name": u"details",
+         u"label::English": u"Details of ${name}"},
+        {u"type": u"select_one yes_no", u"name": u"likes_pizza",
+         u"label::English": u"Does ${name} like pizza?",
+         u"label::French": u"${name} aime la pizza ?"},
+        {u"type": u"integer", u"name": u"slices",
+         u"label::English": u"Slices", u"relevant": u"${likes_pizza} = 'yes'"},
+        {u"type": u"end group"},
+        {u"type": u"note", u"name": u"thanks",
+         u"label::English": u"Thanks", u"hint::English": u"Goodbye"},
+    ],
+    u"choices": [
+        {u"list_name": u"yes_no", u"name": u"yes",
+         u"label::English": u"Yes", u"label::French": u"Oui"},
+        {u"list_name": u"yes_no", u"name": u"no",
+         u"label::English": u"No", u"label::French": u"Non"},
+    ],
+}
+
+
+def convert(workbook_dict):
+    json_dict = workbook_to_json(copy.deepcopy(workbook_dict), u"data")
+    return create_survey_element_from_dict(json_dict).to_xml(validate=False)
+
+
+class IncrementalTests(TestCase):
+
+    maxDiff = None
+
+    def setUp(self):
+        self.survey = compile_workbook(WORKBOOK, u"data")
+        self.xform = self.survey.to_xml(validate=False)
+
+    def assertRecompiles(self, changes):
+        survey = recompile(self.survey, changes)
+        self.assertMultiLineEqual(
+            survey.to_xml(validate=False),
+            convert(apply_changes(WORKBOOK, changes)))
+        return survey
+
+    def test_compile_workbook(self):
+        self.assertMultiLineEqual(self.xform, convert(WORKBOOK))
+        # the second time the text of every part is reused
+        self.assertMultiLineEqual(self.survey.to_xml(validate=False),
+                                  self.xform)
+
+    def test_unchanged_elements_are_reused(self):
+        name, details, thanks = self.survey.children[:3]
+        survey = self.assertRecompiles({u"survey": [
+            (UPDATE, 5, {u"type": u"note", u"name": u"thanks",
+                         u"label::English": u"Thank you"})]})
+        self.assertIs(survey.children[0], name)
+        self.assertIs(survey.children[1], details)
+        self.assertIsNot(survey.children[2], thanks)
+        self.assertIs(name.parent, survey)
+
+    def test_row_changes(self):
+        self.assertRecompiles({
+            u"survey": [
+                (INSERT, 4, {u"type": u"decimal", u"name": u"price",
+                             u"label::English": u"Price ${slices}"}),
+                (DELETE, 6)],
+            u"choices": [
+                (UPDATE, 1, {u"list_name": u"yes_no", u"name": u"no",
+                             u"label::English": u"Nope"})]})
+
+    def test_settings_changes(self):
+        self.assertRecompiles({u"settings": [
+            (INSERT, 0, {u"form_title": u"Pizza",
+                         u"default_language": u"French"})]})
+
+    def test_referenced_names(self):
+        # the group and the select referencing the name are written again
+        survey = self.assertRecompiles({u"survey": [
+            (UPDATE, 0, {u"type": u"text", u"name": u"first_name",
+                         u"label::English": u"Name"}),
+            (INSERT, 6, {u"type": u"text", u"name": u"name",
+                         u"label::English": u"Other name"})]})
+        survey = recompile(survey, {u"survey": [(DELETE, 6)]})
+        with self.assertRaisesRegexp(PyXFormError, u"no survey element"):
+            survey.to_xml(validate=False)
+
+    def test_recompile_errors(self):
+        survey = create_survey_element_from_dict(
+            workbook_to_json(copy.deepcopy(WORKBOOK), u"data"))
+        self.assertRaises(PyXFormError, recompile, survey, {})
+        recompile(self.survey, {})
+        self.assertRaises(PyXFormError, recompile, self.survey, {})
+        with self.assertRaisesRegexp(PyXFormError, u"no row 7"):
+            apply_changes(WORKBOOK, {u"survey": [(DELETE, 7)]})
+
+    def test_shared_itext(self):
+        workbook_dict = dict(WORKBOOK,
+                             settings=[{u"shared_itext": u"yes"}])
+        survey = compile_workbook(workbook_dict, u"data")
+        self.assertMultiLineEqual(survey.to_xml(validate=False),
+                                  convert(workbook_dict))
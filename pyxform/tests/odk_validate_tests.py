@@ -1,6 +1,13 @@
-from pyxform.odk_validate import _cleanup_errors
+from pyxform.odk_validate import _cleanup_errors, ValidateWorker, \
+    check_xforms, _private_directory, _validate_classpath, _java_installed
 
 from unittest2 import TestCase
+from subprocess import Popen, PIPE
+import signal
+import sys
+import os
+import stat
+import shutil
 
 
 class ODKValidateTests(TestCase):
@@ -56,3 +63,84 @@ XPath evaluation: cannot handle function 'testfunc'
 >> Something broke the parser. See above for a hint.
 Result: Invalid"""
         self.assertEqual(_cleanup_errors(testStr), expectedStr.strip())
+
+
+
+# Stands in for the ValidateServer JVM, speaking the same protocol.
+FAKE_VALIDATE_SERVER = """
+import sys, time
+for path in iter(sys.stdin.readline, ''):
+    if 'slow' in path:
+        time.sleep(30)
+    sys.stdout.write('1 3 %d\\nout' % (len(path) - 1) + path.strip())
+    sys.stdout.flush()
+"""
+
+
+class ValidateWorkerTests(TestCase):
+    def start_fake_server(self, worker):
+        worker._process = Popen([sys.executable, '-c', FAKE_VALIDATE_SERVER],
+                                stdin=PIPE, stdout=PIPE)
+
+    def test_worker_reads_responses(self):
+        worker = ValidateWorker(timeout=10)
+        self.start_fake_server(worker)
+        self.assertEqual(worker.validate(u"a.xml"), (1, False, "out", "a.xml"))
+        self.assertEqual(worker.validate("bb.xml"),
+                         (1, False, "out", "bb.xml"))
+        worker.stop()
+
+    def test_worker_timeout(self):
+        worker = ValidateWorker(timeout=1)
+        self.start_fake_server(worker)
+        self.assertEqual(worker.validate("slow.xml"),
+                         (-signal.SIGKILL, True, "", ""))
+        self.assertIsNone(worker._process)
+
+
+class ValidateClasspathTests(TestCase):
+    def test_private_directory(self):
+        name = "pyxform-test-%d" % os.getpid()
+        directory = _private_directory(name)
+        try:
+            self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0700)
+            self.assertEqual(_private_directory(name), directory)
+            # a directory others can write to is not trusted
+            os.chmod(directory, 0777)
+            other = _private_directory(name)
+            self.assertNotEqual(other, directory)
+            self.assertEqual(stat.S_IMODE(os.stat(other).st_mode), 0700)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_extracted_jars_are_checked(self):
+        classpath = _validate_classpath()
+        self.assertTrue(len(classpath) > 1)
+        with open(classpath[1], 'rb') as jar_file:
+            content = jar_file.read()
+        with open(classpath[1], 'wb') as jar_file:
+            jar_file.write("changed")
+        self.assertEqual(_validate_classpath(), classpath)
+        with open(classpath[1], 'rb') as jar_file:
+            self.assertEqual(jar_file.read(), content)
+
+
+DIR = os.path.dirname(__file__)
+
+
+class CheckXFormsTests(TestCase):
+    def setUp(self):
+        if not _java_installed():
+            self.skipTest("ODK Validate needs java")
+
+    def test_check_xforms(self):
+        paths = [os.path.join(DIR, "test_expected_output", filename)
+                 for filename in ["geo.xml", "or_other.xml", "widgets.xml"]]
+        paths.append(os.path.join(DIR, "example_xls", "group.xls"))
+        results = dict((path, (warnings, error)) for path, warnings, error
+                       in check_xforms(paths, workers=2))
+        self.assertEqual(sorted(results.keys()), sorted(paths))
+        for path in paths[:3]:
+            self.assertIsNone(results[path][1])
+        self.assertIsNone(results[paths[3]][0])
+        self.assertIn('ODK Validate Errors', unicode(results[paths[3]][1]))
@@ -0,0 +1,146 @@
+"""
+Testing the conversion service.
+"""
+from unittest2 import TestCase
+import os
+import json
+import shutil
+import signal
+import socket
+import httplib
+import tempfile
+import threading
+import utils
+from pyxform.server import ConversionService, make_server
+
+
+def read_fixture(file_name):
+    with open(utils.path_to_text_fixture(file_name), 'rb') as fixture:
+        return fixture.read()
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, path):
+        httplib.HTTPConnection.__init__(self, "localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class ConversionServiceTests(TestCase):
+
+    def setUp(self):
+        self.service = ConversionService(workers=2, timeout=30)
+
+    def tearDown(self):
+        self.service.stop()
+
+    def test_convert(self):
+        status, response = self.service.convert(
+            read_fixture("select_one_external.xlsx"), validate=False)
+        self.assertEqual(status, 200)
+        self.assertEqual(response['code'], 100)
+        self.assertIn(u"<h:html", response['xform'])
+        self.assertIn(u"list_name", response['itemsets'])
+
+    def test_format_detection(self):
+        for file_name in ["text_and_integer.xls",
+                          "xlsform_spec_test.xlsx"]:
+            status, response = self.service.convert(
+                read_fixture(file_name), validate=False)
+            self.assertIn(response['code'], [100, 101])
+            self.assertIsNone(response['itemsets'])
+
+    def test_file_name(self):
+        for name, id_string in [(u"household.xls", u"household"),
+                                (u"../forms/household.xls", u"household"),
+                                (u"C:\\forms\\house hold.xls",
+                                 u"house_hold"),
+                                (None, u"form")]:
+            status, response = self.service.convert(
+                read_fixture("text_and_integer.xls"), name=name,
+                validate=False)
+            self.assertEqual(response['code'], 100)
+            self.assertIn(u'id="%s"' % id_string, response['xform'])
+
+    def test_conversion_error(self):
+        status, response = self.service.convert(
+            read_fixture("unknown_question_type.xls"), validate=False)
+        self.assertEqual(status, 200)
+        self.assertEqual(response['code'], 999)
+        self.assertIsNone(response['xform'])
+
+    def test_timeout(self):
+        temp_dirs = [worker.temp_dir for worker in self.service._workers]
+        self.service.timeout = 0.001
+        status, response = self.service.convert(
+            read_fixture("xlsform_spec_test.xlsx"), validate=False)
+        self.assertEqual(status, 504)
+        self.assertEqual(response['code'], 999)
+        # the worker was replaced
+        self.service.timeout = 30
+        status, response = self.service.convert(
+            read_fixture("text_and_integer.xls"), validate=False)
+        self.assertEqual(response['code'], 100)
+        self.service.stop()
+        for temp_dir in temp_dirs:
+            self.assertFalse(os.path.exists(temp_dir))
+
+    def test_crash(self):
+        for worker in self.service._workers:
+            os.kill(worker._process.pid, signal.SIGKILL)
+            worker._process.join()
+        for _ in range(2):
+            status, response = self.service.convert(
+                read_fixture("text_and_integer.xls"), validate=False)
+            self.assertEqual(status, 500)
+        # the workers were replaced
+        status, response = self.service.convert(
+            read_fixture("text_and_integer.xls"), validate=False)
+        self.assertEqual((status, response['code']), (200, 100))
+
+
+class ConversionHTTPServerTests(TestCase):
+
+    def setUp(self):
+        self.service = ConversionService(workers=1)
+        self.socket_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.service.stop()
+        shutil.rmtree(self.socket_dir)
+
+    def post(self, connection, path, body):
+        connection.request("POST", path, body)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def serve(self, server):
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_tcp(self):
+        server = make_server(self.service, port=0)
+        self.serve(server)
+        connection = httplib.HTTPConnection(*server.server_address)
+        status, response = self.post(
+            connection, "/convert?validate=0&name=form.xls",
+            read_fixture("text_and_integer.xls"))
+        self.assertEqual((status, response['code']), (200, 100))
+        status, response = self.post(connection, "/other", "")
+        self.assertEqual(status, 404)
+
+    def test_unix_socket(self):
+        socket_path = os.path.join(self.socket_dir, "pyxform.sock")
+        server = make_server(self.service, socket_path=socket_path)
+        self.serve(server)
+        status, response = self.post(
+            UnixHTTPConnection(socket_path), "/convert?validate=0",
+            read_fixture("text_and_integer.xls"))
+        self.assertEqual((status, response['code']), (200, 100))
@@ -0,0 +1,137 @@
+"""
+Testing the parsing of many submissions of a survey.
+"""
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import date
+
+from pyxform.builder import create_survey_element_from_dict
+from pyxform.errors import PyXFormError
+from pyxform.submissions import SubmissionSchema, parse_submissions, \
+    ORPHANS, INVALID_VALUES, PATH_CACHE_SIZE
+from pyxform.xform_instance_parser import XFORM_ID_STRING
+
+SURVEY = {
+    u"type": u"survey", u"name": u"data", u"id_string": u"household",
+    u"children": [
+        {u"type": u"text", u"name": u"name", u"label": u"Name"},
+        {u"type": u"repeat", u"name": u"member", u"label": u"Member",
+         u"children": [
+             {u"type": u"integer", u"name": u"age", u"label": u"Age"}]},
+        {u"type": u"group", u"name": u"place", u"label": u"Place",
+         u"children": [
+             {u"type": u"geopoint", u"name": u"location",
+              u"label": u"Location"},
+             {u"type": u"date", u"name": u"day", u"label": u"Day"},
+             {u"type": u"select all that apply", u"name": u"rooms",
+              u"label": u"Rooms", u"choices": [
+                  {u"name": u"kitchen", u"label": u"Kitchen"},
+                  {u"name": u"bedroom", u"label": u"Bedroom"}]},
+             {u"type": u"decimal", u"name": u"area", u"label": u"Area"}]}]}
+
+
+def submission(name, *ages):
+    return u'<data id="household"><name>%s</name>%s</data>' % (
+        name, u"".join(u"<member><age>%d</age></member>" % age
+                       for age in ages))
+
+
+class SubmissionsTests(TestCase):
+
+    def setUp(self):
+        self.survey = create_survey_element_from_dict(SURVEY)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_schema(self):
+        schema = SubmissionSchema(self.survey)
+        self.assertEqual(schema.bind_types, {
+            u"name": u"string", u"member/age": u"int",
+            u"place/location": u"geopoint", u"place/day": u"date",
+            u"place/rooms": u"select", u"place/area": u"decimal"})
+        self.assertEqual(schema.parse(submission(u"Ann", 30, 5)), {
+            u"name": u"Ann", u"member[1]/age": 30, u"member[2]/age": 5,
+            XFORM_ID_STRING: u"household", ORPHANS: {}, INVALID_VALUES: []})
+        self.assertRaisesRegexp(PyXFormError, u"form other", schema.parse,
+                                u'<data id="other"><name/></data>')
+        self.assertRaisesRegexp(PyXFormError, u"root node is form",
+                                schema.parse, u'<form id="household"/>')
+
+    def test_coercion(self):
+        xml = (u'<data id="household"><name/><member><age>x</age></member>'
+               u'<place><location>1.5 -2 0 10</location>'
+               u'<day>2016-02-29</day><rooms>kitchen bedroom</rooms>'
+               u'<area>12.5</area></place><pets>2</pets></data>')
+        self.assertEqual(SubmissionSchema(self.survey).parse(xml), {
+            u"name": None, u"member/age": u"x",
+            u"place/location": [1.5, -2.0, 0.0, 10.0],
+            u"place/day": date(2016, 2, 29),
+            u"place/rooms": [u"kitchen", u"bedroom"],
+            u"place/area": 12.5,
+            XFORM_ID_STRING: u"household",
+            ORPHANS: {u"pets": u"2"},
+            INVALID_VALUES: [u"member/age"]})
+        record = SubmissionSchema(self.survey, coerce=False).parse(xml)
+        self.assertEqual(record[u"place/area"], u"12.5")
+        self.assertEqual(record[u"pets"], u"2")
+        self.assertNotIn(ORPHANS, record)
+        self.assertNotIn(INVALID_VALUES, record)
+
+    def test_path_cache_is_bounded(self):
+        schema = SubmissionSchema(self.survey)
+        schema.parse(submission(u"Ann", *range(PATH_CACHE_SIZE + 1)))
+        self.assertTrue(len(schema._path_coercions) <= PATH_CACHE_SIZE)
+
+    def test_parse_submissions(self):
+        path = os.path.join(self.directory, u"ben.xml")
+        with open(path, "w") as xml_file:
+            xml_file.write(submission(u"Ben", 40))
+        archive_path = os.path.join(self.directory, u"archive.zip")
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            archive.writestr(u"instances/1/submission.xml",
+                             submission(u"Cy", 7))
+            archive.writestr(u"instances/1/photo.jpg", b"")
+        submissions = [submission(u"Ann", 30, 5), path, archive_path,
+                       u"<data"]
+        for workers in [1, 2]:
+            results = list(parse_submissions(self.survey, submissions,
+                                             workers=workers))
+            self.assertEqual(
+                [name for name, record, error in results],
+                [0, path, os.path.join(archive_path,
+                                       u"instances/1/submission.xml"), 3])
+            self.assertEqual(results[1][1][u"member/age"], 40)
+            self.assertEqual(results[2][1][u"name"], u"Cy")
+            self.assertIsNone(results[0][2])
+            self.assertIsNone(results[3][1])
+            self.assertIsNotNone(results[3][2])
+
+    def test_damaged_archive(self):
+        archive_path = os.path.join(self.directory, u"damaged.zip")
+        with open(archive_path, "wb") as archive:
+            archive.write(b"PK\x03\x04 not a zip file")
+        submissions = [submission(u"Ann", 30), archive_path,
+                       submission(u"Ben", 40)]
+        for workers in [1, 2]:
+            results = list(parse_submissions(self.survey, submissions,
+                                             workers=workers))
+            self.assertEqual([name for name, record, error in results],
+                             [0, archive_path, 2])
+            self.assertIsNone(results[1][1])
+            self.assertIsInstance(results[1][2], zipfile.BadZipfile)
+            self.assertEqual(results[2][1][u"name"], u"Ben")
+
+    def test_schemas_of_inline_parsing(self):
+        other = create_survey_element_from_dict(dict(
+            SURVEY, name=u"other", id_string=u"other"))
+        first = parse_submissions(self.survey, [submission(u"Ann", 30)] * 2,
+                                  workers=1)
+        next(first)
+        self.assertIsNone(next(parse_submissions(
+            other, [u'<other id="other"/>'], workers=1))[2])
+        self.assertIsNone(next(first)[2])
@@ -0,0 +1,58 @@
+"""
+Testing the ${name} replacement in expressions, labels and hints.
+"""
+from unittest2 import TestCase
+from pyxform.errors import PyXFormError
+from pyxform.substitution import XPathSubstitution
+
+
+class XPathSubstitutionTests(TestCase):
+
+    def setUp(self):
+        self.substitution = XPathSubstitution(
+            {u"age": u"/survey/age", u"name": None})
+
+    def test_insert_xpaths(self):
+        self.assertEqual(self.substitution.insert_xpaths(u"${age} > 18"),
+                         u" /survey/age  > 18")
+        self.assertEqual(self.substitution.insert_xpaths(u"true()"),
+                         u"true()")
+
+    def test_unknown_and_ambiguous_names(self):
+        with self.assertRaisesRegexp(PyXFormError, u"no survey element"):
+            self.substitution.insert_xpaths(u"${height}")
+        with self.assertRaisesRegexp(PyXFormError, u"multiple survey"):
+            self.substitution.insert_output_values(u"${name}")
+
+    def test_output_node(self):
+        element = self.substitution.output_node(
+            u"label", u"Older than ${age} & <b>?", form=u"long")
+        self.assertEqual(
+            element.toxml(),
+            u'<label form="long">Older than '
+            u'<output value=" /survey/age "/> &amp; &lt;b&gt;?</label>')
+        self.assertEqual(
+            self.substitution.insert_output_values(u"Older than ${age}?"),
+            (u'Older than <output value=" /survey/age " />?', True))
+
+    def test_output_node_with_prefix(self):
+        element = self.substitution.output_node(
+            u"value", u"${age}.jpg", u"jr://images/", form=u"image")
+        self.assertEqual(
+            element.toxml(),
+            u'<value form="image">jr://images/'
+            u'<output value=" /survey/age "/>.jpg</value>')
+
+    def test_text_without_references(self):
+        self.assertEqual(self.substitution.output_node(
+            u"hint", u"a < b").toxml(), u"<hint>a &lt; b</hint>")
+        self.assertEqual(
+            self.substitution.insert_output_values(u"a < b"),
+            (u"a < b", False))
+
+    def test_text_that_is_not_a_string(self):
+        label = {u"English": u"Age"}
+        self.assertEqual(self.substitution.insert_output_values(label),
+                         (u"{u'English': u'Age'}", False))
+        self.assertEqual(self.substitution.output_node(u"label", 5).toxml(),
+                         u"<label>5</label>")
@@ -0,0 +1,46 @@
+"""
+Testing the defaults and question type values of survey elements.
+"""
+from unittest2 import TestCase
+from pyxform import Survey, InputQuestion
+
+
+class SurveyElementTests(TestCase):
+
+    def test_no_instance_dict(self):
+        question = InputQuestion(name=u"age", type=u"integer")
+        self.assertFalse(hasattr(question, "__dict__"))
+        question.hint = u"In years"
+        self.assertEqual(question[u"hint"], u"In years")
+
+    def test_defaults(self):
+        question = InputQuestion(name=u"age", type=u"integer")
+        self.assertNotIn(u"label", question)
+        self.assertEqual(question.label, u"")
+        self.assertEqual(question[u"label"], u"")
+        self.assertEqual(question.get(u"label", u"unused"), u"")
+        self.assertIsNone(question.get(u"unknown"))
+        # empty containers are kept, so they can be changed in place
+        question.get(u"instance")[u"jr:template"] = u""
+        self.assertEqual(question[u"instance"], {u"jr:template": u""})
+
+    def test_question_type_values(self):
+        question = InputQuestion(name=u"age", type=u"integer",
+                                 bind={u"required": u"yes"})
+        self.assertEqual(question.bind,
+                         {u"type": u"int", u"required": u"yes"})
+        self.assertIs(question.bind, question.bind)
+        question.bind = {u"relevant": u"false()"}
+        self.assertEqual(question.bind,
+                         {u"type": u"int", u"relevant": u"false()"})
+        question.type = u"text"
+        self.assertEqual(question.bind,
+                         {u"type": u"string", u"relevant": u"false()"})
+
+    def test_to_json_dict(self):
+        survey = Survey(name=u"survey", id_string=u"survey")
+        survey.add_child(InputQuestion(name=u"age", type=u"integer"))
+        self.assertEqual(survey.to_json_dict(), {
+            u"name": u"survey",
+            u"id_string": u"survey",
+            u"children": [{u"name": u"age", u"type": u"integer"}]})
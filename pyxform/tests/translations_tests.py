@@ -0,0 +1,87 @@
+"""
+Testing the translation table of the itext.
+"""
+from unittest2 import TestCase
+import json
+from pyxform.translations import TranslationTable
+from pyxform.builder import create_survey_element_from_dict
+from pyxform.xls2json import workbook_to_json
+
+
+class TranslationTableTests(TestCase):
+
+    def setUp(self):
+        self.table = TranslationTable()
+        self.table.set_text(u"English", u"/data/name:label", u"Name")
+        self.table.set_content(u"English", u"/data/name:label", u"image",
+                               u"name.png")
+        self.table.set_text(u"French", u"/data/name:label", u"Nom")
+        self.table.set_text(u"French", u"/data/age:label", u"Age")
+
+    def test_table(self):
+        self.assertEqual(self.table, {
+            u"English": {u"/data/name:label": {u"long": u"Name",
+                                               u"image": u"name.png"}},
+            u"French": {u"/data/name:label": {u"long": u"Nom"},
+                        u"/data/age:label": {u"long": u"Age"}}})
+        # the columns share the path
+        english_path, = self.table[u"English"]
+        french_path, = [path for path in self.table[u"French"]
+                        if path == english_path]
+        self.assertIs(french_path, english_path)
+        # set_text replaces the content
+        self.table.set_text(u"English", u"/data/name:label", u"Full name")
+        self.assertEqual(self.table[u"English"][u"/data/name:label"],
+                         {u"long": u"Full name"})
+
+    def test_fill(self):
+        self.table.fill(u"-")
+        self.assertEqual(self.table, {
+            u"English": {u"/data/name:label": {u"long": u"Name",
+                                               u"image": u"name.png"},
+                         u"/data/age:label": {u"long": u"-"}},
+            u"French": {u"/data/name:label": {u"long": u"Nom",
+                                              u"image": u"-"},
+                        u"/data/age:label": {u"long": u"Age"}}})
+        self.assertEqual(json.loads(json.dumps(self.table)), self.table)
+
+    def test_shared_paths(self):
+        self.table.set_text(u"English", u"/data/age:label", u"Age")
+        self.table.set_text(u"English", u"/data/years:label", u"Age")
+        self.table.set_text(u"French", u"/data/years:label", u"Age")
+        self.table.set_text(u"English", u"/data/years:hint", u"Age")
+        self.table.set_text(u"French", u"/data/years:hint", u"Age")
+        self.table.fill(u"-")
+        self.assertEqual(self.table.shared_paths(),
+                         {u"/data/years:label": u"/data/age:label"})
+
+
+class SharedItextTests(TestCase):
+
+    def test_shared_itext(self):
+        workbook = {
+            u"survey": [
+                {u"type": u"select_one yes_no", u"name": u"q%d" % i,
+                 u"label::English": u"Question %d" % i,
+                 u"label::French": u"Question %d" % i} for i in range(3)],
+            u"choices": [
+                {u"list_name": u"yes_no", u"name": u"yes",
+                 u"label::English": u"Yes", u"label::French": u"Oui"},
+                {u"list_name": u"yes_no", u"name": u"no",
+                 u"label::English": u"No", u"label::French": u"Non"}],
+            u"settings": [{u"shared_itext": u"yes"}]}
+        json_dict = workbook_to_json(workbook, u"data")
+        self.assertIs(json_dict[u"shared_itext"], True)
+        survey = create_survey_element_from_dict(json_dict)
+        xform = survey.to_xml(validate=False)
+        self.assertEqual(xform.count(u"<text "), 2 * 5)
+        self.assertEqual(xform.count(u'id="/data/q0/yes:label"'), 2)
+        self.assertNotIn(u'id="/data/q1/yes:label"', xform)
+        self.assertEqual(
+            xform.count(u"<label ref=\"jr:itext('/data/q0/yes:label')\"/>"),
+            3)
+        survey.shared_itext = False
+        xform = survey.to_xml(validate=False)
+        self.assertEqual(xform.count(u"<text "), 2 * 9)
+        self.assertIn(u"<label ref=\"jr:itext('/data/q1/yes:label')\"/>",
+                      xform)
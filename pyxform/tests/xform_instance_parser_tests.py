@@ -0,0 +1,58 @@
+"""
+Testing the parsing of submitted instances.
+"""
+from unittest2 import TestCase
+from StringIO import StringIO
+from pyxform.xform_instance_parser import XFormInstanceParser, \
+    parse_xform_instance
+
+INSTANCE = u"""<?xml version='1.0' ?>
+<data id="household" xmlns:orx="http://openrosa.org/xforms">
+  <name> Ann </name>
+  <empty>
+  </empty>
+  <member><age>30</age><pets><pet>cat</pet><pet>dog</pet></pets></member>
+  <member><age>5</age><pets><pet/></pets></member>
+  <orx:meta><orx:instanceID>uuid:1</orx:instanceID></orx:meta>
+</data>"""
+
+
+class XFormInstanceParserTests(TestCase):
+
+    def test_parse(self):
+        parser = XFormInstanceParser(INSTANCE)
+        self.assertEqual(parser.get_root_node_name(), u"data")
+        self.assertEqual(parser.to_json_dict(), {u"data": {
+            u"name": u" Ann ",
+            u"empty": None,
+            u"member": [
+                {u"age": u"30", u"pets": {u"pet": [u"cat", u"dog"]}},
+                {u"age": u"5", u"pets": {u"pet": None}}],
+            u"orx:meta": {u"orx:instanceID": u"uuid:1"}}})
+        self.assertEqual(parser.to_flat_dict(), {
+            u"name": u" Ann ",
+            u"empty": None,
+            u"member[1]/age": u"30",
+            u"member[1]/pets/pet[1]": u"cat",
+            u"member[1]/pets/pet[2]": u"dog",
+            u"member[2]/age": u"5",
+            u"member[2]/pets/pet": None,
+            u"orx:meta/orx:instanceID": u"uuid:1"})
+        self.assertEqual(parser.get_attributes(), {
+            u"id": u"household",
+            u"xmlns:orx": u"http://openrosa.org/xforms"})
+        self.assertEqual(parser.get_xform_id_string(), u"household")
+
+    def test_sources(self):
+        expected = XFormInstanceParser(INSTANCE).to_flat_dict()
+        encoded = INSTANCE.encode("utf-8")
+        self.assertEqual(XFormInstanceParser(encoded).to_flat_dict(),
+                         expected)
+        self.assertEqual(
+            XFormInstanceParser(StringIO(encoded)).to_flat_dict(), expected)
+        self.assertEqual(parse_xform_instance(
+            u"<data><name>Z\xfcrich</name></data>")[u"name"], u"Z\xfcrich")
+
+    def test_attributes_are_unique(self):
+        self.assertRaises(AssertionError, XFormInstanceParser,
+                          u'<data id="a"><name id="b"/></data>')
@@ -2,9 +2,12 @@
 Testing simple cases for Xls2Json
 """
 from unittest2 import TestCase
-from pyxform.xls2json import SurveyReader
+from pyxform.xls2json import SurveyReader, dealias_and_group_headers, \
+    workbook_to_json
 import utils
 import os
+import shutil
+import tempfile
 import json, codecs
 
 #Nothing calls this AFAICT
@@ -183,7 +186,8 @@ class BasicXls2JsonApiTests(TestCase):
 
 
 
-from pyxform.xls2json_backends import xls_to_dict, csv_to_dict
+from pyxform.xls2json_backends import xls_to_dict, csv_to_dict, \
+    iter_xls_to_dict
 
 
 class CsvReaderEquivalencyTest(TestCase):
@@ -199,6 +203,129 @@ class CsvReaderEquivalencyTest(TestCase):
             self.maxDiff = None
             self.assertEqual(csv_inp, xls_inp)
 
+class XlsxStreamingReaderTest(TestCase):
+    def test_rows_match_xlrd(self):
+        """
+        The streaming .xlsx reader should see the same rows and columns
+        as xlrd does when it loads the whole workbook.
+        """
+        import xlrd
+        for fixture in ['xlsform_spec_test', 'or_other', 'geo',
+                        'select_one_external']:
+            xlsx_path = utils.path_to_text_fixture("%s.xlsx" % fixture)
+            workbook = xlrd.open_workbook(xlsx_path)
+            xlsx_inp = xls_to_dict(xlsx_path)
+            for sheet in workbook.sheets():
+                rows = xlsx_inp[sheet.name]
+                self.assertEqual(len(rows), max(sheet.nrows - 1, 0))
+                for row, row_dict in enumerate(rows, 1):
+                    keys = set()
+                    for column in range(sheet.ncols):
+                        value = sheet.cell_value(row, column)
+                        if not isinstance(value, basestring) or \
+                                value.strip():
+                            keys.add(
+                                (u"%s" % sheet.cell_value(0, column)).strip())
+                    self.assertEqual(keys, set(row_dict.keys()))
+
+    def test_iter_xls_to_dict(self):
+        xlsx_path = utils.path_to_text_fixture("text_and_integer_xlsx.xlsx")
+        with open(xlsx_path, 'rb') as xlsx_file:
+            sheets = [(sheet_name, header, list(rows))
+                      for sheet_name, header, rows
+                      in iter_xls_to_dict(xlsx_file)]
+        self.assertEqual([sheet_name for sheet_name, _, _ in sheets],
+                         [u'survey', u'choices'])
+        self.assertEqual(sheets[0][1], xls_to_dict(xlsx_path)['survey_header'])
+        self.assertEqual(sheets[0][2][1], {
+            u'text:english': u'How many years old are you?',
+            u'type': u'integer', u'name': u'your_age'})
+
+    def test_streamed_sheets(self):
+        """
+        The survey and choices rows read as they are used should give the
+        same json as the rows loaded into lists.
+        """
+        from pyxform.xls2json import parse_file_to_workbook_dict, \
+            workbook_to_json
+        for fixture in ['xlsform_spec_test.xlsx', 'or_other.xlsx',
+                        'specify_other.xls', 'cascading_select_test.xls']:
+            path = utils.path_to_text_fixture(fixture)
+            workbook_dict = parse_file_to_workbook_dict(path,
+                                                        stream_rows=True)
+            self.assertFalse(isinstance(workbook_dict['survey'], list))
+            self.assertEqual(
+                workbook_to_json(workbook_dict, u'form'),
+                workbook_to_json(parse_file_to_workbook_dict(path), u'form'))
+
+
+def write_xlsx(path, sheets):
+    """
+    Write a minimal .xlsx file of sheets, a list of (sheet name, rows)
+    pairs, with every cell an inline string. The parts are not compressed,
+    so a large sheet takes several reads.
+    """
+    import zipfile
+    from xml.sax.saxutils import escape
+    main = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    relationships = \
+        "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    with zipfile.ZipFile(path, "w") as xlsx:
+        xlsx.writestr("xl/workbook.xml", (
+            '<workbook xmlns="%s" xmlns:r="%s"><sheets>%s</sheets>'
+            '</workbook>' % (main, relationships, "".join(
+                '<sheet name="%s" sheetId="%d" r:id="rId%d"/>' % (
+                    name, index, index)
+                for index, (name, _) in enumerate(sheets, 1)))))
+        xlsx.writestr("xl/_rels/workbook.xml.rels", (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/'
+            'package/2006/relationships">%s</Relationships>' % "".join(
+                '<Relationship Id="rId%d" Type="%s/worksheet" '
+                'Target="worksheets/sheet%d.xml"/>' % (
+                    index, relationships, index)
+                for index in range(1, len(sheets) + 1))))
+        for index, (_, rows) in enumerate(sheets, 1):
+            xlsx.writestr("xl/worksheets/sheet%d.xml" % index, (
+                '<worksheet xmlns="%s"><sheetData>%s</sheetData>'
+                '</worksheet>' % (main, "".join(
+                    "<row>%s</row>" % "".join(
+                        '<c t="inlineStr"><is><t>%s</t></is></c>' %
+                        escape(value) for value in row)
+                    for row in rows))))
+
+
+class LargeXlsxTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_streamed_sheets_larger_than_a_read(self):
+        """
+        The survey and choices sheets are read after the rest of the
+        workbook, and have to stay readable beyond the first read of
+        their streams.
+        """
+        from pyxform.xls2json import parse_file_to_json
+        survey = [["type", "name", "label"]] + [
+            ["select_one yes_no", "q%d" % i, "Question number %d?" % i]
+            for i in range(2000)]
+        choices = [["list_name", "name", "label"]] + [
+            ["yes_no", "yes", "Yes"], ["yes_no", "no", "No"]] + [
+            ["other_%d" % i, "c", "Choice %d" % i] for i in range(2000)]
+        path = os.path.join(self.directory, "large.xlsx")
+        write_xlsx(path, [("survey", survey), ("choices", choices),
+                          ("settings", [["form_title"], ["Large"]])])
+        json_dict = parse_file_to_json(path)
+        self.assertEqual(json_dict["title"], "Large")
+        self.assertEqual(len(json_dict["children"]), 2000 + 1)
+        self.assertEqual(json_dict["children"][-2]["name"], "q1999")
+        with open(path, "rb") as xlsx_file:
+            self.assertEqual(parse_file_to_json(path, file_object=xlsx_file),
+                             json_dict)
+
+
 class UnicodeCsvTest(TestCase):
     def test_a_unicode_csv_works(self):
         """
@@ -209,3 +336,42 @@ class UnicodeCsvTest(TestCase):
         dict_value = csv_to_dict(utf_csv_path)
         self.assertTrue("\ud83c" in json.dumps(dict_value))
 
+
+
+class DealiasAndGroupHeadersTest(TestCase):
+    def test_grouped_headers(self):
+        rows = [{u"caption": u"Name?", u"label::French": u"Nom ?",
+                 u"media::image::French": u"nom.jpg", u"name": u"name"},
+                {u"label::French": u"Age ?", u"name": u"age"}]
+        self.assertEqual(
+            dealias_and_group_headers(rows, {u"caption": u"label"}, True),
+            [{u"label": {u"default": u"Name?", u"French": u"Nom ?"},
+              u"media": {u"image": {u"French": u"nom.jpg"}},
+              u"name": u"name"},
+             {u"label": {u"French": u"Age ?"}, u"name": u"age"}])
+
+    def test_single_colon_headers(self):
+        rows = [{u"bind:jr:constraintMsg:English": u"Too old",
+                 u"Label:English": u"Age"}]
+        self.assertEqual(
+            dealias_and_group_headers(rows, {}, False, ignore_case=True),
+            [{u"bind": {u"jr:constraintmsg": {u"english": u"Too old"}},
+              u"label": {u"english": u"Age"}}])
+
+    def test_survey_rows_iterator(self):
+        xlsx_path = utils.path_to_text_fixture("xlsform_spec_test.xlsx")
+        expected = workbook_to_json(xls_to_dict(xlsx_path), u"spec")
+        workbook_dict = xls_to_dict(xlsx_path)
+        workbook_dict[u"survey"] = iter(workbook_dict[u"survey"])
+        self.assertEqual(workbook_to_json(workbook_dict, u"spec"), expected)
+
+    def test_grouped_headers_of_survey_rows_iterator(self):
+        rows = [{u"type": u"text", u"name": u"name",
+                 u"label::French": u"Nom  ?"}]
+        workbook_dict = {
+            u"survey_header": [{u"type": u"", u"name": u"",
+                                u"label::French": u""}],
+            u"survey": (row for row in rows)}
+        self.assertEqual(workbook_to_json(workbook_dict)[u"children"][0], {
+            u"type": u"text", u"name": u"name",
+            u"label": {u"French": u"Nom ?"}})
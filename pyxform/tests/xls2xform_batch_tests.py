@@ -0,0 +1,76 @@
+"""
+Testing the conversion of many XLSForms at once.
+"""
+from unittest2 import TestCase
+import os
+import shutil
+import tempfile
+import codecs
+import utils
+from pyxform.xls2xform import batch_jobs, xls2xform_convert_batch
+
+
+class BatchConversionTests(TestCase):
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        for fixture in ["text_and_integer.xls", "select_one_external.xlsx",
+                        "unknown_question_type.xls"]:
+            shutil.copy(utils.path_to_text_fixture(fixture), self.source_dir)
+        with open(os.path.join(self.source_dir, "notes.txt"), "w") as notes:
+            notes.write("not an XLSForm")
+
+    def tearDown(self):
+        shutil.rmtree(self.source_dir)
+        shutil.rmtree(self.output_dir)
+
+    def test_batch_jobs_from_directory(self):
+        self.assertEqual(batch_jobs(self.source_dir, self.output_dir), [
+            (os.path.join(self.source_dir, name + extension),
+             os.path.join(self.output_dir, name, name + ".xml"))
+            for name, extension in [("select_one_external", ".xlsx"),
+                                    ("text_and_integer", ".xls"),
+                                    ("unknown_question_type", ".xls")]])
+
+    def test_batch_jobs_from_manifest(self):
+        manifest_path = os.path.join(self.source_dir, "forms.txt")
+        with codecs.open(manifest_path, "w", encoding="utf-8") as manifest:
+            manifest.write(u"# nightly forms\ntext_and_integer.xls\n\n")
+        self.assertEqual(batch_jobs(manifest_path, self.output_dir), [
+            (os.path.join(self.source_dir, "text_and_integer.xls"),
+             os.path.join(self.output_dir, "text_and_integer",
+                          "text_and_integer.xml"))])
+
+    def test_failure_does_not_stop_the_batch(self):
+        jobs = batch_jobs(self.source_dir, self.output_dir)
+        responses = sorted(
+            xls2xform_convert_batch(jobs, workers=2, validate=False),
+            key=lambda response: response['path'])
+        self.assertEqual(
+            [(response['path'], response['output_path'], response['code'])
+             for response in responses],
+            [job + (code,) for job, code in zip(jobs, [100, 100, 999])])
+        self.assertIn("Unknown question type", responses[2]['message'])
+        for xlsform_path, xform_path in jobs[:2]:
+            self.assertTrue(os.path.isfile(xform_path))
+        self.assertTrue(os.path.isfile(os.path.join(
+            os.path.dirname(jobs[0][1]), "itemsets.csv")))
+
+    def test_output_collisions_fail(self):
+        manifest_path = os.path.join(self.source_dir, "forms.txt")
+        other_dir = os.path.join(self.source_dir, "other")
+        os.mkdir(other_dir)
+        shutil.copy(utils.path_to_text_fixture("text_and_integer.xls"),
+                    os.path.join(other_dir, "text_and_integer.xlsx"))
+        with codecs.open(manifest_path, "w", encoding="utf-8") as manifest:
+            manifest.write(u"text_and_integer.xls\n"
+                           u"other/text_and_integer.xlsx\n")
+        jobs = batch_jobs(manifest_path, self.output_dir)
+        responses = sorted(
+            xls2xform_convert_batch(jobs, workers=2, validate=False),
+            key=lambda response: response['path'])
+        self.assertEqual([response['code'] for response in responses],
+                         [999, 100])
+        self.assertIn("would overwrite", responses[0]['message'])
+        self.assertEqual(responses[0]['path'], jobs[1][0])
@@ -0,0 +1,89 @@
+"""
+Testing that the xml nodes cached for survey elements follow changes to
+the survey.
+"""
+from unittest2 import TestCase
+from pyxform import create_survey_element_from_dict
+from pyxform.survey_element import rendering_xml
+
+
+class XmlCacheTests(TestCase):
+
+    def setUp(self):
+        self.survey = create_survey_element_from_dict({
+            u"type": u"survey", u"name": u"data", u"children": [
+                {u"type": u"text", u"name": u"name", u"label": u"Name"},
+                {u"type": u"group", u"name": u"group", u"children": [
+                    {u"type": u"integer", u"name": u"age",
+                     u"label": u"Age of ${name}",
+                     u"bind": {u"relevant": u"${name} != ''"}}]}]})
+        self.age = self.survey.children[1].children[0]
+        self.xform = self.survey.to_xml(validate=False)
+
+    def cached_control(self, share=False):
+        return rendering_xml(self.survey, share, self.age.cached_xml,
+                             u"xml_control")
+
+    def test_nodes_are_reused(self):
+        control = self.cached_control(share=True)
+        self.assertEqual(self.survey.to_xml(validate=False), self.xform)
+        self.assertIs(self.cached_control(share=True), control)
+        # copies of the stored node are returned
+        self.assertIsNot(self.cached_control(), control)
+        self.assertEqual(self.cached_control().toxml(), control.toxml())
+        # outside a render the node is made again
+        self.assertIsNot(self.age.cached_xml(u"xml_control"), control)
+
+    def test_documents_do_not_share_nodes(self):
+        first = self.survey.xml()
+        first_xml = first.toxml()
+        second = self.survey.xml()
+        self.assertEqual(first.toxml(), first_xml)
+        self.assertEqual(second.toxml(), first_xml)
+        self.assertEqual(self.survey.to_xml(validate=False), self.xform)
+        self.assertEqual(first.toxml(), first_xml)
+        # changing a document does not change the next ones
+        first.getElementsByTagName(u"label")[0].setAttribute(u"ref", u"x")
+        self.assertEqual(self.survey.xml().toxml(), first_xml)
+
+    def test_renders_share_nodes_of_their_survey_only(self):
+        other = create_survey_element_from_dict({
+            u"type": u"survey", u"name": u"other", u"children": [
+                {u"type": u"text", u"name": u"name", u"label": u"Name"}]})
+        first = rendering_xml(self.survey, True, other.xml)
+        first_xml = first.toxml()
+        other.xml()
+        self.assertEqual(first.toxml(), first_xml)
+
+    def test_changes(self):
+        control = self.cached_control(share=True)
+        self.age.label = u"Age"
+        self.assertIsNot(self.cached_control(share=True), control)
+        xform = self.survey.to_xml(validate=False)
+        self.assertIn(u"<label>Age</label>", xform)
+        self.assertNotIn(u"<output", xform)
+
+    def test_changes_in_place(self):
+        bind = dict.get(self.age, u"bind")
+        bind[u"required"] = u"true()"
+        del bind[u"relevant"]
+        self.age[u"control"][u"appearance"] = u"w2"
+        xform = self.survey.to_xml(validate=False)
+        self.assertIn(u'required="true()"', xform)
+        self.assertNotIn(u"relevant", xform)
+        self.assertIn(u'appearance="w2"', xform)
+
+    def test_new_xpath_dictionary(self):
+        self.survey.name = u"form"
+        xform = self.survey.to_xml(validate=False)
+        self.assertIn(u'<output value=" /form/name "/>', xform)
+        self.assertIn(u'relevant=" /form/name  != \'\'"', xform)
+
+    def test_instance_does_not_make_xml(self):
+        survey = create_survey_element_from_dict({
+            u"type": u"survey", u"name": u"data", u"children": [
+                {u"type": u"text", u"name": u"name", u"label": u"Name"}]})
+        instance = survey.instantiate()
+        self.assertEqual(sorted(instance.xpaths()),
+                         [u"/data", u"/data/name"])
+        self.assertNotIn(u"_translations", survey)
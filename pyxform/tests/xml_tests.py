@@ -60,3 +60,18 @@ class XMLTests(TestCase):
                          self.survey.id_string, xml_str)
         self.maxDiff = None
         self.assertMultiLineEqual(xml_str, self.survey.to_xml())
+
+    def test_to_xml_renders_once(self):
+        calls = []
+        survey_class = type(self.survey)
+        xml = survey_class.xml
+
+        def counting_xml(survey):
+            calls.append(1)
+            return xml(survey)
+        survey_class.xml = counting_xml
+        try:
+            self.survey.to_xml(validate=False)
+        finally:
+            survey_class.xml = xml
+        self.assertEqual(len(calls), 1)
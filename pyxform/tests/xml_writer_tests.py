@@ -0,0 +1,54 @@
+"""
+Testing that xml_writer produces the same text as the toprettyxml based
+rendering it replaced.
+"""
+from unittest2 import TestCase
+from pyxform.utils import node
+from pyxform.xml_writer import to_pretty_xml, _legacy_pretty_xml, \
+    _is_regular, XML_DECLARATION
+
+
+class XMLWriterTests(TestCase):
+
+    maxDiff = None
+
+    def assertSameAsLegacy(self, element, regular=True):
+        self.assertEqual(_is_regular(element), regular)
+        self.assertMultiLineEqual(
+            XML_DECLARATION + _legacy_pretty_xml(element),
+            to_pretty_xml(element))
+
+    def test_elements_and_text(self):
+        self.assertSameAsLegacy(
+            node(u"h:html",
+                 node(u"h:head", node(u"h:title", u"a & <b>")),
+                 node(u"h:body",
+                      node(u"input", node(u"label", u" "), ref=u"/a/b"),
+                      node(u"label", u"  "), node(u"hint", u"x\ny")),
+                 xmlns=u"http://www.w3.org/2002/xforms"))
+
+    def test_outputs(self):
+        for text in [u'Hello <output value="/a/b"/> there',
+                     u'<output value="/a/b"/> and',
+                     u'with <output value="/a/b"/>',
+                     u'<output value="/a/b"/>',
+                     u'<output value="/a/b"/> <output value="/a/c"/>',
+                     u'a <output value="/a/b"/><output value="/a/c"/> b']:
+            self.assertSameAsLegacy(
+                node(u"itext",
+                     node(u"text",
+                          node(u"value", text, toParseString=True),
+                          node(u"value", text, toParseString=True,
+                               form=u"long"),
+                          id=u"/a/b:label"),
+                     node(u"output_question")))
+
+    def test_irregular_falls_back(self):
+        self.assertSameAsLegacy(
+            node(u"a", node(u"value", u"\nstarts with a newline")),
+            regular=False)
+        self.assertSameAsLegacy(
+            node(u"a", node(u"value",
+                            u'line\nbreak <output value="/a/b"/>',
+                            toParseString=True)),
+            regular=False)
@@ -0,0 +1,39 @@
+"""
+Testing that cached xpaths follow changes to the survey tree.
+"""
+from unittest2 import TestCase
+from pyxform import Survey, Section, InputQuestion
+
+
+class XPathCacheTests(TestCase):
+
+    def setUp(self):
+        self.survey = Survey(name=u"survey")
+        self.group = Section(name=u"group", type=u"group")
+        self.question = InputQuestion(name=u"q", type=u"text")
+        self.group.add_child(self.question)
+        self.survey.add_child(self.group)
+
+    def test_xpath(self):
+        self.assertEqual(self.question.get_xpath(), u"/survey/group/q")
+        self.assertEqual(self.question.get_lineage(),
+                         [self.survey, self.group, self.question])
+        self.assertIs(self.question.get_root(), self.survey)
+
+    def test_rename_ancestor(self):
+        self.assertEqual(self.question.get_xpath(), u"/survey/group/q")
+        self.group.name = u"renamed"
+        self.assertEqual(self.question.get_xpath(), u"/survey/renamed/q")
+
+    def test_move_to_other_parent(self):
+        self.assertEqual(self.question.get_xpath(), u"/survey/group/q")
+        other_group = Section(name=u"other", type=u"group")
+        self.survey.add_child(other_group)
+        other_group.add_child(self.question)
+        self.assertEqual(self.question.get_xpath(), u"/survey/other/q")
+
+    def test_flat_group(self):
+        self.assertEqual(self.question.get_xpath(), u"/survey/group/q")
+        self.group[u"flat"] = True
+        self.assertEqual(self.question.get_xpath(), u"/survey/q")
+        self.assertEqual(self.group.get_xpath(), u"/survey")
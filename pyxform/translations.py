@@ -0,0 +1,100 @@
+"""
+The itext translations of a survey as a table of the translated paths by
+language.
+"""
+
+
+class TranslationTable(dict):
+    """
+    A dict of a column for each language, which maps the paths (itext ids)
+    translated in the language to their content: a dict of content type
+    ("long", "image", "audio"...) to the text or media.
+
+    The columns and contents are plain dicts filled in the order the survey
+    adds them, which is the order of the itext. A path is stored once and
+    shared by the columns.
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._paths = {}
+        self._path_order = []
+
+    def _path(self, path):
+        stored = self._paths.get(path)
+        if stored is None:
+            stored = self._paths[path] = path
+            self._path_order.append(path)
+        return stored
+
+    def _column(self, language):
+        column = self.get(language)
+        if column is None:
+            column = self[language] = {}
+        return column
+
+    def set_text(self, language, path, text):
+        """
+        Make text the only content of path in language.
+        """
+        self._column(language)[self._path(path)] = {"long": text}
+
+    def set_content(self, language, path, content_type, value):
+        """
+        Set one content type of path in language.
+        """
+        path = self._path(path)
+        column = self._column(language)
+        content = column.get(path)
+        if content is None:
+            content = column[path] = {}
+        content[content_type] = value
+
+    def fill(self, placeholder):
+        """
+        Give every language every path, with every content type of the path
+        in any language, using placeholder for the missing contents.
+        """
+        columns = self.values()
+        content_types = {}
+        for column in columns:
+            for path, content in column.iteritems():
+                # unions with lists give the sets the order they always had
+                types = content_types.get(path)
+                content_types[path] = set(content.keys()) if types is None \
+                    else types.union(content.keys())
+        for column in columns:
+            for path, types in content_types.iteritems():
+                content = column.get(path)
+                if content is None:
+                    content = column[path] = {}
+                elif len(content) == len(types):
+                    # the content types of a path include those of content
+                    continue
+                for content_type in types:
+                    if content_type not in content:
+                        content[content_type] = placeholder
+
+    def shared_paths(self):
+        """
+        Returns a dict mapping each path that has the same content in every
+        language as a path added before it, for the same kind of text
+        (label, hint...), to the first of those paths.
+        """
+        columns = self.values()
+        first_paths = {}
+        shared = {}
+        for path in self._path_order:
+            key = [path.partition(":")[-1]]
+            for column in columns:
+                content = column.get(path)
+                key.append(None if content is None
+                           else frozenset(content.items()))
+            try:
+                first_path = first_paths.setdefault(tuple(key), path)
+            except TypeError:
+                # media given as a dict, the path keeps its own texts
+                continue
+            if first_path != path:
+                shared[path] = first_path
+        return shared
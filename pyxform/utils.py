@@ -1,10 +1,8 @@
-from xml.dom.minidom import Text, Element, parseString
+from xml.dom.minidom import Node, Text, Element, parseString
 import re
 import codecs
 import json
 import copy
-import csv
-import xlrd
 
 SEP = "_"
 
@@ -74,6 +72,26 @@ def node(*args, **kwargs):
     return result
 
 
+def clone_node(xml_node):
+    """
+    Returns a deep copy of a xml.dom.minidom node made by node, without
+    its parent. Unlike cloneNode this works for nodes that are in no
+    document.
+    """
+    if xml_node.nodeType == Node.TEXT_NODE:
+        result = Text()
+        result.data = xml_node.data
+        return result
+    if xml_node.nodeType != Node.ELEMENT_NODE:
+        return xml_node.cloneNode(True)
+    result = Element(xml_node.tagName)
+    for name, attribute in xml_node._attrs.iteritems():
+        result.setAttribute(name, attribute.value)
+    for child in xml_node.childNodes:
+        result.appendChild(clone_node(child))
+    return result
+
+
 def get_pyobj_from_json(str_or_path):
     """
     This function takes either a json string or a path to a json file,
@@ -95,6 +113,8 @@ def flatten(li):
             yield it
 
 def sheet_to_csv(workbook_path, csv_path, sheet_name):
+    import csv
+    import xlrd
     wb = xlrd.open_workbook(workbook_path)
     try:
         sheet = wb.sheet_by_name(sheet_name)
@@ -8,9 +8,6 @@ import copy
 import codecs
 from operator import itemgetter
 
-from lxml import etree
-from lxml.etree import ElementTree
-
 from . import aliases
 from . import constants
 from . import builder
@@ -80,6 +77,7 @@ class XmlDictObject(dict):
 
 
 def _ConvertDictToXmlRecurse(parent, dictitem):
+    from lxml.etree import ElementTree
     assert not isinstance(dictitem, list)
 
     if isinstance(dictitem, dict):
@@ -104,6 +102,7 @@ def ConvertDictToXml(xmldict):
     """
     Converts a dictionary to an XML ElementTree Element
     """
+    from lxml.etree import ElementTree
 
     roottag = xmldict.keys()[0]
     root = ElementTree.Element(roottag)
@@ -157,6 +156,7 @@ def ConvertXmlToDict(root, dictclass=XmlDictObject):
     """
     Converts an XML file or ElementTree Element to a dictionary
     """
+    from lxml import etree
 
     # If a string is passed in, try to open it as a file
     if isinstance(root, basestring):
@@ -258,6 +258,7 @@ class XFormToDictBuilder:
 
     @staticmethod
     def get_dict_from_xml(xml_file_object):
+        from lxml import etree
         parser = etree.XMLParser(remove_comments=True)
         xml_root= etree.parse(xml_file_object, parser=parser).getroot()
         xml_dict= ConvertXmlToDict(xml_root)
@@ -3,76 +3,19 @@
 # todo: this has been copied from xform_manager, we need to figure out
 # where this code is actually going to live.
 
-from xml.dom import minidom
-import re
+from itertools import izip
+from xml.parsers import expat
 
 XFORM_ID_STRING = u"_xform_id_string"
 
-def _xml_node_to_dict(node):
-    assert isinstance(node, minidom.Node)
-    if len(node.childNodes)==0:
-        # there's no data for this leaf node
-        value = None
-    elif len(node.childNodes)==1 and \
-            node.childNodes[0].nodeType==node.TEXT_NODE:
-        # there is data for this leaf node
-        value = node.childNodes[0].nodeValue
-    else:
-        # this is an internal node
-        value = {}
-        for child in node.childNodes:
-            d = _xml_node_to_dict(child)
-            child_name = child.nodeName
-            assert d.keys()==[child_name]
-            if child_name not in value:
-                # copy the value into the dict
-                value[child_name] = d[child_name]
-            elif type(value[child_name])==list:
-                # add to the existing list
-                value[child_name].append(d[child_name])
-            else:
-                # create a new list
-                value[child_name] = [value[child_name], d[child_name]]
-    return {node.nodeName: value}
-
-def _flatten_dict(d, prefix):
-    """
-    Return a list of XPath, value pairs.
-    """
-    assert type(d)==dict
-    assert type(prefix)==list
-
-    for key, value in d.items():
-        new_prefix = prefix + [key]
-        if type(value)==dict:
-            for pair in _flatten_dict(value, new_prefix):
-                yield pair
-        elif type(value)==list:
-            for i, item in enumerate(value):
-                item_prefix = list(new_prefix) # make a copy
-                # note on indexing xpaths: IE5 and later has
-                # implemented that [0] should be the first node, but
-                # according to the W3C standard it should have been
-                # [1]. I'm adding 1 to i to start at 1.
-                item_prefix[-1] += u"[%s]" % unicode(i+1)
-                if type(item)==dict:
-                    for pair in _flatten_dict(item, item_prefix):
-                        yield pair
-                else:
-                    yield (item_prefix, item)
-        else:
-            yield (new_prefix, value)
+# the whitespace between tags, which is not data
+WHITESPACE = u" \t\n\r\f\v"
 
-def _get_all_attributes(node):
-    """
-    Go through an XML document returning all the attributes we see.
-    """
-    if hasattr(node, "hasAttributes") and node.hasAttributes():
-        for key in node.attributes.keys():
-            yield key, node.getAttribute(key)
-    for child in node.childNodes:
-        for pair in _get_all_attributes(child):
-            yield pair
+# the items of the lists kept for the elements being parsed: the flat path,
+# the dict of the children (None for leaves), the text, where the leaves of
+# the element start and end in the flat paths, and for each child name the
+# number of children and the first child
+PATH, CHILDREN, TEXT, LEAVES_START, LEAVES_END, REPEATS = range(6)
 
 
 class XFormInstanceParser(object):
@@ -81,18 +24,103 @@ class XFormInstanceParser(object):
         self.parse(xml_str)
 
     def parse(self, xml_str):
-        clean_xml_str = xml_str.strip()
-        clean_xml_str = re.sub(ur">\s+<", u"><", clean_xml_str)
-        self._xml_obj = minidom.parseString(clean_xml_str)
-        self._root_node = self._xml_obj.documentElement
-        self._dict = _xml_node_to_dict(self._root_node)
-        self._flat_dict = {}
-        for path, value in _flatten_dict(self._dict, []):
-            self._flat_dict[u"/".join(path[1:])] = value
-        self._set_attributes()
+        """
+        Parses the instance in one pass over the xml, a string or a file,
+        making the dict of the instance, its flat dict and its attributes.
+        Whitespace between tags is ignored.
+        """
+        self._dict = None
+        self._attributes = attributes = {}
+        stack = []
+        # the flat paths and values of the leaves
+        paths = []
+        values = []
+
+        def start_element(name, element_attributes):
+            for key, value in element_attributes.iteritems():
+                assert key not in attributes
+                attributes[key] = value
+            if not stack:
+                # the root is not part of the paths
+                stack.append([u"", None, None, 0, 0, None])
+                return
+            parent = stack[-1]
+            if parent[CHILDREN] is None:
+                parent[CHILDREN] = {}
+                parent[TEXT] = None
+                parent[REPEATS] = {}
+            repeat = parent[REPEATS].get(name)
+            if repeat is None:
+                segment = name
+            else:
+                # note on indexing xpaths: IE5 and later has
+                # implemented that [0] should be the first node, but
+                # according to the W3C standard it should have been
+                # [1]. I'm adding 1 to i to start at 1.
+                repeat[0] += 1
+                segment = u"%s[%d]" % (name, repeat[0])
+                if repeat[0] == 2:
+                    # the paths of the first child become indexed too
+                    first = repeat.pop()
+                    old_path = first[PATH]
+                    new_path = old_path + u"[1]"
+                    for i in xrange(first[LEAVES_START], first[LEAVES_END]):
+                        paths[i] = new_path + paths[i][len(old_path):]
+            parent_path = parent[PATH]
+            element = [parent_path + u"/" + segment if parent_path
+                       else segment, None, None, len(paths), 0, None]
+            if repeat is None:
+                parent[REPEATS][name] = [1, element]
+            stack.append(element)
+
+        def character_data(data):
+            element = stack[-1]
+            if element[CHILDREN] is None:
+                text = element[TEXT]
+                element[TEXT] = data if text is None else text + data
+
+        def end_element(name):
+            element = stack.pop()
+            value = element[CHILDREN]
+            if value is None:
+                value = element[TEXT]
+                if value is not None and not value.strip(WHITESPACE):
+                    # there's no data for this leaf node
+                    value = None
+                paths.append(element[PATH])
+                values.append(value)
+            element[LEAVES_END] = len(paths)
+            if not stack:
+                self._dict = {name: value}
+                return
+            children = stack[-1][CHILDREN]
+            if name not in children:
+                children[name] = value
+            elif type(children[name]) == list:
+                # add to the existing list
+                children[name].append(value)
+            else:
+                # create a new list
+                children[name] = [children[name], value]
+
+        if isinstance(xml_str, unicode):
+            parser = expat.ParserCreate("UTF-8")
+            xml_str = xml_str.encode("utf-8")
+        else:
+            parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        if hasattr(xml_str, "read"):
+            parser.ParseFile(xml_str)
+        else:
+            parser.Parse(xml_str.lstrip(), True)
+        self._root_node_name, = self._dict.keys()
+        self._flat_dict = dict(izip(paths, values))
 
     def get_root_node_name(self):
-        return self._root_node.nodeName
+        return self._root_node_name
 
     def get(self, abbreviated_xpath):
         return self.to_flat_dict()[abbreviated_xpath]
@@ -106,13 +134,6 @@ class XFormInstanceParser(object):
     def get_attributes(self):
         return self._attributes
 
-    def _set_attributes(self):
-        self._attributes = {}
-        all_attributes = list(_get_all_attributes(self._root_node))
-        for key, value in all_attributes:
-            assert key not in self._attributes
-            self._attributes[key] = value
-
     def get_xform_id_string(self):
         return self._attributes[u"id"]
 
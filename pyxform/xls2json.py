@@ -9,8 +9,8 @@ import os
 import constants
 import aliases
 from errors import PyXFormError
-from xls2json_backends import xls_to_dict, csv_to_dict
 from utils import is_valid_xml_tag
+from choices import group_choice_lists
 
 def print_pyobj_to_json(pyobj, path=None):
     """
@@ -65,6 +65,84 @@ def list_to_nested_dict(lst):
         return lst[0]
 
 
+GROUP_DELIMITER = u"::"
+
+
+def _header_path(header, header_aliases, use_double_colons, ignore_case):
+    """
+    Split a column header into the list of keys its values are stored
+    under, with the first token dealiased.
+    """
+    if ignore_case:
+        header = header.lower()
+
+    if use_double_colons:
+        tokens = header.split(GROUP_DELIMITER)
+
+#    else:
+#        #We do the initial parse using single colons
+#        #for backwards compatibility and
+#        #only the first single is used
+#        #in order to avoid nesting jr:something tokens.
+#        if len(tokens) > 1:
+#            tokens[1:] = [u":".join(tokens[1:])]
+    else:
+        #I think the commented out section above
+        # break if there is something like media:image:english
+        #so maybe a better backwards compatibility hack
+        # is to join any jr token with the next token
+        tokens = header.split(u":")
+        if "jr" in tokens:
+            jr_idx = tokens.index("jr")
+            tokens[jr_idx] = u":".join(tokens[jr_idx: jr_idx + 2])
+            tokens.pop(jr_idx + 1)
+
+    dealiased_first_token = header_aliases.get(tokens[0], tokens[0])
+    return dealiased_first_token.split(GROUP_DELIMITER) + tokens[1:]
+
+
+def _merge_value(out_row, path, value, default_language):
+    """
+    Merge value into out_row under the keys in path, in place.
+    Gives the same result as
+        merge_dicts(out_row, list_to_nested_dict(path + [value]))
+    descending into the nested dicts already in out_row and only
+    falling back to merge_dicts where a value meets a dict or another
+    value (e.g. label and label::French).
+    """
+    container = out_row
+    last = len(path) - 1
+    for index, key in enumerate(path):
+        current = container.get(key)
+        if current is None or current == {}:
+            container[key] = list_to_nested_dict(path[index + 1:] + [value])
+            return
+        if index < last and type(current) is dict:
+            container = current
+            continue
+        container[key] = merge_dicts(
+            current, list_to_nested_dict(path[index + 1:] + [value]),
+            default_language)
+        return
+
+
+def _group_headers(row, header_paths, header_aliases, use_double_colons,
+                   default_language, ignore_case):
+    """
+    Return the grouped and dealiased version of a row, see
+    dealias_and_group_headers. header_paths caches the key path of
+    every header seen so far.
+    """
+    out_row = dict()
+    for header, val in row.items():
+        path = header_paths.get(header)
+        if path is None:
+            path = header_paths[header] = _header_path(
+                header, header_aliases, use_double_colons, ignore_case)
+        _merge_value(out_row, path, val, default_language)
+    return out_row
+
+
 def dealias_and_group_headers(dict_array, header_aliases, use_double_colons,
                               default_language=u"default", ignore_case=False):
     """
@@ -78,47 +156,18 @@ def dealias_and_group_headers(dict_array, header_aliases, use_double_colons,
     default_language -- used to group labels/hints/etc
     without a language specified with localized versions.
     """
-    GROUP_DELIMITER = u"::"
-    out_dict_array = list()
-    for row in dict_array:
-        out_row = dict()
-        for header, val in row.items():
+    # the headers are the same for every row, split each of them once
+    header_paths = {}
+    return [_group_headers(row, header_paths, header_aliases,
+                           use_double_colons, default_language, ignore_case)
+            for row in dict_array]
 
-            if ignore_case:
-                header = header.lower()
 
-            tokens = list()
-
-            if use_double_colons:
-                tokens = header.split(GROUP_DELIMITER)
-
-#            else:
-#                #We do the initial parse using single colons
-#                #for backwards compatibility and
-#                #only the first single is used
-#                #in order to avoid nesting jr:something tokens.
-#                if len(tokens) > 1:
-#                    tokens[1:] = [u":".join(tokens[1:])]
-            else:
-                #I think the commented out section above
-                # break if there is something like media:image:english
-                #so maybe a better backwards compatibility hack
-                # is to join any jr token with the next token
-                tokens = header.split(u":")
-                if "jr" in tokens:
-                    jr_idx = tokens.index("jr")
-                    tokens[jr_idx] = u":".join(tokens[jr_idx: jr_idx + 2])
-                    tokens.pop(jr_idx + 1)
-
-            dealiased_first_token = header_aliases.get(tokens[0], tokens[0])
-            tokens = dealiased_first_token.split(GROUP_DELIMITER) + tokens[1:]
-            new_key = tokens[0]
-            new_value = list_to_nested_dict(tokens[1:] + [val])
-            out_row = merge_dicts(
-                out_row, {new_key: new_value}, default_language)
-
-        out_dict_array.append(out_row)
-    return out_dict_array
+def _dealias_type(row):
+    found_type = row.get(constants.TYPE)
+    # the type is a dict if the type column has a language suffix
+    if isinstance(found_type, basestring) and found_type in aliases.type:
+        row[constants.TYPE] = aliases.type[found_type]
 
 
 def dealias_types(dict_array):
@@ -127,12 +176,22 @@ def dealias_types(dict_array):
     replace them with the name they map to.
     """
     for row in dict_array:
-        found_type = row.get(constants.TYPE)
-        if found_type in aliases.type.keys():
-            row[constants.TYPE] = aliases.type[found_type]
+        _dealias_type(row)
     return dict_array
 
 
+MULTIPLE_SPACES_RE = re.compile(r"( )+")
+
+
+def _clean_text(row):
+    for key, value in row.items():
+        if isinstance(value, basestring):
+            value = value.strip()
+            if "  " in value:
+                value = MULTIPLE_SPACES_RE.sub(" ", value)
+            row[key] = value
+
+
 def clean_text_values(dict_array):
     """
     Go though the dict array and strips all text values.
@@ -140,12 +199,28 @@ def clean_text_values(dict_array):
     Note that the keys don't get cleaned, which could be an issue.
     """
     for row in dict_array:
-        for key, value in row.items():
-            if isinstance(value, basestring):
-                row[key] = re.sub(r"( )+", " ", value.strip())
+        _clean_text(row)
     return dict_array
 
 
+def normalize_survey_rows(rows, header_aliases, use_double_colons,
+                          default_language=u"default", clean_text=True):
+    """
+    Generator doing what clean_text_values (if clean_text is true),
+    dealias_and_group_headers and dealias_types do to a survey sheet,
+    one row at a time. rows can be any iterable of row dicts, e.g. the
+    rows of a sheet as they are read from the spreadsheet.
+    """
+    header_paths = {}
+    for row in rows:
+        if clean_text:
+            _clean_text(row)
+        out_row = _group_headers(row, header_paths, header_aliases,
+                                 use_double_colons, default_language, False)
+        _dealias_type(out_row)
+        yield out_row
+
+
 #This is currently unused because name uniqueness is checked in json2xform.
 def check_name_uniqueness(dict_array):
     """
@@ -195,6 +270,9 @@ def has_double_colon(workbook_dict):
     return true if one is found.
     """
     for sheet in workbook_dict.values():
+        if not isinstance(sheet, list):
+            # rows that are read as they are used, see workbook_to_json
+            continue
         for row in sheet:
             for column_header in row.keys():
                 if type(column_header) is not unicode:
@@ -245,6 +323,10 @@ def workbook_to_json(
     """
     workbook_dict -- nested dictionaries representing a spreadsheet.
                     should be similar to those returned by xls_to_dict
+                    The survey and choices rows can be iterators (e.g.
+                    from xls_to_dict with streamed_sheets) along with
+                    survey_header and choices_header entries, they are
+                    then parsed as they are read, choices first.
     form_name -- The spreadsheet's filename
     default_language -- default_language does two things:
     1. In the xform the default language is the language reverted to when
@@ -261,6 +343,7 @@ def workbook_to_json(
     json form spec.
     """
     # ensure required headers are present
+    survey_headers = None
     survey_header_sheet = u'%s_header' % constants.SURVEY
     if survey_header_sheet in workbook_dict:
         survey_headers = workbook_dict.get(survey_header_sheet)
@@ -271,6 +354,7 @@ def workbook_to_json(
             raise PyXFormError(u"The survey sheet must have on the first row"
                                u" name and type columns.")
         del workbook_dict[survey_header_sheet]
+    choices_headers = None
     choices_header_sheet = u'%s_header' % constants.CHOICES
     if choices_header_sheet in workbook_dict:
         choices_headers = workbook_dict.get(choices_header_sheet)
@@ -300,6 +384,16 @@ def workbook_to_json(
     #syntax (i.e. jr:constraintMsg),
     #so we only use them if we have to for backwards compatibility.
     use_double_colons = has_double_colon(workbook_dict)
+    if not use_double_colons:
+        # the headers of the sheets whose rows are read as they are used
+        streamed_headers = {}
+        if survey_headers and \
+                not isinstance(workbook_dict.get(constants.SURVEY), list):
+            streamed_headers[constants.SURVEY] = survey_headers
+        if choices_headers and \
+                not isinstance(workbook_dict.get(constants.CHOICES), list):
+            streamed_headers[constants.CHOICES] = choices_headers
+        use_double_colons = has_double_colon(streamed_headers)
 
     #Break the spreadsheet dict into easier to access objects
     #(settings, choices, survey_sheet):
@@ -319,6 +413,18 @@ def workbook_to_json(
         settings[u"add_none_option"] = aliases.yes_no.get(
             settings[u"add_none_option"], False)
 
+    #shared_choices is a boolean that when true, has the choice lists used
+    #by several selects emitted once and used through itemsets.
+    if u"shared_choices" in settings:
+        settings[u"shared_choices"] = aliases.yes_no.get(
+            settings[u"shared_choices"], False)
+
+    #shared_itext is a boolean that when true, has the texts with the same
+    #translations written once in the itext and referenced through one id.
+    if u"shared_itext" in settings:
+        settings[u"shared_itext"] = aliases.yes_no.get(
+            settings[u"shared_itext"], False)
+
     #Here we create our json dict root with default settings:
     id_string = settings.get(constants.ID_STRING, form_name)
     form_name= form_name if form_name else id_string
@@ -364,19 +470,19 @@ def workbook_to_json(
         if 'choices' in cascading_choices[0]:
             choices_sheet = choices_sheet + cascading_choices[0]['choices']
 
-    combined_lists = group_dictionaries_by_key(
-        choices_and_columns_sheet + choices_sheet + columns_sheet,
-        constants.LIST_NAME)
-
-    choices = combined_lists
+    choices = group_choice_lists(
+        choices_and_columns_sheet + choices_sheet + columns_sheet)
     #Make sure all the options have the required properties:
     warnedabout = set()
     for list_name, options in choices.items():
+        if options.unnamed:
+            info = "[list_name : " + list_name + ']'
+            raise PyXFormError("On the choices sheet there is "
+                               "a option with no name. " + info)
+        if not options.unlabelled and not any(
+                header == '' or ' ' in header for header in options.headers):
+            continue
         for option in options:
-            if constants.NAME not in option:
-                info = "[list_name : " + list_name + ']'
-                raise PyXFormError("On the choices sheet there is "
-                                   "a option with no name. " + info)
             if 'label' not in option:
                 info = "[list_name : " + list_name + ']'
                 warnings.append(
@@ -406,16 +512,12 @@ def workbook_to_json(
         raise PyXFormError(
             "You must have a sheet named (case-sensitive): "
             + constants.SURVEY)
-    survey_sheet = workbook_dict[constants.SURVEY]
-    #Process the headers:
+    #Process the headers (as the rows are parsed below):
     clean_text_values_enabled = aliases.yes_no.get(
         settings.get("clean_text_values", "true()"))
-    if clean_text_values_enabled:
-        survey_sheet = clean_text_values(survey_sheet)
-    survey_sheet = dealias_and_group_headers(
-        survey_sheet, aliases.survey_header,
-        use_double_colons, default_language)
-    survey_sheet = dealias_types(survey_sheet)
+    survey_sheet = normalize_survey_rows(
+        workbook_dict[constants.SURVEY], aliases.survey_header,
+        use_double_colons, default_language, clean_text_values_enabled)
     ##################################
 
     #Parse the survey sheet while generating a survey in our json format:
@@ -682,14 +784,13 @@ def workbook_to_json(
 
                 #Validate select_multiple choice names by making sure
                 #they have no spaces (will cause errors in exports).
-                if select_type == constants.SELECT_ALL_THAT_APPLY:
-                    for choice in choices[list_name]:
-                        if ' ' in choice[constants.NAME]:
-                            raise PyXFormError(
-                                "Choice names with spaces cannot be added "
-                                "to multiple choice selects. See [" +
-                                choice[constants.NAME] + "] in [" +
-                                list_name + "]")
+                if select_type == constants.SELECT_ALL_THAT_APPLY and \
+                        choices[list_name].names_with_spaces:
+                    raise PyXFormError(
+                        "Choice names with spaces cannot be added "
+                        "to multiple choice selects. See [" +
+                        choices[list_name].names_with_spaces[0] + "] in [" +
+                        list_name + "]")
 
                 specify_other_question = None
                 if parse_dict.get("specify_other") is not None:
@@ -823,12 +924,14 @@ def workbook_to_json(
     return json_dict
 
 
-def parse_file_to_workbook_dict(path, file_object=None):
+def parse_file_to_workbook_dict(path, file_object=None, stream_rows=False):
     """
     Given a xls or csv workbook file use xls2json_backends to create
     a python workbook_dict.
     workbook_dicts are organized as follows:
     {sheetname : [{column_header : column_value_in_array_indexed_row}]}
+    With stream_rows the choices and survey rows of xls and xlsx files are
+    iterators reading them as workbook_to_json uses them.
     """
     (_, filename) = os.path.split(path)
     if not filename:
@@ -837,8 +940,12 @@ def parse_file_to_workbook_dict(path, file_object=None):
     if not extension:
         raise PyXFormError("No extension.")
 
+    # the spreadsheet backends (and xlrd) are only needed to read a file
+    from xls2json_backends import xls_to_dict, csv_to_dict
     if extension == ".xls" or extension == ".xlsx":
-        return xls_to_dict(file_object if file_object is not None else path)
+        return xls_to_dict(
+            file_object if file_object is not None else path,
+            (constants.CHOICES, constants.SURVEY) if stream_rows else ())
     elif extension == ".csv":
         return csv_to_dict(file_object if file_object is not None else path)
     else:
@@ -856,7 +963,8 @@ def parse_file_to_json(path, default_name=None, default_language=u"default",
     """
     A wrapper for workbook_to_json
     """
-    workbook_dict = parse_file_to_workbook_dict(path, file_object)
+    workbook_dict = parse_file_to_workbook_dict(path, file_object,
+                                                stream_rows=True)
     if default_name is None:
         default_name = unicode(get_filename(path))
     return workbook_to_json(
@@ -3,12 +3,19 @@ XLS-to-dict and csv-to-dict are essentially backends for xls2json.
 """
 import xlrd
 from xlrd import XLRDError
+from xlrd.formatting import is_date_format_string
+from xlrd.xlsx import error_code_from_text as XLSX_ERROR_CODES
 import csv
 import cStringIO
 import constants
 import re
 import datetime
 import collections
+import zipfile
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
 from errors import PyXFormError
 
 
@@ -24,287 +31,563 @@ def _list_to_dict_list(list_items):
         return [k]
     return []
 
+def _iswhitespace(string):
+    return isinstance(string, basestring) and len(string.strip()) == 0
 
-def xls_to_dict(path_or_file):
+
+def xls_value_to_unicode(value, value_type, datemode):
     """
-    Return a Python dictionary with a key for each worksheet
-    name. For each sheet there is a list of dictionaries, each
-    dictionary corresponds to a single row in the worksheet. A
-    dictionary has keys taken from the column headers and values
-    equal to the cell value for that row and column.
-    All the keys and leaf elements are unicode text.
+    Take a xls formatted value and try to make a unicode string
+    representation.
     """
-    try:
-        if isinstance(path_or_file, basestring):
-            workbook = xlrd.open_workbook(filename=path_or_file)
+    if value_type == xlrd.XL_CELL_BOOLEAN:
+        return u"TRUE" if value else u"FALSE"
+    elif value_type == xlrd.XL_CELL_NUMBER:
+        #Try to display as an int if possible.
+        int_value = int(value)
+        if int_value == value:
+            return unicode(int_value)
         else:
-            workbook = xlrd.open_workbook(file_contents=path_or_file.read())
-    except XLRDError, e:
-        raise PyXFormError("Error reading .xls file: %s" % e.message)
+            return unicode(value)
+    elif value_type is xlrd.XL_CELL_DATE:
+        #Warn that it is better to single quote as a string.
+        #error_location = cellFormatString % (ss_row_idx, ss_col_idx)
+        #raise Exception(
+        #   "Cannot handle excel formatted date at " + error_location)
+        datetime_or_time_only = xlrd.xldate_as_tuple(value, datemode)
+        if datetime_or_time_only[:3] == (0, 0, 0):
+            # must be time only
+            return unicode(datetime.time(*datetime_or_time_only[3:]))
+        return unicode(datetime.datetime(*datetime_or_time_only))
+    else:
+        #ensure unicode and replace nbsp spaces with normal ones
+        #to avoid this issue:
+        #https://github.com/modilabs/pyxform/issues/83
+        return unicode(value).replace(unichr(160), ' ')
 
-    def xls_value_to_unicode(value, value_type):
-        """
-        Take a xls formatted value and try to make a unicode string
-        representation.
-        """
-        if value_type == xlrd.XL_CELL_BOOLEAN:
-            return u"TRUE" if value else u"FALSE"
-        elif value_type == xlrd.XL_CELL_NUMBER:
-            #Try to display as an int if possible.
-            int_value = int(value)
-            if int_value == value:
-                return unicode(int_value)
-            else:
-                return unicode(value)
-        elif value_type is xlrd.XL_CELL_DATE:
-            #Warn that it is better to single quote as a string.
-            #error_location = cellFormatString % (ss_row_idx, ss_col_idx)
-            #raise Exception(
-            #   "Cannot handle excel formatted date at " + error_location)
-            datetime_or_time_only = xlrd.xldate_as_tuple(
-                value, workbook.datemode)
-            if datetime_or_time_only[:3] == (0, 0, 0):
-                # must be time only
-                return unicode(datetime.time(*datetime_or_time_only[3:]))
-            return unicode(datetime.datetime(*datetime_or_time_only))
-        else:
-            #ensure unicode and replace nbsp spaces with normal ones
-            #to avoid this issue:
-            #https://github.com/modilabs/pyxform/issues/83
-            return unicode(value).replace(unichr(160), ' ')
-
-    def xls_to_dict_normal_sheet(sheet):
-        def iswhitespace(string):
-            return (
-                isinstance(string, basestring) and len(string.strip()) == 0)
-
-        #Check for duplicate column headers
-        column_header_set = set()
-        for column in range(0, sheet.ncols):
-            column_header = sheet.cell_value(0, column)
-            if column_header in column_header_set:
-                raise PyXFormError(
-                    u"Duplicate column header: %s" % column_header)
-            # xls file with 3 columns mostly have a 3 more columns that are
-            # blank by default or something, skip during check
-            if column_header is not None:
-                if not iswhitespace(column_header):
-                    column_header_set.add(column_header)
-
-        result = []
-        for row in range(1, sheet.nrows):
+
+def xls_value_from_sheet(sheet, row, column, datemode):
+    value = sheet.cell_value(row, column)
+    value_type = sheet.cell_type(row, column)
+    if value is not None and value != "":
+        return xls_value_to_unicode(value, value_type, datemode)
+    else:
+        raise PyXFormError("Empty Value")
+
+
+def _sheet_rows_to_dicts(rows, datemode):
+    """
+    Turn an iterator over raw sheet rows (lists of (value, cell type)
+    pairs) into the header list and an iterator over row dicts.
+    The header row is consumed eagerly so duplicate column headers are
+    reported before any rows are produced; the keys for each column are
+    resolved once instead of once per cell.
+    """
+    header_row = next(rows, [])
+
+    #Check for duplicate column headers
+    column_header_set = set()
+    keys = []
+    for column_header, _ in header_row:
+        if column_header in column_header_set:
+            raise PyXFormError(
+                u"Duplicate column header: %s" % column_header)
+        # xls file with 3 columns mostly have a 3 more columns that are
+        # blank by default or something, skip during check
+        if column_header is not None:
+            if not _iswhitespace(column_header):
+                column_header_set.add(column_header)
+        # convert to string, in case it is not string
+        keys.append((u"%s" % column_header).strip())
+    ncols = len(keys)
+
+    def row_dicts():
+        for row in rows:
             row_dict = {}
-            for column in range(0, sheet.ncols):
-                #Changing to cell_value function
-                # convert to string, in case it is not string
-                key = u"%s" % sheet.cell_value(0, column)
-                key = key.strip()
-                value = sheet.cell_value(row, column)
+            for column, (value, value_type) in enumerate(row):
+                key = keys[column] if column < ncols else u""
                 # remove whitespace at the beginning and end of value
                 if isinstance(value, basestring):
                     value = value.strip()
-                value_type = sheet.cell_type(row, column)
                 if value is not None:
-                    if not iswhitespace(value):
-                        row_dict[key] = xls_value_to_unicode(value, value_type)
+                    if not _iswhitespace(value):
+                        row_dict[key] = xls_value_to_unicode(
+                            value, value_type, datemode)
 #            Taking this condition out so I can get accurate row numbers.
 #            TODO: Do the same for csvs
 #            if row_dict != {}:
-            result.append(row_dict)
-        return result, _list_to_dict_list(column_header_set)
-
-    def xls_value_from_sheet(sheet, row, column):
-        value = sheet.cell_value(row, column)
-        value_type = sheet.cell_type(row, column)
-        if value is not None and value != "":
-            return xls_value_to_unicode(value, value_type)
+            yield row_dict
+
+    return _list_to_dict_list(column_header_set), row_dicts()
+
+
+class _RowListSheet(object):
+    """
+    Minimal stand-in for a xlrd sheet built from already read raw rows,
+    for the sheets (cascades) that need random access to their cells.
+    """
+    def __init__(self, name, rows):
+        self.name = name
+        self.nrows = len(rows)
+        self.ncols = max([len(row) for row in rows] or [0])
+        self._rows = rows
+
+    def _cell(self, row, column):
+        cells = self._rows[row]
+        if column < len(cells):
+            return cells[column]
+        return (u"", xlrd.XL_CELL_EMPTY)
+
+    def cell_value(self, row, column):
+        return self._cell(row, column)[0]
+
+    def cell_type(self, row, column):
+        return self._cell(row, column)[1]
+
+
+def _last_sheets_last(sheets, sheet_name, last_sheets):
+    """
+    Return the list sheets with the sheets named in last_sheets moved to
+    its end, in the order of last_sheets.
+    """
+    last = [None] * len(last_sheets)
+    others = []
+    for sheet in sheets:
+        name = sheet_name(sheet)
+        if name in last_sheets:
+            last[last_sheets.index(name)] = sheet
         else:
-            raise PyXFormError("Empty Value")
-
-    def xls_to_dict_cascade_sheet(sheet):
-        result = []
-        for column in range(1, sheet.ncols):  # col 1 = headers; don't process
-            # first row value for this column is the key
-            col_dict = {}
-            col_name = sheet.cell_value(0, column)
-            col_dict[constants.NAME] = col_name
-            col_dict["choice_labels"] = []
-            col_dict["prev_choice_labels"] = []
-            for row in range(1, sheet.nrows):
-
-                # pass 0: build col_dict for first time
-                key = sheet.cell_value(row, 0)
-                if key == "choice_label":
-                    col_dict["choice_labels"].append(
-                        xls_value_from_sheet(sheet, row, column))
-                    if column > 1:
-                        col_dict["prev_choice_labels"].append(
-                            xls_value_from_sheet(sheet, row, column - 1))
-                else:
-                    col_dict[key] = xls_value_from_sheet(sheet, row, column)
-
-                # pass 1: make sure choice_labels are unique,
-                # while keeping the paired prev_choice_label consistent
-                def f(l, (x1, x2)):
-                    if (x1, x2) in l:
-                        return l
-                    else:
-                        return l + [(x1, x2)]
-                zipped = reduce(
-                    f,
-                    zip(col_dict["choice_labels"],
-                        col_dict["prev_choice_labels"]
-                        or col_dict["choice_labels"]), [])
-                col_dict["choice_labels"] = [a for a, b in zipped]
-                if column > 1:
-                    col_dict["prev_choice_labels"] = [b for a, b in zipped]
-                # end make things unique
-            result.append(col_dict)
-
-        # pass 2: explode things according to prev_choices
-        result2 = []
-
-        def slugify(s):
-            return re.sub(r'\W+', '_', s.lower())
-        prefix = "$PREFIX$"
-        for index, level in enumerate(result):
-            if index == 0:
-                result2.append({'lambda': {
-                    constants.NAME: prefix + '_' + level[constants.NAME],
-                    "label": level['label'],
-                    "children": [
-                        {constants.NAME: slugify(x),
-                         'label': x} for x in level['choice_labels']],
-                    "type": "select one",
-                }})
-                result2.append({"stopper": level[constants.NAME]})
-                continue
-            calc_formula_string = "'ERROR'"
-            for prev_choice_label in set(level["prev_choice_labels"]):
-                prev_choice_name = slugify(prev_choice_label)
-                my_name = \
-                    prefix + '_' + level[constants.NAME] + "_in_" + prev_choice_name
-                prev_choice_val = \
-                    "${" + prefix + "_" + result[index - 1][constants.NAME] + "}"
-                result2.append({'lambda': {
-                    constants.NAME: my_name,
-                    "label": level["label"],
-                    "children": [
-                        {constants.NAME: slugify(x), 'label': x}
-                        for (x, y) in zip(
-                            level["choice_labels"],
-                            level["prev_choice_labels"])
-                        if y == prev_choice_label],
-                    constants.BIND: {
-                        u'relevant':
-                        prev_choice_val + "='" + prev_choice_name + "'"},
-                    "type": "select one"
-                }})
-                calc_formula_string = calc_formula_string.replace(
-                    "'ERROR'",
-                    "if(" + prev_choice_val + "='" + prev_choice_name
-                    + "', ${" + my_name + "}, 'ERROR')")
-            result2.append({'lambda': {
-                constants.NAME: prefix + '_' + level[constants.NAME],
-                "type": "calculate",
-                constants.BIND: {u'calculate': calc_formula_string}}})
-            result2.append({"stopper": level[constants.NAME]})
-        return result2
-
-    def _xls_to_dict_cascade_sheet(sheet):
-        result = []
-        rs_dict = {}  # tmp dict to hold entire structure
-
-        def slugify(s):
-            return re.sub(r'\W+', '_', s.strip().lower())
-        prefix = "$PREFIX$"
-        # get col headers and position first, ignore first column
-        for column in range(1, sheet.ncols):
-            col_name = sheet.cell_value(0, column)
-            rs_dict[col_name] = {
-                'pos': column,
-                'data': [],
-                'itemset': col_name,
-                'type': constants.SELECT_ONE,
-                constants.NAME:
-                prefix if (column == sheet.ncols - 1) else u''.join(
-                        [prefix, '_', col_name]),
-                'label': sheet.cell_value(1, column)}
-            if column > 1:
-                rs_dict[col_name]['parent'] = sheet.cell_value(0, column - 1)
+            others.append(sheet)
+    return others + [sheet for sheet in last if sheet is not None]
+
+
+def _iter_xls_sheets(workbook, last_sheets=()):
+    """
+    Yield (sheet_name, raw_rows, datemode) for every sheet of a workbook
+    opened by xlrd with on_demand=True, unloading each sheet once it has
+    been read.
+    """
+    sheet_indexes = _last_sheets_last(
+        range(workbook.nsheets), workbook.sheet_names().__getitem__,
+        last_sheets)
+    for sheet_index in sheet_indexes:
+        sheet = workbook.sheet_by_index(sheet_index)
+
+        def raw_rows(sheet=sheet):
+            for row in range(sheet.nrows):
+                yield zip(sheet.row_values(row), sheet.row_types(row))
+        yield sheet.name, raw_rows(), workbook.datemode
+        workbook.unload_sheet(sheet_index)
+    workbook.release_resources()
+
+
+XLSX_MAGIC = "PK\x03\x04"
+XLSX_MAIN_NS = \
+    u"{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_DOC_REL_NS = \
+    u"{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XLSX_PKG_REL_NS = \
+    u"{http://schemas.openxmlformats.org/package/2006/relationships}"
+XLSX_SPACE_ATTR = u"{http://www.w3.org/XML/1998/namespace}space"
+# Built-in number formats that display dates, see ECMA-376 18.8.30.
+XLSX_DATE_FORMAT_IDS = set(range(14, 23) + range(45, 48))
+XLSX_ESCAPE_RE = re.compile(r"_x[0-9A-Fa-f]{4}_")
+
+
+def _xlsx_text(elem):
+    """
+    Return the (unescaped) text of a <t> or <v> element the way xlrd
+    does.
+    """
+    text = elem.text
+    if text is None:
+        return u""
+    if elem.get(XLSX_SPACE_ATTR) != u"preserve":
+        text = text.strip(u"\t\n \r")
+    return XLSX_ESCAPE_RE.sub(
+        lambda match: unichr(int(match.group(0)[2:6], 16)), unicode(text))
+
+
+def _xlsx_rich_text(elem):
+    """
+    Return the text of a shared string (<si>) or inline string (<is>),
+    concatenating the runs of rich text.
+    """
+    parts = []
+    for child in elem:
+        if child.tag == XLSX_MAIN_NS + u"t":
+            parts.append(_xlsx_text(child))
+        elif child.tag == XLSX_MAIN_NS + u"r":
+            for grandchild in child:
+                if grandchild.tag == XLSX_MAIN_NS + u"t":
+                    parts.append(_xlsx_text(grandchild))
+    return u"".join(parts)
+
+
+def _xlsx_column_index(cell_reference):
+    """
+    "A1" -> 0, "AB12" -> 27
+    """
+    column = 0
+    for char in cell_reference:
+        if char == u"$":
+            continue
+        if not char.isalpha():
+            break
+        column = column * 26 + ord(char.upper()) - ord(u"A") + 1
+    return column - 1
+
+
+def _xlsx_workbook_parts(zip_file):
+    """
+    Read the workbook, its relationships, the styles and the shared
+    strings of a .xlsx zip file.
+    Returns a tuple (sheets, datemode, date_styles, shared_strings)
+    where sheets is a list of (sheet_name, zip member name) pairs and
+    date_styles is the set of cell style indexes that format dates.
+    """
+    members = dict(
+        (name.replace(u"\\", u"/").lower(), name)
+        for name in zip_file.namelist())
+
+    def open_member(name):
+        return zip_file.open(members[name])
+
+    relationships = {}
+    rels = ElementTree.parse(open_member(u"xl/_rels/workbook.xml.rels"))
+    for elem in rels.getroot().findall(XLSX_PKG_REL_NS + u"Relationship"):
+        target = elem.get(u"Target").replace(u"\\", u"/").lower()
+        if target.startswith(u"/"):
+            target = target[1:]
+        else:
+            target = u"xl/" + target
+        relationships[elem.get(u"Id")] = (
+            elem.get(u"Type").split(u"/")[-1], target)
+
+    sheets = []
+    datemode = 0
+    workbook = ElementTree.parse(open_member(u"xl/workbook.xml")).getroot()
+    workbook_pr = workbook.find(XLSX_MAIN_NS + u"workbookPr")
+    if workbook_pr is not None and \
+            workbook_pr.get(u"date1904") in (u"1", u"true", u"on"):
+        datemode = 1
+    for elem in workbook.iter(XLSX_MAIN_NS + u"sheet"):
+        rel_type, target = relationships[elem.get(XLSX_DOC_REL_NS + u"id")]
+        if rel_type == u"worksheet":
+            name = XLSX_ESCAPE_RE.sub(
+                lambda match: unichr(int(match.group(0)[2:6], 16)),
+                unicode(elem.get(u"name")))
+            sheets.append((name, members[target]))
+
+    date_styles = set()
+    if u"xl/styles.xml" in members:
+        styles = ElementTree.parse(open_member(u"xl/styles.xml")).getroot()
+        date_formats = set(XLSX_DATE_FORMAT_IDS)
+        # is_date_format_string only needs the book for its logging
+        format_book = xlrd.book.Book()
+        format_book.verbosity = 0
+        for elem in styles.iter(XLSX_MAIN_NS + u"numFmt"):
+            format_id = int(elem.get(u"numFmtId"))
+            if is_date_format_string(
+                    format_book, unicode(elem.get(u"formatCode"))):
+                date_formats.add(format_id)
             else:
-                rs_dict[col_name]['choices'] = []
-            choice_filter = ''
-            for a in range(1, column):
-                prev_col_name = sheet.cell_value(0, a)
-                if choice_filter != '':
-                    choice_filter += ' and %s=${%s_%s}' %\
-                                     (prev_col_name, prefix, prev_col_name)
-                else:
-                    choice_filter += '%s=${%s_%s}' % \
-                                     (prev_col_name, prefix, prev_col_name)
-            rs_dict[col_name]['choice_filter'] = choice_filter
-        # get data, use new cascade dict structure, data starts on 3 row
-        for row in range(2, sheet.nrows):
-            # go through each header aka column
-            for col_name in rs_dict:
-                column = rs_dict[col_name]['pos']
-                cell_data = xls_value_from_sheet(sheet, row, column)
-                try:
-                    rs_dict[col_name]['data'].index(slugify(cell_data))
-                except ValueError:
-                    rs_dict[col_name]['data'].append(slugify(cell_data))
-                    if 'choices' in rs_dict[col_name]:
-                        l = {constants.NAME: slugify(cell_data), 'label': cell_data}
-                        rs_dict[col_name]['choices'].append(l)
-                data = {
-                    constants.NAME: slugify(cell_data),
-                    'label': cell_data.strip(),
-                    constants.LIST_NAME: col_name
-                }
-                for prev_column in range(1, column):
-                    prev_col_name = sheet.cell_value(0, prev_column)
-                    data[prev_col_name] = slugify(xls_value_from_sheet(
-                        sheet, row, prev_column))
-                result.append(data)
-        # order
-        kl = []
-        for column in range(1, sheet.ncols):
-            col_name = sheet.cell_value(0, column)
-            if 'parent' in rs_dict[col_name]:
-                rs_dict[col_name].pop('parent')
-            if 'pos' in rs_dict[col_name]:
-                rs_dict[col_name].pop('pos')
-            if 'data' in rs_dict[col_name]:
-                rs_dict[col_name].pop('data')
-            kl.append(rs_dict[col_name])
-
-    # create list with no duplicates
-        choices = []
-        for rec in result:
-            c = 0
-            for check in result:
-                if rec == check:
-                    c += 1
-            if c == 1:
-                choices.append(rec)
+                date_formats.discard(format_id)
+        cell_xfs = styles.find(XLSX_MAIN_NS + u"cellXfs")
+        if cell_xfs is not None:
+            for index, elem in enumerate(cell_xfs.findall(XLSX_MAIN_NS + u"xf")):
+                if int(elem.get(u"numFmtId", u"0")) in date_formats:
+                    date_styles.add(index)
+
+    shared_strings = []
+    if u"xl/sharedstrings.xml" in members:
+        for _, elem in ElementTree.iterparse(
+                open_member(u"xl/sharedstrings.xml")):
+            if elem.tag == XLSX_MAIN_NS + u"si":
+                shared_strings.append(_xlsx_rich_text(elem))
+                elem.clear()
+    return sheets, datemode, date_styles, shared_strings
+
+
+def _xlsx_cell(cell, date_styles, shared_strings):
+    """
+    Return the (value, xlrd cell type) pair for a <c> element, or None if
+    the cell holds no value.
+    """
+    cell_type = cell.get(u"t", u"n")
+    value = None
+    if cell_type == u"inlineStr":
+        for child in cell:
+            if child.tag == XLSX_MAIN_NS + u"is":
+                value = _xlsx_rich_text(child)
+            elif child.tag == XLSX_MAIN_NS + u"v":
+                value = child.text
+        return (value, xlrd.XL_CELL_TEXT) if value else None
+    for child in cell:
+        if child.tag == XLSX_MAIN_NS + u"v":
+            value = _xlsx_text(child) if cell_type == u"str" else child.text
+    if cell_type == u"n":
+        if not value:
+            return None
+        if int(cell.get(u"s", u"0")) in date_styles:
+            return float(value), xlrd.XL_CELL_DATE
+        return float(value), xlrd.XL_CELL_NUMBER
+    elif cell_type == u"s":
+        if not value:
+            return None
+        return shared_strings[int(value)], xlrd.XL_CELL_TEXT
+    elif cell_type == u"str":
+        return value, xlrd.XL_CELL_TEXT
+    elif cell_type == u"b":
+        return int(value in (u"1", u"true", u"on")), xlrd.XL_CELL_BOOLEAN
+    elif cell_type == u"e":
+        return (XLSX_ERROR_CODES[value or u"#N/A"], xlrd.XL_CELL_ERROR)
+    raise PyXFormError(u"Unknown cell type %s" % cell_type)
+
+
+def _iter_xlsx_sheet_rows(stream, date_styles, shared_strings):
+    """
+    Yield the raw rows of a worksheet stream one at a time.
+    The sheet is read with iterparse and every row element is discarded
+    once it has been converted, so only one row is held in memory.
+    Rows without any values in between two populated rows are yielded
+    as empty lists so row numbers stay accurate. The stream is closed
+    once the rows are read.
+    """
+    try:
+        for row in _iter_xlsx_stream_rows(stream, date_styles,
+                                          shared_strings):
+            yield row
+    finally:
+        stream.close()
+
+
+def _iter_xlsx_stream_rows(stream, date_styles, shared_strings):
+    sheet_data = None
+    next_row_index = 0
+    row_index = -1
+    for event, elem in ElementTree.iterparse(stream, ("start", "end")):
+        if event == "start":
+            if elem.tag == XLSX_MAIN_NS + u"sheetData":
+                sheet_data = elem
+            continue
+        if elem.tag != XLSX_MAIN_NS + u"row":
+            continue
+        row_number = elem.get(u"r")
+        row_index = int(row_number) - 1 if row_number else row_index + 1
+        row = []
+        column = -1
+        for cell in elem:
+            reference = cell.get(u"r")
+            column = _xlsx_column_index(reference) if reference \
+                else column + 1
+            value = _xlsx_cell(cell, date_styles, shared_strings)
+            if value is None:
+                continue
+            if column > len(row):
+                row.extend([(u"", xlrd.XL_CELL_EMPTY)] * (column - len(row)))
+            if column < len(row):
+                row[column] = value
             else:
-                try:
-                    choices.index(rec)
-                except ValueError:
-                    choices.append(rec)
-        return [{'choices': choices, 'questions': kl}]
+                row.append(value)
+        if sheet_data is not None:
+            sheet_data.clear()
+        else:
+            elem.clear()
+        if not row:
+            continue
+        for _ in range(next_row_index, row_index):
+            yield []
+        next_row_index = row_index + 1
+        yield row
 
-    result = {}
-    for sheet in workbook.sheets():
-        if sheet.name == constants.CASCADING_CHOICES:
-            result[sheet.name] = _xls_to_dict_cascade_sheet(sheet)
+
+def _open_xlsx_member(source, member):
+    """
+    Open the member of the .xlsx zip file source (a path or a cStringIO)
+    through a zip file of its own, which does not share its position in
+    the file with the other members opened.
+    """
+    if not isinstance(source, basestring):
+        source = cStringIO.StringIO(source.getvalue())
+    zip_file = zipfile.ZipFile(source)
+    try:
+        return zip_file.open(member)
+    finally:
+        # the member keeps its own file handle or the cStringIO
+        zip_file.close()
+
+
+def _iter_xlsx_sheets(source, last_sheets=()):
+    """
+    Return an iterator over (sheet_name, raw_rows, datemode) for every
+    worksheet of the .xlsx zip file source, a path or a cStringIO. Each worksheet is read from a
+    stream of its own, so the rows of a sheet can still be read after the
+    next sheets, as xls_to_dict does for the streamed sheets.
+    """
+    with zipfile.ZipFile(source) as zip_file:
+        sheets, datemode, date_styles, shared_strings = \
+            _xlsx_workbook_parts(zip_file)
+    sheets = _last_sheets_last(sheets, lambda sheet: sheet[0], last_sheets)
+    return ((sheet_name, _iter_xlsx_sheet_rows(
+        _open_xlsx_member(source, member), date_styles, shared_strings),
+        datemode) for sheet_name, member in sheets)
+
+
+def iter_xls_to_dict(path_or_file, last_sheets=()):
+    """
+    Streaming counterpart of xls_to_dict.
+    Yields a (sheet_name, header, rows) tuple for each worksheet, where
+    header is the value xls_to_dict stores under "<sheet_name>_header"
+    (None for the cascading choices sheet) and rows is an iterator over
+    the row dictionaries of that sheet. The rows of a sheet have to be
+    consumed before moving on to the next sheet. The sheets are yielded
+    in the order of the workbook, except for those named in last_sheets,
+    which come last in that order.
+    .xlsx files are read row by row straight from the zip archive so
+    memory stays proportional to a row rather than to the workbook;
+    .xls files are loaded one sheet at a time.
+    """
+    if isinstance(path_or_file, basestring):
+        with open(path_or_file, "rb") as xls_file:
+            is_xlsx = xls_file.read(4) == XLSX_MAGIC
+        source = path_or_file
+    else:
+        source = cStringIO.StringIO(path_or_file.read())
+        is_xlsx = source.getvalue()[:4] == XLSX_MAGIC
+    try:
+        if is_xlsx:
+            sheets = _iter_xlsx_sheets(source, last_sheets)
+        elif isinstance(source, basestring):
+            sheets = _iter_xls_sheets(xlrd.open_workbook(
+                filename=source, on_demand=True), last_sheets)
+        else:
+            sheets = _iter_xls_sheets(xlrd.open_workbook(
+                file_contents=source.getvalue(), on_demand=True),
+                last_sheets)
+    except XLRDError, e:
+        raise PyXFormError("Error reading .xls file: %s" % e.message)
+    except (zipfile.BadZipfile, KeyError), e:
+        raise PyXFormError("Error reading .xlsx file: %s" % e)
+
+    for sheet_name, rows, datemode in sheets:
+        if sheet_name == constants.CASCADING_CHOICES:
+            sheet = _RowListSheet(sheet_name, list(rows))
+            yield sheet_name, None, \
+                iter(_xls_to_dict_cascade_sheet(sheet, datemode))
         else:
-            result[sheet.name], result[u"%s_header" % sheet.name] = \
-                xls_to_dict_normal_sheet(sheet)
+            header, row_dicts = _sheet_rows_to_dicts(rows, datemode)
+            yield sheet_name, header, row_dicts
+
+
+def xls_to_dict(path_or_file, streamed_sheets=()):
+    """
+    Return a Python dictionary with a key for each worksheet
+    name. For each sheet there is a list of dictionaries, each
+    dictionary corresponds to a single row in the worksheet. A
+    dictionary has keys taken from the column headers and values
+    equal to the cell value for that row and column.
+    All the keys and leaf elements are unicode text.
+    The sheets named in streamed_sheets are read last, as the iterators
+    over their rows are consumed, instead of being loaded into lists: the
+    rows of each of them have to be consumed in the order of
+    streamed_sheets, after those of the sheet before it.
+    """
+    result = {}
+    for sheet_name, header, rows in iter_xls_to_dict(path_or_file,
+                                                     streamed_sheets):
+        result[sheet_name] = rows if sheet_name in streamed_sheets \
+            else list(rows)
+        if header is not None:
+            result[u"%s_header" % sheet_name] = header
     return result
 
 
+def _xls_to_dict_cascade_sheet(sheet, datemode):
+    result = []
+    rs_dict = {}  # tmp dict to hold entire structure
+
+    def slugify(s):
+        return re.sub(r'\W+', '_', s.strip().lower())
+    prefix = "$PREFIX$"
+    # get col headers and position first, ignore first column
+    for column in range(1, sheet.ncols):
+        col_name = sheet.cell_value(0, column)
+        rs_dict[col_name] = {
+            'pos': column,
+            'data': [],
+            'itemset': col_name,
+            'type': constants.SELECT_ONE,
+            constants.NAME:
+            prefix if (column == sheet.ncols - 1) else u''.join(
+                    [prefix, '_', col_name]),
+            'label': sheet.cell_value(1, column)}
+        if column > 1:
+            rs_dict[col_name]['parent'] = sheet.cell_value(0, column - 1)
+        else:
+            rs_dict[col_name]['choices'] = []
+        choice_filter = ''
+        for a in range(1, column):
+            prev_col_name = sheet.cell_value(0, a)
+            if choice_filter != '':
+                choice_filter += ' and %s=${%s_%s}' %\
+                                 (prev_col_name, prefix, prev_col_name)
+            else:
+                choice_filter += '%s=${%s_%s}' % \
+                                 (prev_col_name, prefix, prev_col_name)
+        rs_dict[col_name]['choice_filter'] = choice_filter
+    # get data, use new cascade dict structure, data starts on 3 row
+    for row in range(2, sheet.nrows):
+        # go through each header aka column
+        for col_name in rs_dict:
+            column = rs_dict[col_name]['pos']
+            cell_data = xls_value_from_sheet(sheet, row, column, datemode)
+            try:
+                rs_dict[col_name]['data'].index(slugify(cell_data))
+            except ValueError:
+                rs_dict[col_name]['data'].append(slugify(cell_data))
+                if 'choices' in rs_dict[col_name]:
+                    l = {constants.NAME: slugify(cell_data), 'label': cell_data}
+                    rs_dict[col_name]['choices'].append(l)
+            data = {
+                constants.NAME: slugify(cell_data),
+                'label': cell_data.strip(),
+                constants.LIST_NAME: col_name
+            }
+            for prev_column in range(1, column):
+                prev_col_name = sheet.cell_value(0, prev_column)
+                data[prev_col_name] = slugify(xls_value_from_sheet(
+                    sheet, row, prev_column, datemode))
+            result.append(data)
+    # order
+    kl = []
+    for column in range(1, sheet.ncols):
+        col_name = sheet.cell_value(0, column)
+        if 'parent' in rs_dict[col_name]:
+            rs_dict[col_name].pop('parent')
+        if 'pos' in rs_dict[col_name]:
+            rs_dict[col_name].pop('pos')
+        if 'data' in rs_dict[col_name]:
+            rs_dict[col_name].pop('data')
+        kl.append(rs_dict[col_name])
+
+# create list with no duplicates
+    choices = []
+    for rec in result:
+        c = 0
+        for check in result:
+            if rec == check:
+                c += 1
+        if c == 1:
+            choices.append(rec)
+        else:
+            try:
+                choices.index(rec)
+            except ValueError:
+                choices.append(rec)
+    return [{'choices': choices, 'questions': kl}]
+
+
 def get_cascading_json(sheet_list, prefix, level):
     return_list = []
     for row in sheet_list:
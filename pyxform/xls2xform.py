@@ -7,20 +7,48 @@ import xls2json
 import builder
 import json
 import argparse
+import codecs
+import multiprocessing
 from utils import sheet_to_csv, has_external_choices
+from cache import make_entry
 import os
 
-def xls2xform_convert(xlsform_path, xform_path):
+XLSFORM_EXTENSIONS = ('.xls', '.xlsx')
+
+def xls2xform_convert(xlsform_path, xform_path, validate=True,
+                      default_language=u"default", cache=None):
+    """
+    Convert the XLSForm at xlsform_path into an XForm written to xform_path
+    (and an itemsets.csv next to it for external choices).
+    Returns the list of warnings.
+    If a pyxform.cache.ConversionCache is given, an unchanged XLSForm is
+    served from it without being converted again.
+    """
+    key = None
+    if cache is not None:
+        with open(xlsform_path, 'rb') as xlsform_file:
+            key = cache.make_key(
+                xlsform_file.read(), validate=validate,
+                default_language=default_language,
+                extension=os.path.splitext(xlsform_path)[1].lower(),
+                # the default id_string, title and root element name
+                name=unicode(xls2json.get_filename(xlsform_path)))
+        entry = cache.get(key)
+        if entry is not None:
+            return _write_cached_entry(entry, xform_path)
+
     warnings = []
 
-    json_survey = xls2json.parse_file_to_json(xlsform_path, warnings=warnings)
+    json_survey = xls2json.parse_file_to_json(
+        xlsform_path, default_language=default_language, warnings=warnings)
     survey = builder.create_survey_element_from_dict(json_survey)
     # Setting validate to false will cause the form not to be processed by
     # ODK Validate.
     # This may be desirable since ODK Validate requires launching a subprocess
     # that runs some java code.
-    survey.print_xform_to_file(xform_path, validate=True, warnings=warnings)
+    survey.print_xform_to_file(xform_path, validate=validate, warnings=warnings)
     output_dir = os.path.split(xform_path)[0]
+    itemsets = None
     if has_external_choices(json_survey):
         itemsets_csv = os.path.join(output_dir, "itemsets.csv")
         choices_exported = sheet_to_csv(xlsform_path, itemsets_csv, "external_choices")
@@ -28,42 +56,204 @@ def xls2xform_convert(xlsform_path, xform_path):
             warnings.append("Could not export itemsets.csv, perhaps the external choices sheet is missing.")
         else:
             print 'External choices csv is located at:', itemsets_csv
+            if key is not None:
+                with open(itemsets_csv, 'rb') as itemsets_file:
+                    itemsets = itemsets_file.read()
+    if key is not None:
+        with codecs.open(xform_path, mode="r", encoding="utf-8") as xform_file:
+            cache.set(key, make_entry(xform_file.read(), warnings, itemsets))
     return warnings
 
 
-if __name__ == '__main__':
+def _write_cached_entry(entry, xform_path):
+    """
+    Write out the files of a cached conversion and return its warnings.
+    """
+    with codecs.open(xform_path, mode="w", encoding="utf-8") as xform_file:
+        xform_file.write(entry[u"xform"])
+    if entry[u"itemsets"] is not None:
+        itemsets_csv = os.path.join(
+            os.path.split(xform_path)[0], "itemsets.csv")
+        with open(itemsets_csv, 'wb') as itemsets_file:
+            itemsets_file.write(entry[u"itemsets"])
+        print 'External choices csv is located at:', itemsets_csv
+    return list(entry[u"warnings"])
+
+
+def conversion_response(xlsform_path, xform_path, validate=True,
+                        default_language=u"default", cache=None):
+    """
+    Convert an XLSForm and report the outcome as a dict with a code, a
+    message and the warnings. Errors are reported rather than raised.
+    """
+    # Store everything in a list just in case the user wants to output
+    # as a JSON encoded string.
+    response = {'code': None, 'message': None, 'warnings': []}
+
+    try:
+        response['warnings'] = xls2xform_convert(
+            xlsform_path, xform_path, validate=validate,
+            default_language=default_language, cache=cache)
+
+        response['code'] = 100
+        response['message'] = "Ok!"
+
+        if response['warnings']:
+            response['code'] = 101
+            response['message'] = 'Ok with warnings.'
+
+    except Exception as e:
+        # Catch the exception by default.
+        response['code'] = 999
+        response['message'] = str(e)
+
+    return response
+
+
+def batch_jobs(source, output_dir):
+    """
+    List the (xlsform_path, xform_path) pairs for converting the XLSForms
+    in the directory source, or listed one per line in the manifest file
+    source (relative to it; blank lines and lines starting with # are
+    skipped). Each XForm is written to a directory of its own in
+    output_dir, together with its itemsets.csv.
+    """
+    if os.path.isdir(source):
+        xlsform_paths = [
+            os.path.join(source, file_name)
+            for file_name in sorted(os.listdir(source))
+            if os.path.splitext(file_name)[1].lower() in XLSFORM_EXTENSIONS
+            and not file_name.startswith(('.', '~$'))]
+    else:
+        manifest_dir = os.path.dirname(source)
+        with codecs.open(source, mode="r", encoding="utf-8") as manifest:
+            xlsform_paths = [
+                os.path.join(manifest_dir, line.strip())
+                for line in manifest
+                if line.strip() and not line.strip().startswith('#')]
+    jobs = []
+    for xlsform_path in xlsform_paths:
+        name = os.path.splitext(os.path.basename(xlsform_path))[0]
+        jobs.append((xlsform_path,
+                     os.path.join(output_dir, name, name + '.xml')))
+    return jobs
+
+
+def _batch_convert(job):
+    xlsform_path, xform_path, validate, cache_dir = job
+    cache = None
+    if cache_dir:
+        from cache import ConversionCache, DirectoryStore
+        cache = ConversionCache(DirectoryStore(cache_dir))
+    # the batch output on stdout is one JSON object per line
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        xform_dir = os.path.dirname(xform_path)
+        if xform_dir and not os.path.isdir(xform_dir):
+            os.makedirs(xform_dir)
+        response = conversion_response(
+            xlsform_path, xform_path, validate=validate, cache=cache)
+    except Exception as e:
+        response = {'code': 999, 'message': str(e), 'warnings': []}
+    finally:
+        sys.stdout = stdout
+    response['path'] = xlsform_path
+    response['output_path'] = xform_path
+    return response
+
+
+def xls2xform_convert_batch(jobs, workers=None, validate=True,
+                            cache_dir=None):
+    """
+    Convert the (xlsform_path, xform_path) pairs in jobs in a pool of worker
+    processes (one per cpu by default). Yields the conversion_response of
+    each form, with its path and output_path, in the order they complete.
+    A form that fails to convert does not stop the others. A form whose
+    xform_path is that of a form before it in jobs (e.g. a/form.xls and
+    b/form.xlsx) is not converted and reported as failed, rather than
+    overwriting the other's output.
+    """
+    output_forms = {}
+    unique_jobs = []
+    for xlsform_path, xform_path in jobs:
+        output = os.path.normcase(os.path.abspath(xform_path))
+        if output in output_forms:
+            yield {'code': 999, 'warnings': [],
+                   'message': "%s would overwrite the XForm of %s." % (
+                       xform_path, output_forms[output]),
+                   'path': xlsform_path, 'output_path': xform_path}
+            continue
+        output_forms[output] = xlsform_path
+        unique_jobs.append((xlsform_path, xform_path))
+    jobs = unique_jobs
+    if not jobs:
+        return
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+    pool = multiprocessing.Pool(workers)
+    try:
+        for response in pool.imap_unordered(
+                _batch_convert,
+                [(xlsform_path, xform_path, validate, cache_dir)
+                 for xlsform_path, xform_path in jobs]):
+            yield response
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main(argv=None):
     parser = argparse.ArgumentParser()
-    parser.add_argument('path_to_XLSForm')
-    parser.add_argument('output_path')
+    parser.add_argument('path_to_XLSForm',
+        help="The XLSForm, or with --batch a directory of XLSForms or a "
+             "manifest file listing them.")
+    parser.add_argument('output_path',
+        help="The XForm, or with --batch the directory the XForms are "
+             "written to.")
     parser.add_argument('--json',
         action='store_true',
         help="Capture everything and report in JSON format.")
-    args = parser.parse_args()
-    
-    if args.json:
-        # Store everything in a list just in case the user wants to output
-        # as a JSON encoded string.
-        response = {'code': None, 'message': None, 'warnings': []}
-
-        try:
-            response['warnings'] = xls2xform_convert(args.path_to_XLSForm, args.output_path)
-
-            response['code'] = 100
-            response['message'] = "Ok!"
+    parser.add_argument('--cache-dir',
+        help="Reuse the output of earlier conversions of the same XLSForm "
+             "stored in this directory.")
+    parser.add_argument('--batch',
+        action='store_true',
+        help="Convert many XLSForms, reporting each in JSON format on a "
+             "line of its own. Exits with status 1 if any of them fails.")
+    parser.add_argument('--workers', type=int, default=None,
+        help="Number of forms to convert at once with --batch "
+             "(default: one per cpu).")
+    args = parser.parse_args(argv)
 
-            if response['warnings']:
-                response['code'] = 101
-                response['message'] = 'Ok with warnings.'
+    if args.batch:
+        failed = False
+        for response in xls2xform_convert_batch(
+                batch_jobs(args.path_to_XLSForm, args.output_path),
+                workers=args.workers, cache_dir=args.cache_dir):
+            failed = failed or response['code'] == 999
+            print json.dumps(response)
+            sys.stdout.flush()
+        sys.exit(1 if failed else 0)
 
-        except Exception as e:
-            # Catch the exception by default.
-            response['code'] = 999
-            response['message'] = str(e)
+    cache = None
+    if args.cache_dir:
+        from cache import ConversionCache, DirectoryStore
+        cache = ConversionCache(DirectoryStore(args.cache_dir))
 
-        print json.dumps(response)
+    if args.json:
+        print json.dumps(conversion_response(
+            args.path_to_XLSForm, args.output_path, cache=cache))
     else:
-        warnings = xls2xform_convert(args.path_to_XLSForm, args.output_path)
+        warnings = xls2xform_convert(
+            args.path_to_XLSForm, args.output_path, cache=cache)
         if len(warnings) > 0: print "Warnings:"
         for w in warnings:
             print w
         print 'Conversion complete!'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Write xml.dom.minidom elements as indented XForm text.
+
+The XForm output used to be produced by minidom's toprettyxml followed by
+three regular expressions undoing the whitespace it adds around text and
+<output/> elements. write_pretty_xml produces the same text in a single
+pass over the tree, straight into a stream.
+
+The regular expressions have effects that are hard to reproduce for some
+unusual trees (text starting with a line break, comments, text next to
+multi-line elements, ...). Those are detected up front and rendered the
+old way, so the output is always identical.
+"""
+import re
+from xml.dom import Node
+from StringIO import StringIO
+
+INDENT = u"  "
+XML_DECLARATION = u'<?xml version="1.0"?>\n'
+
+# what the \s of the fix-up regular expressions matches, minus newlines
+# which can not occur where it is used
+_WHITESPACE = u" \t\r\f\v"
+
+_TEXT_RE = re.compile('>\n\s+([^<>\s].*?)\n\s+</', re.DOTALL)
+_OUTPUT_RE = re.compile('\n.*(<output.*>)\n(  )*')
+_EMPTY_LABEL_RE = re.compile('<label>\s*\n*\s*\n*\s*</label>')
+
+
+def _escape(data):
+    return data.replace(u"&", u"&amp;").replace(u"<", u"&lt;"). \
+        replace(u"\"", u"&quot;").replace(u">", u"&gt;")
+
+
+def _start_tag(element, indent):
+    parts = [indent, u"<", element.tagName]
+    attributes = element._attrs
+    for name in sorted(attributes):
+        parts.append(u" %s=\"" % name)
+        parts.append(_escape(attributes[name].value))
+        parts.append(u"\"")
+    return u"".join(parts)
+
+
+def _is_single_line(element):
+    children = element.childNodes
+    return not children or (
+        len(children) == 1 and children[0].nodeType == Node.TEXT_NODE and
+        u"\n" not in children[0].data)
+
+
+def _is_regular(element, root=True):
+    """
+    Returns False if the element contains anything for which the fix-up
+    regular expressions do something write_pretty_xml does not reproduce.
+    """
+    children = element.childNodes
+    if len(children) == 1 and children[0].nodeType == Node.TEXT_NODE:
+        return not children[0].data.startswith(u"\n")
+    mixed = False
+    for child in children:
+        if child.nodeType == Node.TEXT_NODE:
+            mixed = True
+        elif child.nodeType != Node.ELEMENT_NODE:
+            return False
+    if not mixed:
+        for child in children:
+            if not _is_regular(child, False):
+                return False
+        return True
+    if root:
+        # the text fix-up needs the closing tag to be indented
+        return False
+    previous_text = False
+    for child in children:
+        if child.nodeType == Node.TEXT_NODE:
+            if previous_text or u"\n" in child.data:
+                return False
+            previous_text = True
+        else:
+            if not _is_single_line(child):
+                return False
+            previous_text = False
+    return True
+
+
+def _element_lines(element, indent):
+    """
+    Yield the lines of an element as toprettyxml would write them, with
+    the text of mixed content pulled up the way the text fix-up does.
+    """
+    start_tag = _start_tag(element, indent)
+    children = element.childNodes
+    if not children:
+        yield start_tag + u"/>"
+        return
+    tag = element.tagName
+    if len(children) == 1 and children[0].nodeType == Node.TEXT_NODE:
+        data = _escape(children[0].data)
+        if tag == u"label" and not element._attrs and \
+                not data.strip(_WHITESPACE + u"\n"):
+            data = u""
+        yield u"%s>%s</%s>" % (start_tag, data, tag)
+        return
+    child_indent = indent + INDENT
+    texts = [child.nodeType == Node.TEXT_NODE for child in children]
+    if not any(texts):
+        yield start_tag + u">"
+        for child in children:
+            for line in _element_lines(child, child_indent):
+                yield line
+        yield u"%s</%s>" % (indent, tag)
+        return
+
+    # Mixed content, every child takes a single line.
+    lines = [start_tag + u">"]
+    first_text = None
+    for child, is_text in zip(children, texts):
+        if is_text:
+            data = _escape(child.data)
+            if first_text is None and data.strip(_WHITESPACE):
+                # the text joins the line before it, without indentation
+                # and leading whitespace
+                first_text = len(lines)
+                lines[-1] += data.lstrip(_WHITESPACE)
+            else:
+                lines.append(child_indent + data)
+        else:
+            lines.extend(_element_lines(child, child_indent))
+    if first_text is None:
+        lines.append(u"%s</%s>" % (indent, tag))
+    else:
+        # the closing tag joins the last line, swallowing a trailing line
+        # of whitespace
+        if texts[-1] and len(lines) > first_text and \
+                not lines[-1].strip(_WHITESPACE):
+            lines.pop()
+        lines[-1] += u"</%s>" % tag
+    for line in lines:
+        yield line
+
+
+def _physical_lines(lines):
+    for line in lines:
+        if u"\n" in line:
+            for physical_line in line.split(u"\n"):
+                yield physical_line
+        else:
+            yield line
+
+
+def _is_output_line(line):
+    return u"<output" in line and line.endswith(u">")
+
+
+def _join_output_lines(lines):
+    """
+    Returns the lines with those holding an <output/> element (as the last
+    thing on the line) joined to the previous and the next line, the
+    latter losing its indentation in pairs of spaces, and whether the last
+    line is waiting for the next one.
+    """
+    result = []
+    pending = None
+    join_next = False
+    for line in lines:
+        if pending is None:
+            pending = line
+        elif join_next:
+            stripped = line.lstrip(u" ")
+            spaces = len(line) - len(stripped)
+            pending += line[spaces - spaces % 2:]
+            join_next = False
+        elif _is_output_line(line):
+            pending += line[line.rindex(u"<output"):]
+            join_next = True
+        else:
+            result.append(pending)
+            pending = line
+    if pending is not None:
+        result.append(pending)
+    return result, join_next
+
+
+def write_pretty_xml(element, stream):
+    """
+    Write the XML declaration and the indented element to a (unicode) text
+    stream.
+    """
+    stream.write(XML_DECLARATION)
+    if not _is_regular(element):
+        stream.write(_legacy_pretty_xml(element))
+        return
+    lines, join_next = _join_output_lines(
+        _physical_lines(_element_lines(element, u"")))
+    stream.write(u"\n".join(lines))
+    if not join_next:
+        stream.write(u"\n")
+
+
+def pretty_xml_fragment(elements, indent):
+    """
+    Returns the lines write_pretty_xml writes for elements as children
+    indented by indent, or None if they depend on the lines around them.
+    """
+    for element in elements:
+        if not _is_regular(element, False):
+            return None
+    physical_lines = list(_physical_lines(
+        line for element in elements
+        for line in _element_lines(element, indent)))
+    if not physical_lines or _is_output_line(physical_lines[0]):
+        return None
+    lines, join_next = _join_output_lines(physical_lines)
+    if join_next:
+        return None
+    return u"\n".join(lines)
+
+
+def to_pretty_xml_with_fragments(element, fragments):
+    """
+    Returns what to_pretty_xml returns for element, with each empty
+    placeholder element whose tag is a key of fragments replaced by the
+    text fragments[tag](indent) returns for the placeholder's indentation
+    (see pretty_xml_fragment), or None if that is not possible.
+    """
+    if not _is_regular(element):
+        return None
+    lines, join_next = _join_output_lines(
+        _physical_lines(_element_lines(element, u"")))
+    if join_next:
+        return None
+    result = [XML_DECLARATION]
+    replaced = 0
+    for line in lines:
+        stripped = line.lstrip(u" ")
+        if stripped.startswith(u"<") and stripped.endswith(u"/>") and \
+                stripped[1:-2] in fragments:
+            text = fragments[stripped[1:-2]](line[:len(line) - len(stripped)])
+            if text is None:
+                return None
+            line = text
+            replaced += 1
+        result.append(line)
+        result.append(u"\n")
+    if replaced != len(fragments):
+        return None
+    return u"".join(result)
+
+
+def to_pretty_xml(element):
+    """
+    Returns the XML declaration and the indented element as unicode.
+    """
+    stream = StringIO()
+    write_pretty_xml(element, stream)
+    return stream.getvalue()
+
+
+def _legacy_pretty_xml(element):
+    """
+    The original rendering: toprettyxml and regular expressions removing
+    the whitespace it adds around text.
+    """
+    # Hacky way of pretty printing xml without adding extra white
+    # space to text
+    # TODO: check out pyxml
+    # http://ronrothman.com/public/leftbraned/xml-dom-minidom-toprettyxml-and-silly-whitespace/
+    xml_with_linebreaks = element.toprettyxml(indent='  ')
+    pretty_xml = _TEXT_RE.sub('>\g<1></', xml_with_linebreaks)
+    inline_output = _OUTPUT_RE.sub('\g<1>', pretty_xml)
+    return _EMPTY_LABEL_RE.sub('<label></label>', inline_output)
@@ -10,6 +10,7 @@ setup(
     package_data={
         'pyxform': [
             'odk_validate/ODK_Validate.jar',
+            'odk_validate/ValidateServer.java',
         ],
     },
     url='http://pypi.python.org/pypi/pyxform/',